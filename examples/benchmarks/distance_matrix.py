@@ -0,0 +1,80 @@
+"""Benchmark computing the all to all distance matrix of the REVO
+resampler by calling `image_distance` for each pair versus the
+batched `image_distances` of the distances, and with the
+ParallelDistance process pool.
+
+Random images are used for the unbinding and rebinding distances (a
+ligand of 30 atoms and a binding site of 200 atoms) and the random
+walk distance (in 5 dimensions).
+
+Usage:
+
+    python distance_matrix.py [max_n_walkers] [num_processes]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from wepy.resampling.distances.distance import Distance, ParallelDistance
+from wepy.resampling.distances.receptor import UnbindingDistance, RebindingDistance
+from wepy.resampling.distances.randomwalk import RandomWalkDistance
+
+N_LIG_ATOMS = 30
+N_BS_ATOMS = 200
+
+def time_func(func, *args):
+
+    start = time.time()
+    result = func(*args)
+
+    return time.time() - start, result
+
+if __name__ == "__main__":
+
+    max_n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    num_processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    rng = np.random.RandomState(0)
+
+    n_atoms = N_LIG_ATOMS + N_BS_ATOMS
+    ref_state = {'positions' : rng.random_sample((n_atoms, 3)),
+                 'box_vectors' : 10 * np.eye(3)}
+    lig_idxs = np.arange(N_LIG_ATOMS)
+    bs_idxs = np.arange(N_LIG_ATOMS, n_atoms)
+
+    distances = {'unbinding' : UnbindingDistance(lig_idxs, bs_idxs, ref_state),
+                 'rebinding' : RebindingDistance(lig_idxs, bs_idxs, ref_state),
+                 'randomwalk' : RandomWalkDistance()}
+
+    for name, distance in distances.items():
+
+        parallel_distance = ParallelDistance(distance, num_processes=num_processes)
+
+        n_walkers = 125
+        while n_walkers <= max_n_walkers:
+
+            if name == 'randomwalk':
+                images = [rng.randint(0, 10, size=(1, 5)) for i in range(n_walkers)]
+            else:
+                images = [rng.random_sample((n_atoms, 3)) for i in range(n_walkers)]
+
+            # the reference implementation calling image_distance per pair
+            pair_time, pair_dists = time_func(Distance.all_image_distances, distance, images)
+            batched_time, batched_dists = time_func(distance.all_image_distances, images)
+
+            # start the pool before timing
+            parallel_distance.all_image_distances(images[:num_processes])
+            parallel_time, parallel_dists = time_func(parallel_distance.all_image_distances,
+                                                      images)
+
+            assert np.allclose(pair_dists, batched_dists, rtol=1e-12, atol=0)
+            assert np.allclose(pair_dists, parallel_dists, rtol=1e-12, atol=0)
+
+            print("{:>10} n_walkers {:>5}: pairs {:.4f} s, batched {:.4f} s, "
+                  "parallel batched {:.4f} s".format(
+                      name, n_walkers, pair_time, batched_time, parallel_time))
+
+            n_walkers *= 2
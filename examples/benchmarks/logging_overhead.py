@@ -0,0 +1,84 @@
+"""Benchmark the cost of logging in the simulation loop for the random
+walk system with the REVO resampler and the WorkerMapper.
+
+Logging to a file (the null device) is compared for:
+
+- payloads: payload logging enabled at the DEBUG level, which formats
+  the walkers, results, and distance matrix every cycle like the
+  INFO messages did before they were moved to payload logging
+- info: the default, only small structured events at the INFO level
+- warning: nothing from the simulation loop is logged
+
+Usage:
+
+    python logging_overhead.py [n_walkers] [n_workers] [n_cycles]
+
+"""
+
+import os
+import sys
+import time
+import logging
+
+import numpy as np
+
+from wepy.walker import Walker, WalkerState
+from wepy.runners.randomwalk import RandomWalkRunner
+from wepy.resampling.distances.randomwalk import RandomWalkDistance
+from wepy.resampling.resamplers.revo import REVOResampler
+from wepy.work_mapper.mapper import WorkerMapper
+from wepy.work_mapper.worker import Worker
+from wepy.sim_manager import Manager
+from wepy.sim_logging import enable_payload_logging
+
+def time_cycles(n_walkers, n_workers, n_cycles, dimension=5):
+
+    init_state = WalkerState(positions=np.zeros((1, dimension)), time=0.0)
+    walkers = [Walker(init_state, 1/n_walkers) for i in range(n_walkers)]
+
+    resampler = REVOResampler(distance=RandomWalkDistance(), init_state=init_state,
+                              seed=1, d0=1.0, pmin=1e-12, pmax=0.5)
+
+    sim_manager = Manager(walkers,
+                          runner=RandomWalkRunner(dimension=dimension),
+                          resampler=resampler,
+                          work_mapper=WorkerMapper(num_workers=n_workers,
+                                                   worker_type=Worker))
+
+    sim_manager.init(num_workers=n_workers)
+
+    cycle_times = []
+    for cycle_idx in range(n_cycles):
+        start = time.time()
+        walkers, _ = sim_manager.run_cycle(walkers, 10, cycle_idx)
+        cycle_times.append(time.time() - start)
+
+    sim_manager.cleanup()
+
+    return cycle_times
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    n_cycles = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    print("n_walkers: {}, n_workers: {}".format(n_walkers, n_workers))
+
+    logger = logging.getLogger()
+    handler = logging.FileHandler(os.devnull)
+    logger.addHandler(handler)
+
+    for name, level, payloads in (('payloads', logging.DEBUG, True),
+                                  ('info', logging.INFO, False),
+                                  ('warning', logging.WARNING, False)):
+
+        logger.setLevel(level)
+        enable_payload_logging(payloads)
+
+        cycle_times = time_cycles(n_walkers, n_workers, n_cycles)
+
+        print("{:>8}: mean cycle time {:.4f} s".format(name, np.mean(cycle_times)))
+
+    logger.removeHandler(handler)
+    handler.close()
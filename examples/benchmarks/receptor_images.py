@@ -0,0 +1,95 @@
+"""Benchmark computing the images of the receptor distances for all
+the walkers with the batched `images` versus one state at a time with
+the geomm functions (grouping, centering, and Theobald-QCP
+superposition), as `image` did before.
+
+Random states are used with a ligand of 30 atoms and a binding site
+of 300 atoms in a system of 5000 atoms.
+
+Usage:
+
+    python receptor_images.py [max_n_walkers]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from geomm.grouping import group_pair
+from geomm.superimpose import superimpose
+from geomm.centering import center_around
+
+from wepy.walker import WalkerState
+from wepy.util.util import box_vectors_to_lengths_angles
+from wepy.resampling.distances.receptor import UnbindingDistance
+
+N_ATOMS = 5000
+N_LIG_ATOMS = 30
+N_BS_ATOMS = 300
+
+class PerStateUnbindingDistance(UnbindingDistance):
+    """Unbinding distance computing the image of each state with
+    geomm."""
+
+    def images(self, states):
+
+        images = []
+        for state in states:
+
+            box_lengths, box_angles = box_vectors_to_lengths_angles(state['box_vectors'])
+
+            grouped_positions = group_pair(state['positions'], box_lengths,
+                                           self._bs_idxs, self._lig_idxs)
+            centered_positions = center_around(grouped_positions, self._bs_idxs)
+
+            sup_image, _, _ = superimpose(self.ref_image, centered_positions[self._image_idxs],
+                                          idxs=self._image_bs_idxs)
+
+            images.append(sup_image)
+
+        return images
+
+def random_state(rng, lig_idxs, bs_idxs):
+
+    positions = rng.uniform(0, 10, size=(N_ATOMS, 3))
+    positions[bs_idxs] = 5 + rng.normal(scale=1.0, size=(N_BS_ATOMS, 3))
+    positions[lig_idxs] = rng.uniform(0, 10, size=3) + \
+                          rng.normal(scale=0.5, size=(N_LIG_ATOMS, 3))
+
+    return WalkerState(positions=positions, box_vectors=10 * np.eye(3))
+
+if __name__ == "__main__":
+
+    max_n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    rng = np.random.RandomState(0)
+
+    lig_idxs = np.arange(N_LIG_ATOMS)
+    bs_idxs = np.arange(1000, 1000 + N_BS_ATOMS)
+
+    ref_state = random_state(rng, lig_idxs, bs_idxs)
+
+    distances = {'per state' : PerStateUnbindingDistance(lig_idxs, bs_idxs, ref_state),
+                 'batched' : UnbindingDistance(lig_idxs, bs_idxs, ref_state)}
+
+    n_walkers = 125
+    while n_walkers <= max_n_walkers:
+
+        states = [random_state(rng, lig_idxs, bs_idxs) for i in range(n_walkers)]
+
+        times = {}
+        images = {}
+        for name, distance in distances.items():
+            start = time.time()
+            images[name] = distance.images(states)
+            times[name] = time.time() - start
+
+        max_diff = max(np.abs(image_a - image_b).max()
+                       for image_a, image_b in zip(images['per state'], images['batched']))
+
+        print("n_walkers {:>5}: per state {:.4f} s, batched {:.4f} s, max difference {:.2e}".format(
+            n_walkers, times['per state'], times['batched'], max_diff))
+
+        n_walkers *= 2
@@ -0,0 +1,79 @@
+"""Benchmark the size of the REVO resampler records with the compact
+encodings: lower precision images, only the upper triangle of the
+distance matrix, and only recording them every few cycles.
+
+The walkers are random states of a ligand (30 atoms) around a binding
+site (300 atoms) with the unbinding distance, and the total size of
+the resampler records of all the cycles is reported for each
+encoding.
+
+Usage:
+
+    python revo_record_size.py [n_walkers] [n_cycles]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from wepy.walker import Walker, WalkerState
+from wepy.resampling.distances.receptor import UnbindingDistance
+from wepy.resampling.resamplers.revo import REVOResampler
+
+N_LIG_ATOMS = 30
+N_BS_ATOMS = 300
+
+ENCODINGS = (
+    ('full', {}),
+    ('float32 images', {'record_image_dtype' : np.float32}),
+    ('float16 images', {'record_image_dtype' : np.float16}),
+    ('float32 + triu', {'record_image_dtype' : np.float32,
+                       'record_triu_distance_matrix' : True}),
+    ('float32 + triu, every 10', {'record_image_dtype' : np.float32,
+                                  'record_triu_distance_matrix' : True,
+                                  'record_every' : 10}),
+)
+
+def random_state(rng, bs_positions):
+
+    lig_positions = bs_positions.mean(axis=0) + rng.normal(scale=1.0, size=(N_LIG_ATOMS, 3))
+
+    return WalkerState(positions=np.concatenate([lig_positions, bs_positions]),
+                       box_vectors=10 * np.eye(3))
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    n_cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    rng = np.random.RandomState(0)
+
+    bs_positions = 5 + rng.normal(scale=0.5, size=(N_BS_ATOMS, 3))
+    init_state = random_state(rng, bs_positions)
+    distance = UnbindingDistance(np.arange(N_LIG_ATOMS),
+                                 np.arange(N_LIG_ATOMS, N_LIG_ATOMS + N_BS_ATOMS),
+                                 init_state)
+
+    cycles_walkers = [[Walker(random_state(rng, bs_positions), 1/n_walkers)
+                       for i in range(n_walkers)]
+                      for cycle_idx in range(n_cycles)]
+
+    print("n_walkers: {}, n_cycles: {}".format(n_walkers, n_cycles))
+
+    for name, encoding in ENCODINGS:
+
+        resampler = REVOResampler(distance=distance, init_state=init_state,
+                                  d0=1.0, pmin=1e-12, pmax=0.5, **encoding)
+
+        n_bytes = 0
+        start = time.time()
+        for walkers in cycles_walkers:
+            _, _, resampler_data = resampler.resample(walkers)
+
+            n_bytes += sum(np.asarray(value).nbytes
+                           for record in resampler_data for value in record.values())
+
+        print("{:>26}: {:10.2f} MB of records ({:.4f} s per cycle)".format(
+            name, n_bytes / 1e6, (time.time() - start) / n_cycles))
@@ -0,0 +1,168 @@
+"""Benchmark the spread calculation of the REVOResampler and the whole
+clone/merge decision for increasing numbers of walkers.
+
+The vectorized implementation is compared to the reference double
+loop over the walker pairs which it replaced, checking that both give
+the same spreads and the same decisions.
+
+For the decisions the incremental updates of the spread for each
+move (IncrementalSpread) are compared to recomputing the whole spread
+for every move, with both the loop and the vectorized calculation.
+
+Usage:
+
+    python revo_spread.py [max_n_walkers]
+
+"""
+
+import sys
+import time
+import random as rand
+
+import numpy as np
+
+from wepy.resampling.resamplers.revo import REVOResampler
+from wepy.resampling.distances.distance import Distance
+from wepy.resampling.decisions.clone_merge import MultiCloneMergeDecision
+
+SQUASH = MultiCloneMergeDecision.ENUM.SQUASH.value
+
+class PointDistance(Distance):
+    """Euclidean distance between points."""
+
+    def image(self, state):
+        return state['positions']
+
+    def image_distance(self, image_a, image_b):
+        return np.sqrt(np.sum((image_a - image_b)**2))
+
+class FullSpread(object):
+    """Recomputes the whole spread for every move of the decision."""
+
+    def __init__(self, resampler, walkerwt, amp, distance_matrix):
+
+        self._resampler = resampler
+        self._distance_matrix = distance_matrix
+        self.spread, self.wsum = resampler._calcspread(walkerwt, amp, distance_matrix)
+
+    def update(self, walker_idxs, walkerwt, amp):
+
+        self.spread, self.wsum = self._resampler._calcspread(walkerwt, amp,
+                                                             self._distance_matrix)
+        return self.spread, self.wsum
+
+class FullREVOResampler(REVOResampler):
+    """REVO recomputing the whole spread for every move."""
+
+    def _spread_calculator(self, walkerwt, amp, distance_matrix):
+        return FullSpread(self, walkerwt, amp, distance_matrix)
+
+class LoopREVOResampler(FullREVOResampler):
+    """REVO with the reference spread calculation looping over pairs."""
+
+    def _calcspread(self, walkerwt, amp, distance_matrix):
+
+        n_walkers = len(walkerwt)
+        spread = 0
+        wsum = np.zeros(n_walkers)
+        wtfac = np.zeros(n_walkers)
+
+        for i in range(n_walkers):
+
+            if walkerwt[i] > 0 and amp[i] > 0:
+                if self.weights:
+                    wtfac[i] = np.log(walkerwt[i]/amp[i]) - self.lpmin
+                else:
+                    wtfac[i] = 1
+            else:
+                wtfac[i] = 0
+
+            if wtfac[i] < 0:
+                wtfac[i] = 0
+
+        for i in range(n_walkers - 1):
+            if amp[i] > 0:
+                for j in range(i+1, n_walkers):
+                    if amp[j] > 0:
+                        d = ((distance_matrix[i][j]/self.d0)**self.dpower) * wtfac[i] * wtfac[j]
+                        spread += d * amp[i] * amp[j]
+                        wsum[i] += d * amp[j]
+                        wsum[j] += d * amp[i]
+
+        return spread, wsum
+
+def make_problem(n_walkers, seed=0):
+
+    rng = np.random.RandomState(seed)
+    points = rng.random_sample((n_walkers, 3))
+    distance_matrix = np.sqrt(np.sum((points[:, None, :] - points[None, :, :])**2, axis=-1))
+    weights = rng.random_sample(n_walkers)
+    weights = list(weights / weights.sum())
+
+    return weights, distance_matrix
+
+def run_decision(resampler, weights, distance_matrix, seed=0):
+
+    # the decision picks which walker of a merged pair is kept randomly
+    rand.seed(seed)
+
+    start = time.time()
+    walker_actions, spread = resampler.decide_clone_merge(
+        list(weights), [1 for i in range(len(weights))], distance_matrix)
+
+    return time.time() - start, walker_actions, spread
+
+if __name__ == "__main__":
+
+    max_n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    kwargs = dict(distance=PointDistance(), init_state={'positions' : np.zeros(3)},
+                  d0=0.5, merge_dist=0.5, pmax=0.5)
+
+    resamplers = {'loop' : LoopREVOResampler(**kwargs),
+                  'vectorized' : FullREVOResampler(**kwargs),
+                  'incremental' : REVOResampler(**kwargs)}
+
+    n_walkers = 50
+    while n_walkers <= max_n_walkers:
+
+        weights, distance_matrix = make_problem(n_walkers)
+        amp = [1 for i in range(n_walkers)]
+
+        spread_times = {}
+        spreads = {}
+        for name in ('loop', 'vectorized'):
+            resampler = resamplers[name]
+            start = time.time()
+            spreads[name] = resampler._calcspread(weights, amp, distance_matrix)
+            spread_times[name] = time.time() - start
+
+        assert np.isclose(spreads['loop'][0], spreads['vectorized'][0], rtol=1e-12)
+        assert np.allclose(spreads['loop'][1], spreads['vectorized'][1], rtol=1e-12)
+
+        decision_times = {}
+        decisions = {}
+        for name, resampler in resamplers.items():
+            decision_time, walker_actions, spread = run_decision(
+                resampler, weights, distance_matrix)
+
+            decision_times[name] = decision_time
+            decisions[name] = (walker_actions, spread)
+
+        # the same decisions are made
+        for name in ('vectorized', 'incremental'):
+            assert np.isclose(decisions['loop'][1], decisions[name][1], rtol=1e-10)
+            assert all(a['decision_id'] == b['decision_id'] and
+                       a['target_idxs'] == b['target_idxs']
+                       for a, b in zip(decisions['loop'][0], decisions[name][0]))
+
+        n_merged = sum(1 for action in decisions['loop'][0] if action['decision_id'] == SQUASH)
+
+        print("n_walkers {:>5}: spread loop {:.5f} s, vectorized {:.5f} s; "
+              "decision ({} squashed) loop {:.4f} s, vectorized {:.4f} s, "
+              "incremental {:.4f} s".format(
+                  n_walkers, spread_times['loop'], spread_times['vectorized'],
+                  n_merged, decision_times['loop'], decision_times['vectorized'],
+                  decision_times['incremental']))
+
+        n_walkers *= 2
@@ -0,0 +1,107 @@
+"""Benchmark the ligand-receptor min-min distances of the UnbindingBC
+computed from all of the atom pairs (brute force) versus with the
+periodic k-d tree neighbor search, for rectangular and triclinic
+boxes.
+
+Random states are used with a ligand of 30 atoms and a receptor of
+5000 atoms filling a 10 nm box, with most ligands close to the
+receptor atoms and a few of them (which need the brute force for the
+exact distance) unbound.
+
+Usage:
+
+    python unbinding_min_distance.py [n_walkers] [n_receptor_atoms]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import mdtraj as mdj
+
+from wepy.walker import Walker, WalkerState
+from wepy.util.util import lengths_and_angles_to_box_vectors
+from wepy.util.mdtraj import mdtraj_to_json_topology
+from wepy.boundary_conditions.receptor import UnbindingBC
+
+N_LIG_ATOMS = 30
+CUTOFF_DISTANCE = 1.0
+UNBOUND_FRACTION = 0.1
+
+BOXES = (
+    ('rectangular', np.diag([10.0, 10.0, 10.0])),
+    ('triclinic', np.array(lengths_and_angles_to_box_vectors(10.0, 10.0, 10.0,
+                                                             70.53, 109.47, 70.53))),
+)
+
+def json_topology(n_atoms):
+
+    topology = mdj.Topology()
+    residue = topology.add_residue('X', topology.add_chain())
+    for i in range(n_atoms):
+        topology.add_atom('C', mdj.element.carbon, residue)
+
+    return mdtraj_to_json_topology(topology)
+
+def random_state(rng, n_rec_atoms, box_vectors, unbound):
+
+    # the receptor atoms are spread over the box, and the ligand is
+    # either in a hole left around its center or not
+    rec_positions = np.dot(rng.uniform(0, 1, size=(n_rec_atoms, 3)), box_vectors)
+    lig_center = np.dot(rng.uniform(0, 1, size=3), box_vectors)
+
+    if unbound:
+        hole_radius = 2.0 * CUTOFF_DISTANCE
+    else:
+        hole_radius = 0.5 * CUTOFF_DISTANCE
+
+    rec_positions = rec_positions[np.linalg.norm(rec_positions - lig_center, axis=1) > hole_radius]
+    rec_positions = np.concatenate([rec_positions,
+                                    np.full((n_rec_atoms - rec_positions.shape[0], 3),
+                                            lig_center + 5.0)])
+
+    lig_positions = lig_center + rng.normal(scale=0.1, size=(N_LIG_ATOMS, 3))
+
+    return WalkerState(positions=np.concatenate([lig_positions, rec_positions]),
+                       box_vectors=box_vectors)
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    n_rec_atoms = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    rng = np.random.RandomState(0)
+
+    topology = json_topology(N_LIG_ATOMS + n_rec_atoms)
+    lig_idxs = np.arange(N_LIG_ATOMS)
+    rec_idxs = np.arange(N_LIG_ATOMS, N_LIG_ATOMS + n_rec_atoms)
+
+    print("n_walkers: {}, n_receptor_atoms: {}".format(n_walkers, n_rec_atoms))
+
+    for box_name, box_vectors in BOXES:
+
+        walkers = [Walker(random_state(rng, n_rec_atoms, box_vectors,
+                                       rng.uniform() < UNBOUND_FRACTION),
+                          1 / n_walkers)
+                   for i in range(n_walkers)]
+
+        times = {}
+        min_distances = {}
+        for neighbor_search in (False, True):
+
+            bc = UnbindingBC(initial_state=walkers[0].state,
+                             cutoff_distance=CUTOFF_DISTANCE,
+                             topology=topology,
+                             ligand_idxs=lig_idxs,
+                             receptor_idxs=rec_idxs,
+                             neighbor_search=neighbor_search)
+
+            start = time.time()
+            min_distances[neighbor_search] = bc._calc_min_distances(walkers)
+            times[neighbor_search] = time.time() - start
+
+        print("{:>12}: brute force {:.4f} s, neighbor search {:.4f} s, max difference {:.2e}".format(
+            box_name, times[False], times[True],
+            np.abs(min_distances[False] - min_distances[True]).max()))
@@ -0,0 +1,121 @@
+"""Benchmark assigning walkers to the regions of a deep and wide
+WExplore region tree with the UnbindingDistance.
+
+The assignment computing the image of the state once and the
+distances to all the region images of each level in one batched call
+is compared to the previous assignment which computed the image of
+the state again for the distance to every region.
+
+Usage:
+
+    python wexplore_assign.py [n_walkers] [n_bs_atoms]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from wepy.walker import Walker, WalkerState
+from wepy.resampling.distances.receptor import UnbindingDistance
+from wepy.resampling.resamplers.wexplore import RegionTree
+
+N_LIG_ATOMS = 30
+
+MAX_N_REGIONS = (10, 10, 10, 10)
+MAX_REGION_SIZES = (1.0, 0.6, 0.35, 0.2)
+
+class PerRegionImageRegionTree(RegionTree):
+    """Region tree with the previous assignment, computing the image of
+    the state for every region distance."""
+
+    def assign(self, state, image=None):
+
+        assignment = []
+        dists = []
+        dist_cache = {}
+
+        node = self.ROOT_NODE
+        for level in range(self.n_levels):
+            level_nodes = self.children(node)
+
+            image_dists = []
+            for level_node in level_nodes:
+
+                image_idx = self.nodes[level_node]['image_idx']
+                region_image = self.images[image_idx]
+
+                if image_idx in dist_cache:
+                    dist = dist_cache[image_idx]
+                else:
+                    state_image = self.distance.image(state)
+                    dist = self.distance.image_distance(state_image, region_image)
+                    dist_cache[image_idx] = dist
+
+                image_dists.append(dist)
+
+            level_closest_child_idx = np.argmin(image_dists)
+
+            assignment.append(level_closest_child_idx)
+            dists.append(image_dists[level_closest_child_idx])
+
+            node = level_nodes[level_closest_child_idx]
+
+        return tuple(assignment), tuple(dists)
+
+def random_state(rng, n_bs_atoms, bs_positions):
+
+    # the ligand is somewhere around the binding site
+    lig_positions = bs_positions.mean(axis=0) + rng.normal(scale=1.0, size=(N_LIG_ATOMS, 3))
+
+    return WalkerState(positions=np.concatenate([lig_positions, bs_positions]),
+                       box_vectors=10 * np.eye(3))
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_bs_atoms = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    rng = np.random.RandomState(0)
+
+    bs_positions = 5 + rng.normal(scale=0.5, size=(n_bs_atoms, 3))
+    lig_idxs = np.arange(N_LIG_ATOMS)
+    bs_idxs = np.arange(N_LIG_ATOMS, N_LIG_ATOMS + n_bs_atoms)
+
+    init_state = random_state(rng, n_bs_atoms, bs_positions)
+    distance = UnbindingDistance(lig_idxs, bs_idxs, init_state)
+
+    trees = {name : tree_type(init_state,
+                              max_n_regions=MAX_N_REGIONS,
+                              max_region_sizes=MAX_REGION_SIZES,
+                              distance=distance,
+                              pmin=1e-12, pmax=0.5)
+             for name, tree_type in (('per region', PerRegionImageRegionTree),
+                                     ('once', RegionTree))}
+
+    # grow the trees with the same walkers
+    for cycle_idx in range(5):
+        walkers = [Walker(random_state(rng, n_bs_atoms, bs_positions), 1/n_walkers)
+                   for i in range(n_walkers)]
+
+        for name, tree in trees.items():
+            tree.place_walkers(walkers)
+
+    print("n_walkers: {}, n_atoms: {}, n_regions: {}".format(
+        n_walkers, N_LIG_ATOMS + n_bs_atoms, len(trees['once'].leaf_nodes())))
+
+    states = [random_state(rng, n_bs_atoms, bs_positions) for i in range(n_walkers)]
+
+    assignments = {}
+    for name, tree in trees.items():
+
+        start = time.time()
+        assignments[name] = [tree.assign(state) for state in states]
+        assign_time = time.time() - start
+
+        print("{:>10}: {:.4f} s".format(name, assign_time))
+
+    for (assignment_a, dists_a), (assignment_b, dists_b) in zip(*assignments.values()):
+        assert assignment_a == assignment_b
+        assert np.allclose(dists_a, dists_b, rtol=1e-12)
@@ -0,0 +1,75 @@
+"""Benchmark the bookkeeping of the WExplore region tree, i.e. placing
+walkers in the regions and counting the walkers, squashable walkers
+and possible clones of every region, and balancing the tree.
+
+A cheap distance (the random walk distance in two dimensions) is used
+so that the assignment of the walkers doesn't dominate, and the tree
+is grown to many regions before timing.
+
+Usage:
+
+    python wexplore_bookkeeping.py [n_walkers] [n_cycles]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from wepy.walker import Walker, WalkerState
+from wepy.resampling.distances.randomwalk import RandomWalkDistance
+from wepy.resampling.resamplers.wexplore import RegionTree
+
+MAX_N_REGIONS = (10, 10, 10, 10)
+MAX_REGION_SIZES = (8.0, 4.0, 2.0, 1.0)
+
+def random_walkers(rng, n_walkers):
+
+    weights = rng.uniform(0.5, 1.5, size=n_walkers)
+    weights /= weights.sum()
+
+    return [Walker(WalkerState(positions=rng.uniform(0, 20, size=(1, 2)), time=0.0), weight)
+            for weight in weights]
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    rng = np.random.RandomState(0)
+
+    init_state = WalkerState(positions=np.zeros((1, 2)), time=0.0)
+    tree = RegionTree(init_state,
+                      max_n_regions=MAX_N_REGIONS,
+                      max_region_sizes=MAX_REGION_SIZES,
+                      distance=RandomWalkDistance(),
+                      pmin=1e-12, pmax=0.5)
+
+    tree.max_num_walkers = n_walkers
+    tree.min_num_walkers = n_walkers
+
+    # grow the tree
+    for i in range(5):
+        tree.place_walkers(random_walkers(rng, n_walkers))
+
+    print("n_walkers: {}, n_regions: {}, n_nodes: {}".format(
+        n_walkers, len(tree.leaf_nodes()), len(tree.nodes)))
+
+    place_times = []
+    balance_times = []
+    for cycle_idx in range(n_cycles):
+
+        walkers = random_walkers(rng, n_walkers)
+        images = [tree.distance.image(walker.state) for walker in walkers]
+
+        start = time.time()
+        tree.place_walkers(walkers, images=images)
+        place_times.append(time.time() - start)
+
+        start = time.time()
+        tree.balance_tree()
+        balance_times.append(time.time() - start)
+
+    print("place walkers: {:.4f} s, balance tree: {:.4f} s".format(
+        np.mean(place_times), np.mean(balance_times)))
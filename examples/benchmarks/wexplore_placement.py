@@ -0,0 +1,99 @@
+"""Benchmark placing walkers in a WExplore region tree one at a time
+versus the two phase placement, which first assigns all the walkers
+to the current tree with a process pool and then only assigns again
+the walkers whose assignment could be changed by the new regions.
+
+The placements are checked to be identical.
+
+Usage:
+
+    python wexplore_placement.py [n_walkers] [n_processes] [n_cycles]
+
+"""
+
+import sys
+import time
+import multiprocessing as mp
+
+import numpy as np
+
+from wepy.walker import Walker, WalkerState
+from wepy.resampling.distances.receptor import UnbindingDistance
+from wepy.resampling.resamplers.wexplore import RegionTree
+
+N_LIG_ATOMS = 30
+N_BS_ATOMS = 500
+
+MAX_N_REGIONS = (10, 10, 10, 10)
+MAX_REGION_SIZES = (1.0, 0.6, 0.35, 0.2)
+
+class CountingRegionTree(RegionTree):
+    """Counts the assignments made in this process."""
+
+    n_assigned = 0
+
+    def assign(self, state, image=None):
+        CountingRegionTree.n_assigned += 1
+        return super().assign(state, image=image)
+
+def random_state(rng, bs_positions):
+
+    lig_positions = bs_positions.mean(axis=0) + rng.normal(scale=1.0, size=(N_LIG_ATOMS, 3))
+
+    return WalkerState(positions=np.concatenate([lig_positions, bs_positions]),
+                       box_vectors=10 * np.eye(3))
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    n_cycles = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    rng = np.random.RandomState(0)
+
+    bs_positions = 5 + rng.normal(scale=0.5, size=(N_BS_ATOMS, 3))
+    init_state = random_state(rng, bs_positions)
+    distance = UnbindingDistance(np.arange(N_LIG_ATOMS),
+                                 np.arange(N_LIG_ATOMS, N_LIG_ATOMS + N_BS_ATOMS),
+                                 init_state)
+
+    trees = {name : CountingRegionTree(init_state,
+                                       max_n_regions=MAX_N_REGIONS,
+                                       max_region_sizes=MAX_REGION_SIZES,
+                                       distance=distance,
+                                       pmin=1e-12, pmax=0.5)
+             for name in ('serial', 'two phase')}
+
+    pool = mp.Pool(n_processes)
+
+    print("n_walkers: {}, n_processes: {}".format(n_walkers, n_processes))
+
+    for cycle_idx in range(n_cycles):
+
+        walkers = [Walker(random_state(rng, bs_positions), 1/n_walkers)
+                   for i in range(n_walkers)]
+
+        times = {}
+        n_assigned = {}
+        for name, tree in trees.items():
+
+            CountingRegionTree.n_assigned = 0
+            start = time.time()
+
+            if name == 'serial':
+                tree.place_walkers(walkers)
+            else:
+                tree.place_walkers(walkers, map_func=pool.map, n_chunks=n_processes)
+
+            times[name] = time.time() - start
+            n_assigned[name] = CountingRegionTree.n_assigned
+
+        assert trees['serial'].walker_assignments == trees['two phase'].walker_assignments
+        assert trees['serial'].regions == trees['two phase'].regions
+
+        print("cycle {}: {} regions; serial {:.4f} s; two phase {:.4f} s "
+              "({} walkers assigned again)".format(
+                  cycle_idx, len(trees['serial'].leaf_nodes()),
+                  times['serial'], times['two phase'], n_assigned['two phase']))
+
+    pool.terminate()
@@ -0,0 +1,101 @@
+"""Benchmark assigning walkers to wide WExplore region trees with and
+without the spatial index (VPTree) of the region images.
+
+The ligand of the states only moves as a rigid body (with a little
+noise) around the binding site, as a stand in for the low dimensional
+space real ligand poses explore, where the index can skip most of the
+regions. For states spread evenly in all dimensions a nearest
+neighbor index can't skip much and a linear scan is faster.
+
+Usage:
+
+    python wexplore_region_index.py [n_cycles] [n_bs_atoms]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from wepy.walker import Walker, WalkerState
+from wepy.resampling.distances.receptor import UnbindingDistance
+from wepy.resampling.resamplers.wexplore import RegionTree
+
+N_LIG_ATOMS = 30
+N_WALKERS = 200
+
+# (max_n_regions, max_region_sizes)
+TREE_SHAPES = (((4000,), (0.1,)),
+               ((100, 100), (0.5, 0.1)))
+
+class CountingUnbindingDistance(UnbindingDistance):
+    """Counts the number of distances computed."""
+
+    n_distances = 0
+
+    def image_distances(self, images_a, images_b):
+        CountingUnbindingDistance.n_distances += len(images_a) * len(images_b)
+        return super().image_distances(images_a, images_b)
+
+def random_state(rng, bs_positions, lig_template):
+
+    lig_positions = bs_positions.mean(axis=0) + lig_template + \
+                    rng.uniform(-2, 2, size=3) + \
+                    rng.normal(scale=0.02, size=lig_template.shape)
+
+    return WalkerState(positions=np.concatenate([lig_positions, bs_positions]),
+                       box_vectors=10 * np.eye(3))
+
+if __name__ == "__main__":
+
+    n_cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_bs_atoms = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    rng = np.random.RandomState(0)
+
+    bs_positions = 5 + rng.normal(scale=0.5, size=(n_bs_atoms, 3))
+    lig_template = rng.normal(scale=0.3, size=(N_LIG_ATOMS, 3))
+
+    init_state = random_state(rng, bs_positions, lig_template)
+    distance = CountingUnbindingDistance(np.arange(N_LIG_ATOMS),
+                                         np.arange(N_LIG_ATOMS, N_LIG_ATOMS + n_bs_atoms),
+                                         init_state)
+
+    for max_n_regions, max_region_sizes in TREE_SHAPES:
+
+        trees = {name : RegionTree(init_state,
+                                   max_n_regions=max_n_regions,
+                                   max_region_sizes=max_region_sizes,
+                                   distance=distance,
+                                   pmin=1e-12, pmax=0.5,
+                                   region_index_min_size=region_index_min_size)
+                 for name, region_index_min_size in (('linear', None), ('index', 16))}
+
+        # grow the trees with the same walkers
+        for cycle_idx in range(n_cycles):
+            walkers = [Walker(random_state(rng, bs_positions, lig_template), 1/N_WALKERS)
+                       for i in range(N_WALKERS)]
+
+            for tree in trees.values():
+                tree.place_walkers(walkers)
+
+        print("max_n_regions: {}, n_regions: {}".format(
+            max_n_regions, len(trees['linear'].leaf_nodes())))
+
+        states = [random_state(rng, bs_positions, lig_template) for i in range(N_WALKERS)]
+
+        assignments = {}
+        for name, tree in trees.items():
+
+            CountingUnbindingDistance.n_distances = 0
+            start = time.time()
+            assignments[name] = [tree.assign(state) for state in states]
+            assign_time = time.time() - start
+
+            print("{:>8}: {:.4f} s, {:.1f} distances per walker".format(
+                name, assign_time, CountingUnbindingDistance.n_distances / N_WALKERS))
+
+        for (assignment_a, dists_a), (assignment_b, dists_b) in zip(*assignments.values()):
+            assert assignment_a == assignment_b
+            assert np.allclose(dists_a, dists_b, rtol=1e-12)
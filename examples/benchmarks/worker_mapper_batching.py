@@ -0,0 +1,58 @@
+"""Benchmark the cycle time of the WorkerMapper for many cheap segments
+when sending each walker as its own task versus in batches of walkers.
+
+Usage:
+
+    python worker_mapper_batching.py [n_walkers] [n_workers] [n_cycles]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from wepy.walker import Walker, WalkerState
+from wepy.runners.randomwalk import RandomWalkRunner
+from wepy.work_mapper.mapper import WorkerMapper
+from wepy.work_mapper.worker import Worker
+
+def time_cycles(mapper, runner, walkers, n_workers, n_cycles):
+
+    mapper.init(segment_func=runner.run_segment, num_workers=n_workers)
+
+    cycle_times = []
+    for cycle_idx in range(n_cycles):
+        start = time.time()
+        walkers = mapper.map(walkers, [10 for i in range(len(walkers))])
+        cycle_times.append(time.time() - start)
+
+    mapper.cleanup()
+
+    return cycle_times
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    n_cycles = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    runner = RandomWalkRunner(dimension=5)
+
+    init_state = WalkerState(positions=np.zeros((1, 5)), time=0.0)
+    walkers = [Walker(init_state, 1/n_walkers) for i in range(n_walkers)]
+
+    print("n_walkers: {}, n_workers: {}".format(n_walkers, n_workers))
+
+    for batch_size in (1, 10, 100, 'auto'):
+
+        mapper = WorkerMapper(num_workers=n_workers, worker_type=Worker,
+                              batch_size=batch_size)
+
+        cycle_times = time_cycles(mapper, runner, walkers, n_workers, n_cycles)
+
+        # the first cycle is used to measure the segments when
+        # choosing the batch size automatically
+        print("batch size {:>5}: first cycle time {:.4f} s; "
+              "mean time of the other cycles {:.4f} s".format(
+                  batch_size, cycle_times[0], np.mean(cycle_times[1:])))
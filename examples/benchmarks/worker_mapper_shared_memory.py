@@ -0,0 +1,95 @@
+"""Benchmark sending walkers to and from the WorkerMapper workers
+through the task and result queues (pickling the walker arrays)
+versus through shared memory with the SharedMemoryTransport.
+
+Walkers with large position, velocity, and force arrays are used as a
+stand-in for large systems. The segments only jiggle the positions so
+that most of the cycle time is spent sending the walkers.
+
+Usage:
+
+    python worker_mapper_shared_memory.py [n_walkers] [n_workers] [n_atoms] [n_cycles]
+
+"""
+
+import sys
+import time
+import pickle
+
+import numpy as np
+
+from wepy.walker import Walker, WalkerState
+from wepy.runners.runner import Runner
+from wepy.work_mapper.mapper import WorkerMapper
+from wepy.work_mapper.worker import Worker
+from wepy.work_mapper.transport import SharedMemoryTransport
+
+class JiggleRunner(Runner):
+    """Runner that just jiggles the positions."""
+
+    def run_segment(self, walker, segment_length):
+
+        state_d = walker.state.dict()
+        state_d['positions'] = state_d['positions'] + 0.01
+
+        return Walker(WalkerState(**state_d), walker.weight)
+
+def time_cycles(mapper, walkers, n_workers, n_cycles):
+
+    mapper.init(segment_func=JiggleRunner().run_segment, num_workers=n_workers)
+
+    cycle_times = []
+    for cycle_idx in range(n_cycles):
+        start = time.time()
+        walkers = mapper.map(walkers, [1 for i in range(len(walkers))])
+        cycle_times.append(time.time() - start)
+
+    mapper.cleanup()
+
+    return walkers, cycle_times
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    n_atoms = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+    n_cycles = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+
+    walkers = [Walker(WalkerState(positions=np.random.random((n_atoms, 3)),
+                                  velocities=np.random.random((n_atoms, 3)),
+                                  forces=np.random.random((n_atoms, 3)),
+                                  box_vectors=np.eye(3),
+                                  time=np.array(0.0)),
+                      1/n_walkers)
+               for i in range(n_walkers)]
+
+    walker_bytes = len(pickle.dumps(walkers[0]))
+
+    # the size of what is sent through the queue for a walker instead
+    transport = SharedMemoryTransport(worker_slab_size=walker_bytes,
+                                      task_slab_size=walker_bytes)
+    transport.init(1)
+    descriptor_bytes = len(pickle.dumps(transport.pack_tasks_args([(walkers[0],)])[0][0]))
+    transport.cleanup()
+
+    print("n_walkers: {}, n_workers: {}, n_atoms: {}, walker size: {} bytes, "
+          "descriptor size: {} bytes".format(
+        n_walkers, n_workers, n_atoms, walker_bytes, descriptor_bytes))
+
+    slab_size = 2 * walker_bytes * n_walkers
+
+    final_positions = {}
+    for name, transport in (('queues', None),
+                            ('shared memory', SharedMemoryTransport(worker_slab_size=slab_size,
+                                                                    task_slab_size=slab_size))):
+
+        mapper = WorkerMapper(num_workers=n_workers, worker_type=Worker,
+                              transport=transport)
+
+        new_walkers, cycle_times = time_cycles(mapper, walkers, n_workers, n_cycles)
+
+        final_positions[name] = np.array([walker.state['positions'] for walker in new_walkers])
+
+        print("{:>14}: mean cycle time {:.4f} s".format(name, np.mean(cycle_times)))
+
+    assert np.allclose(final_positions['queues'], final_positions['shared memory'])
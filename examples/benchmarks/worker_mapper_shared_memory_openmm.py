@@ -0,0 +1,111 @@
+"""Benchmark sending OpenMM walkers to and from the WorkerMapper
+workers through the task and result queues (pickling the OpenMM
+States) versus through shared memory with the SharedMemoryTransport.
+
+A system of non-interacting particles is used so that the segments
+(a single step on the Reference platform) take little time and most
+of the cycle time is spent sending the walkers. With the transport
+the OpenMMWalkers are sent as the arrays of their states.
+
+Usage:
+
+    python worker_mapper_shared_memory_openmm.py [n_walkers] [n_workers] [n_atoms] [n_cycles]
+
+"""
+
+import sys
+import time
+import pickle
+
+import numpy as np
+
+import simtk.openmm as omm
+import simtk.openmm.app as omma
+import simtk.unit as unit
+
+from wepy.runners.openmm import OpenMMRunner, OpenMMState, OpenMMWalker, \
+    GET_STATE_KWARG_DEFAULTS
+from wepy.work_mapper.mapper import WorkerMapper
+from wepy.work_mapper.worker import Worker
+from wepy.work_mapper.transport import SharedMemoryTransport
+
+def make_runner_and_state(n_atoms):
+
+    box_vectors = [omm.Vec3(10.0, 0.0, 0.0), omm.Vec3(0.0, 10.0, 0.0), omm.Vec3(0.0, 0.0, 10.0)]
+
+    topology = omma.Topology()
+    residue = topology.addResidue('X', topology.addChain())
+    for i in range(n_atoms):
+        topology.addAtom('Ar', omma.Element.getBySymbol('Ar'), residue)
+    topology.setPeriodicBoxVectors(box_vectors)
+
+    system = omm.System()
+    for i in range(n_atoms):
+        system.addParticle(39.9)
+    system.setDefaultPeriodicBoxVectors(*box_vectors)
+
+    integrator = omm.LangevinIntegrator(300*unit.kelvin, 1/unit.picosecond,
+                                        0.002*unit.picoseconds)
+
+    context = omm.Context(system, omm.VerletIntegrator(0.002),
+                          omm.Platform.getPlatformByName('Reference'))
+    context.setPositions(np.random.uniform(0.0, 10.0, size=(n_atoms, 3)) * unit.nanometer)
+    context.setVelocitiesToTemperature(300*unit.kelvin)
+    sim_state = context.getState(**dict(GET_STATE_KWARG_DEFAULTS))
+
+    runner = OpenMMRunner(system, topology, integrator, platform='Reference')
+
+    return runner, OpenMMState(sim_state)
+
+def time_cycles(mapper, runner, walkers, n_workers, n_cycles):
+
+    mapper.init(segment_func=runner.run_segment, num_workers=n_workers)
+
+    cycle_times = []
+    for cycle_idx in range(n_cycles):
+        start = time.time()
+        walkers = mapper.map(walkers, [1 for i in range(len(walkers))])
+        cycle_times.append(time.time() - start)
+
+    mapper.cleanup()
+
+    return walkers, cycle_times
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    n_atoms = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+    n_cycles = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+
+    runner, init_state = make_runner_and_state(n_atoms)
+
+    walkers = [OpenMMWalker(init_state, 1/n_walkers) for i in range(n_walkers)]
+
+    walker_bytes = len(pickle.dumps(walkers[0]))
+
+    # the size of what is sent through the queue for a walker instead
+    transport = SharedMemoryTransport(worker_slab_size=walker_bytes,
+                                      task_slab_size=walker_bytes)
+    transport.init(1)
+    descriptor_bytes = len(pickle.dumps(transport.pack_tasks_args([(walkers[0],)])[0][0]))
+    transport.cleanup()
+
+    print("n_walkers: {}, n_workers: {}, n_atoms: {}, walker size: {} bytes, "
+          "descriptor size: {} bytes".format(
+        n_walkers, n_workers, n_atoms, walker_bytes, descriptor_bytes))
+
+    slab_size = 2 * walker_bytes * n_walkers
+
+    for name, transport in (('queues', None),
+                            ('shared memory', SharedMemoryTransport(worker_slab_size=slab_size,
+                                                                    task_slab_size=slab_size))):
+
+        mapper = WorkerMapper(num_workers=n_workers, worker_type=Worker,
+                              transport=transport)
+
+        new_walkers, cycle_times = time_cycles(mapper, runner, walkers, n_workers, n_cycles)
+
+        print("{:>14}: mean cycle time {:.4f} s, walker type {}, state type {}".format(
+            name, np.mean(cycle_times),
+            type(new_walkers[0]).__name__, type(new_walkers[0].state).__name__))
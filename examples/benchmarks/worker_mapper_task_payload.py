@@ -0,0 +1,95 @@
+"""Benchmark the size of the tasks sent through the WorkerMapper task
+queue and the resulting cycle latency.
+
+Compares the current behavior, where workers cache the runner's
+`run_segment` function when they are started, to the old behavior of
+pickling the runner into every task.
+
+A runner carrying a large array is used as a stand-in for an
+OpenMMRunner with a large System and Topology.
+
+Usage:
+
+    python worker_mapper_task_payload.py [n_walkers] [n_workers] [payload_mb] [n_cycles]
+
+"""
+
+import sys
+import time
+import pickle
+
+import numpy as np
+
+from wepy.walker import Walker, WalkerState
+from wepy.runners.runner import Runner
+from wepy.work_mapper.mapper import WorkerMapper
+from wepy.work_mapper.worker import Worker, Task
+
+class PayloadRunner(Runner):
+    """Runner that just jiggles positions but carries a large payload."""
+
+    def __init__(self, payload_mb=10):
+
+        n_floats = int(payload_mb * 1e6 / 8)
+        self.payload = np.zeros(n_floats)
+
+    def run_segment(self, walker, segment_length):
+
+        positions = walker.state['positions'] + \
+                    np.random.normal(size=walker.state['positions'].shape)
+
+        return Walker(WalkerState(positions=positions), walker.weight)
+
+class PerTaskRunnerWorkerMapper(WorkerMapper):
+    """WorkerMapper reproducing the old behavior of sending the segment
+    function (and thus the whole runner) with every task."""
+
+    def _make_task(self, *args, **kwargs):
+        return Task(self._func, *args, **kwargs)
+
+def task_bytes(mapper, walker):
+
+    return len(pickle.dumps(mapper._make_task(walker, 1)))
+
+def time_cycles(mapper, runner, walkers, n_workers, n_cycles):
+
+    mapper.init(segment_func=runner.run_segment, num_workers=n_workers)
+
+    cycle_times = []
+    for cycle_idx in range(n_cycles):
+        start = time.time()
+        walkers = mapper.map(walkers, [1 for i in range(len(walkers))])
+        cycle_times.append(time.time() - start)
+
+    mapper.cleanup()
+
+    return cycle_times
+
+if __name__ == "__main__":
+
+    n_walkers = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    payload_mb = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+    n_cycles = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+
+    runner = PayloadRunner(payload_mb=payload_mb)
+
+    init_state = WalkerState(positions=np.zeros((1000, 3)))
+    walkers = [Walker(init_state, 1/n_walkers) for i in range(n_walkers)]
+
+    print("n_walkers: {}, n_workers: {}, runner payload: {} MB".format(
+        n_walkers, n_workers, payload_mb))
+
+    for name, mapper_type in (('per-task runner', PerTaskRunnerWorkerMapper),
+                              ('cached runner', WorkerMapper)):
+
+        mapper = mapper_type(num_workers=n_workers, worker_type=Worker)
+        mapper._func = runner.run_segment
+
+        n_bytes = task_bytes(mapper, walkers[0])
+
+        cycle_times = time_cycles(mapper, runner, walkers, n_workers, n_cycles)
+
+        print("{:>16}: task size {:>12} bytes; queue bytes per cycle {:>14}; "
+              "mean cycle time {:.4f} s".format(name, n_bytes, n_bytes * n_walkers,
+                                                np.mean(cycle_times)))
@@ -9,15 +9,15 @@ import itertools as it
 
 import numpy as np
 
-from geomm.grouping import group_pair
-from geomm.superimpose import superimpose
-from geomm.rmsd import calc_rmsd
 from geomm.centering import center_around
 
-import mdtraj as mdj
-
-from wepy.util.util import box_vectors_to_lengths_angles
+from wepy.util.util import traj_min_pair_distances, traj_group_pair, \
+    traj_center_around, traj_superimpose
 from wepy.util.mdtraj import json_to_mdtraj_topology
+from wepy.util.neighbors import traj_periodic_min_distances
+
+from wepy.util.sampling import AliasSampler
+from wepy.walker import WalkerState
 
 from wepy.boundary_conditions.boundary import BoundaryConditions
 
@@ -40,7 +40,15 @@ class ReceptorBC(BoundaryConditions):
 
     Warping of walkers with multiple initial states will be done
     according to a choice of initial states weighted on their weights,
-    if given.
+    if given. The choice is made with an alias method sampler built
+    once from the weights and a random number generator that can be
+    seeded for reproducibility.
+
+    The initial states are stored once as read-only arrays (for the
+    array values of the states) and warped walkers are given states
+    with views of them. Since these views can't be written to,
+    anything changing the state of a warped walker must copy the
+    arrays first, so the initial states are never changed.
 
     """
 
@@ -88,7 +96,9 @@ class ReceptorBC(BoundaryConditions):
     def __init__(self, initial_states=None,
                  initial_weights=None,
                  ligand_idxs=None,
-                 receptor_idxs=None):
+                 receptor_idxs=None,
+                 worker_progress=False,
+                 seed=None):
         """Base constructor for ReceptorBC.
 
         This should be called immediately in the subclass `__init__`
@@ -115,6 +125,22 @@ class ReceptorBC(BoundaryConditions):
             The indices of the atom positions in the state considered
             the receptor.
 
+        worker_progress : bool, optional
+            If True the simulation manager will have the work mapper
+            compute the progress of each walker right after its
+            segment (i.e. in the worker processes of the
+            WorkerMapper), so only the warping is done in the main
+            process. The boundary conditions are copied into the
+            workers when they are started so the progress must not
+            depend on changes to them during the simulation.
+             (Default value = False)
+
+        seed : int, optional
+            The seed for the random number generator used to choose
+            the initial states of warped walkers. If not given the
+            global numpy random number generator is used.
+             (Default value = None)
+
         Raises
         ------
         AssertionError
@@ -128,9 +154,13 @@ class ReceptorBC(BoundaryConditions):
         assert ligand_idxs is not None, "Must give ligand indices"
         assert receptor_idxs is not None, "Must give binding site indices"
 
-        self._initial_states = initial_states
         self._ligand_idxs = ligand_idxs
         self._receptor_idxs = receptor_idxs
+        self._worker_progress = worker_progress
+
+        # store the initial states as compact arrays
+        self._initial_state_arrays, self._initial_state_values = \
+                                        self._compact_states(initial_states)
 
         # we want to choose initial states conditional on their
         # initial probability if specified. If not specified assume
@@ -140,10 +170,121 @@ class ReceptorBC(BoundaryConditions):
         else:
             self._initial_weights = initial_weights
 
+        # the tables for sampling the initial states are only made
+        # once
+        self._initial_state_sampler = AliasSampler(self._initial_weights)
+
+        # use our own random number generator if a seed is given
+        self._seed = seed
+        if seed is None:
+            self._rng = None
+        else:
+            self._rng = np.random.RandomState(seed)
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+
+        # boundary conditions pickled before the initial states were
+        # stored as arrays
+        if '_initial_states' in state:
+            self._initial_state_arrays, self._initial_state_values = \
+                                self._compact_states(self.__dict__.pop('_initial_states'))
+            self._initial_state_sampler = AliasSampler(self._initial_weights)
+            self._seed = None
+            self._rng = None
+
+        # or before the progress could be computed in the workers
+        if '_worker_progress' not in state:
+            self._worker_progress = False
+
+        # arrays are writeable again after unpickling
+        for state_array in self._initial_state_arrays.values():
+            state_array.flags.writeable = False
+
+    @staticmethod
+    def _compact_states(states):
+        """Store the values of states as arrays.
+
+        The array values which have the same shape and dtype for all
+        of the states are stacked into a single read-only array, the
+        rest (e.g. scalars) are kept for each state.
+
+        Parameters
+        ----------
+        states : list of objects implementing the State interface
+
+        Returns
+        -------
+        state_arrays : dict of str : numpy.ndarray
+            The stacked arrays of the values of all the states.
+
+        state_values : list of dict of str : value
+            The other values of each state.
+
+        """
+
+        states_d = [state.dict() for state in states]
+
+        state_arrays = {}
+        for key, value in states_d[0].items():
+
+            values = [state_d.get(key, None) for state_d in states_d]
+
+            if not all(isinstance(value, np.ndarray) and value.dtype != object and
+                       value.shape == values[0].shape and value.dtype == values[0].dtype
+                       for value in values):
+                continue
+
+            state_array = np.stack(values)
+            state_array.flags.writeable = False
+
+            state_arrays[key] = state_array
+
+        state_values = [{key : value for key, value in state_d.items()
+                         if key not in state_arrays}
+                        for state_d in states_d]
+
+        return state_arrays, state_values
+
+    def _initial_state(self, state_idx):
+        """Make a state for an initial state from the compact arrays.
+
+        The array values are read-only views of the stored arrays.
+
+        Parameters
+        ----------
+        state_idx : int
+
+        Returns
+        -------
+        state : WalkerState
+
+        """
+
+        state_d = dict(self._initial_state_values[state_idx])
+        for key, state_array in self._initial_state_arrays.items():
+            state_d[key] = state_array[state_idx]
+
+        return WalkerState(**state_d)
+
+    @property
+    def worker_progress(self):
+        """Whether the progress of the walkers should be computed by the
+        work mapper right after their segments."""
+        return self._worker_progress
+
     @property
     def initial_states(self):
         """The possible initial states warped walkers may assume."""
-        return self._initial_states
+        return [self._initial_state(state_idx)
+                for state_idx in range(len(self._initial_state_values))]
+
+    @property
+    def seed(self):
+        """The seed of the random number generator for choosing the
+        initial states, None if the global one is used."""
+        return self._seed
 
     @property
     def initial_weights(self):
@@ -185,6 +326,52 @@ class ReceptorBC(BoundaryConditions):
 
         raise NotImplementedError
 
+    def progress(self, walker):
+        """Decide if a single walker should be warped and compute its
+        progress record.
+
+        This allows the progress of walkers to be computed
+        independently of each other (e.g. as soon as each walker's
+        segment finishes) and given to `warp_walkers` afterwards.
+
+        Parameters
+        ----------
+        walker : object implementing the Walker interface
+
+        Returns
+        -------
+        to_warp : bool
+           Whether the walker should be warped or not.
+
+        progress_data : dict of str : value
+           Dictionary of the progress record group fields
+           for this walker alone.
+
+        """
+
+        return self._progress(walker)
+
+    def _progresses(self, walkers):
+        """Decide if walkers should be warped and compute their progress
+        records.
+
+        By default this just calls `_progress` for each walker, but
+        subclasses can override it to compute the progress of all the
+        walkers at once.
+
+        Parameters
+        ----------
+        walkers : list of objects implementing the Walker interface
+
+        Returns
+        -------
+        walker_progresses : list of tuple of (bool, dict of str : value)
+           The results of `_progress` for each walker.
+
+        """
+
+        return [self._progress(walker) for walker in walkers]
+
     def _warp(self, walker):
         """Perform the warping of a walker.
 
@@ -212,10 +399,12 @@ class ReceptorBC(BoundaryConditions):
 
 
         # choose a state randomly from the set of initial states
-        target_idx = np.random.choice(range(len(self.initial_states)), 1,
-                                  p=self.initial_weights/np.sum(self.initial_weights))[0]
+        target_idx = self._initial_state_sampler.sample(random_state=self._rng)
 
-        warped_state = self.initial_states[target_idx]
+        # this is a plain WalkerState of the stored arrays, whatever
+        # the type of the initial state was (e.g. an OpenMMState), so
+        # the walker type must accept those (e.g. the OpenMMWalker)
+        warped_state = self._initial_state(target_idx)
 
         # set the initial state into a new walker object with the same weight
         warped_walker = type(walker)(state=warped_state, weight=walker.weight)
@@ -255,7 +444,7 @@ class ReceptorBC(BoundaryConditions):
         return []
 
 
-    def warp_walkers(self, walkers, cycle):
+    def warp_walkers(self, walkers, cycle, walker_progresses=None):
         """Test the progress of all the walkers, warp if required, and update
         the boundary conditions.
 
@@ -267,6 +456,10 @@ class ReceptorBC(BoundaryConditions):
         cycle : int
             The index of the cycle.
 
+        walker_progresses : list of tuple, optional
+            The already computed results of the `progress` method for
+            each walker. If not given they are computed here.
+
         Returns
         -------
 
@@ -294,10 +487,13 @@ class ReceptorBC(BoundaryConditions):
         # continual, one record per call
         progress_data = defaultdict(list)
 
+        # check if they are unbound, also gives the progress records
+        if walker_progresses is None:
+            walker_progresses = self._progresses(walkers)
+
         for walker_idx, walker in enumerate(walkers):
 
-            # check if it is unbound, also gives the progress record
-            to_warp, walker_progress_data = self._progress(walker)
+            to_warp, walker_progress_data = walker_progresses[walker_idx]
 
             # add that to the progress data record
             for key, value in walker_progress_data.items():
@@ -447,7 +643,9 @@ class RebindingBC(ReceptorBC):
                  initial_states=None,
                  initial_weights=None,
                  ligand_idxs=None,
-                 binding_site_idxs=None):
+                 binding_site_idxs=None,
+                 worker_progress=False,
+                 seed=None):
         """Constructor for RebindingBC.
 
         Arguments
@@ -477,6 +675,16 @@ class RebindingBC(ReceptorBC):
             The indices of the atom positions in the state considered
             the binding site.
 
+        worker_progress : bool, optional
+            If True the progress of each walker is computed by the
+            work mapper right after its segment, see ReceptorBC.
+             (Default value = False)
+
+        seed : int, optional
+            The seed for the random number generator used to choose
+            the initial states of warped walkers.
+             (Default value = None)
+
         Raises
         ------
         AssertionError
@@ -489,7 +697,9 @@ class RebindingBC(ReceptorBC):
         super().__init__(initial_states=initial_states,
                          initial_weights=initial_weights,
                          ligand_idxs=ligand_idxs,
-                         receptor_idxs=binding_site_idxs
+                         receptor_idxs=binding_site_idxs,
+                         worker_progress=worker_progress,
+                         seed=seed
                          )
 
         # test inputs
@@ -520,6 +730,60 @@ class RebindingBC(ReceptorBC):
 
         return self._receptor_idxs
 
+    def _native_rmsds(self, walkers):
+        """Compute the RMSDs of the ligands of many walkers to the native
+        state at once, after superimposing their binding sites.
+
+        Parameters
+        ----------
+        walkers : list of objects implementing the Walker interface
+
+        Returns
+        -------
+        native_rmsds : numpy.ndarray of float of shape (n_walkers,)
+
+        """
+
+        bs_idxs = np.asarray(self.binding_site_idxs)
+        lig_idxs = np.asarray(self.ligand_idxs)
+
+        # only the positions of the binding site and the ligand are
+        # needed, so we stack just these for all of the walkers
+        rmsd_idxs = np.concatenate([bs_idxs, lig_idxs])
+        rmsd_bs_idxs = np.arange(bs_idxs.shape[0])
+        rmsd_lig_idxs = np.arange(bs_idxs.shape[0], rmsd_idxs.shape[0])
+
+        positions = np.stack([np.asarray(walker.state['positions'])[rmsd_idxs]
+                              for walker in walkers])
+
+        # get the box lengths from the vectors
+        box_lengths = np.linalg.norm(np.stack([np.asarray(walker.state['box_vectors'])
+                                               for walker in walkers]),
+                                     axis=2)
+
+        # first recenter the ligand and the receptor in the walkers
+        grouped_positions = traj_group_pair(positions, box_lengths,
+                                            rmsd_bs_idxs, rmsd_lig_idxs)
+
+        # center the positions around the center of the binding site
+        centered_positions = traj_center_around(grouped_positions, rmsd_bs_idxs)
+
+        # superimpose the walker state positions over the native state
+        # matching the binding site indices only
+        native_positions = np.asarray(self.native_state['positions'])[rmsd_idxs]
+        sup_positions, _, _ = traj_superimpose(native_positions, centered_positions,
+                                               idxs=rmsd_bs_idxs)
+
+        # calculate the rmsd of the walker ligands (superimposed
+        # according to the binding sites) to the native state ligand
+        lig_diffs = sup_positions[:, rmsd_lig_idxs] - native_positions[rmsd_lig_idxs]
+
+        # sum each walker's contiguous row so the result doesn't
+        # depend on how many walkers are computed together
+        sq_dists = (lig_diffs**2).reshape((lig_diffs.shape[0], -1)).sum(axis=1)
+
+        return np.sqrt(sq_dists / rmsd_lig_idxs.shape[0])
+
     def _progress(self, walker):
         """Calculate if the walker has bound and provide progress record.
 
@@ -538,32 +802,33 @@ class RebindingBC(ReceptorBC):
 
         """
 
-        # first recenter the ligand and the receptor in the walker
-        box_lengths, box_angles = box_vectors_to_lengths_angles(walker.state['box_vectors'])
-        grouped_walker_pos = group_pair(walker.state['positions'], box_lengths,
-                                     self.binding_site_idxs, self.ligand_idxs)
+        return self._progresses([walker])[0]
 
-        # center the positions around the center of the binding site
-        centered_walker_pos = center_around(grouped_walker_pos, self.binding_site_idxs)
+    def _progresses(self, walkers):
+        """Calculate if walkers have bound and provide their progress
+        records, with the RMSDs of all the walkers computed at once.
 
-        # superimpose the walker state positions over the native state
-        # matching the binding site indices only
-        sup_walker_pos, _, _ = superimpose(self.native_state['positions'], centered_walker_pos,
-                                 idxs=self.binding_site_idxs)
+        Parameters
+        ----------
+        walkers : list of objects implementing the Walker interface
 
-        # calculate the rmsd of the walker ligand (superimposed
-        # according to the binding sites) to the native state ligand
-        native_rmsd = calc_rmsd(self.native_state['positions'], sup_walker_pos,
-                                idxs=self.ligand_idxs)
+        Returns
+        -------
+        walker_progresses : list of tuple of (bool, dict of str : value)
+           Whether each walker is bound (warped) or not and its
+           progress record.
+
+        """
 
-        # test to see if the ligand is re-bound
-        rebound = False
-        if native_rmsd <= self.cutoff_rmsd:
-            rebound = True
+        if len(walkers) == 0:
+            return []
 
-        progress_data = {'native_rmsd' : native_rmsd}
+        native_rmsds = self._native_rmsds(walkers)
 
-        return rebound, progress_data
+        # test to see if the ligands are re-bound
+        return [(bool(native_rmsd <= self.cutoff_rmsd),
+                 {'native_rmsd' : native_rmsd})
+                for native_rmsd in native_rmsds]
 
 
 class UnbindingBC(ReceptorBC):
@@ -614,7 +879,9 @@ class UnbindingBC(ReceptorBC):
                  cutoff_distance=1.0,
                  topology=None,
                  ligand_idxs=None,
-                 receptor_idxs=None):
+                 receptor_idxs=None,
+                 neighbor_search=False,
+                 worker_progress=False):
         """Constructor for UnbindingBC class.
 
         All the key-word arguments are necessary.
@@ -642,6 +909,19 @@ class UnbindingBC(ReceptorBC):
            Indices of the atoms in the topology that correspond to the
            receptor for the ligand.
 
+        neighbor_search : bool
+           If True the min-min distances are found with a periodic
+           k-d tree neighbor search over the receptor atoms, only
+           computing the ligand-receptor distances below the cutoff
+           distance. The exact distance for walkers which are
+           unbound is still computed from all of the pairs.
+           (Default = False)
+
+        worker_progress : bool
+           If True the progress of each walker is computed by the
+           work mapper right after its segment, see ReceptorBC.
+           (Default = False)
+
         Raises
         ------
         AssertionError
@@ -668,7 +948,8 @@ class UnbindingBC(ReceptorBC):
         # wrap the single initial state to a list.
         super().__init__(initial_states=[initial_state],
                          ligand_idxs=ligand_idxs,
-                         receptor_idxs=receptor_idxs)
+                         receptor_idxs=receptor_idxs,
+                         worker_progress=worker_progress)
 
         # test input
         assert topology is not None, "Must give a reference topology"
@@ -676,6 +957,33 @@ class UnbindingBC(ReceptorBC):
 
         self._cutoff_distance = cutoff_distance
         self._topology = topology
+        self._neighbor_search = neighbor_search
+
+        # parse the topology only once
+        self._mdj_top = json_to_mdtraj_topology(self._topology)
+
+        # the indices of all the ligand-receptor atom pairs to compute
+        # the distances for
+        self._atom_pairs = np.array(list(it.product(self.ligand_idxs,
+                                                    self.receptor_idxs)),
+                                    dtype=int).reshape((-1, 2))
+
+    def __setstate__(self, state):
+
+        super().__setstate__(state)
+
+        # boundary conditions pickled before the topology and atom
+        # pairs were cached or the neighbor search was added
+        if '_mdj_top' not in state:
+            self._mdj_top = json_to_mdtraj_topology(self._topology)
+
+        if '_atom_pairs' not in state:
+            self._atom_pairs = np.array(list(it.product(self.ligand_idxs,
+                                                        self.receptor_idxs)),
+                                        dtype=int).reshape((-1, 2))
+
+        if '_neighbor_search' not in state:
+            self._neighbor_search = False
 
     @property
     def cutoff_distance(self):
@@ -687,6 +995,52 @@ class UnbindingBC(ReceptorBC):
         """JSON string topology of the system."""
         return self._topology
 
+    @property
+    def mdtraj_topology(self):
+        """The mdtraj topology of the system, parsed from the JSON string."""
+        return self._mdj_top
+
+    def _calc_min_distances(self, walkers):
+        """Min-min distances for many walkers at once.
+
+        Parameters
+        ----------
+        walkers : list of objects implementing the Walker interface
+
+        Returns
+        -------
+        min_distances : numpy.ndarray of float of shape (n_walkers,)
+
+        """
+
+        if len(walkers) == 0:
+            return np.zeros((0,))
+
+        traj_positions = np.stack([walker.state['positions'] for walker in walkers])
+        traj_box_vectors = np.stack([walker.state['box_vectors'] for walker in walkers])
+
+        if not self._neighbor_search:
+
+            # calculate the distances through periodic boundary conditions
+            # and get the minimum distance for each walker
+            return traj_min_pair_distances(traj_positions, traj_box_vectors, self._atom_pairs)
+
+        # only search for distances less than the cutoff, which is
+        # enough to know if the walkers are unbound
+        min_distances = traj_periodic_min_distances(traj_positions, traj_box_vectors,
+                                                    self.ligand_idxs, self.receptor_idxs,
+                                                    self._cutoff_distance)
+
+        # the unbound walkers need all the distances for the exact
+        # minimum of the progress records
+        unbound_idxs = np.flatnonzero(np.isinf(min_distances))
+        if len(unbound_idxs) > 0:
+            min_distances[unbound_idxs] = traj_min_pair_distances(traj_positions[unbound_idxs],
+                                                                  traj_box_vectors[unbound_idxs],
+                                                                  self._atom_pairs)
+
+        return min_distances
+
     def _calc_min_distance(self, walker):
         """Min-min distance for a walker.
 
@@ -700,24 +1054,7 @@ class UnbindingBC(ReceptorBC):
 
         """
 
-        cell_lengths, cell_angles = box_vectors_to_lengths_angles(walker.state['box_vectors'])
-
-        # convert the json topology to an mdtraj one
-        mdj_top = json_to_mdtraj_topology(self._topology)
-
-        # make a traj out of it so we can calculate distances through
-        # the periodic boundary conditions
-        walker_traj = mdj.Trajectory(walker.state['positions'],
-                                     topology=mdj_top,
-                                     unitcell_lengths=cell_lengths,
-                                     unitcell_angles=cell_angles)
-
-        # calculate the distances through periodic boundary conditions
-        # and get hte minimum distance
-        min_distance = np.min(mdj.compute_distances(walker_traj,
-                                                    it.product(self.ligand_idxs,
-                                                               self.receptor_idxs)))
-        return min_distance
+        return self._calc_min_distances([walker])[0]
 
     def _progress(self, walker):
         """Calculate whether a walker has unbound and also provide a
@@ -749,6 +1086,29 @@ class UnbindingBC(ReceptorBC):
 
         return unbound, progress_data
 
+    def _progresses(self, walkers):
+        """Calculate whether walkers have unbound and their progress
+        records, with the min-min distances of all the walkers computed
+        at once.
+
+        Parameters
+        ----------
+        walkers : list of objects implementing the Walker interface
+
+        Returns
+        -------
+        walker_progresses : list of tuple of (bool, dict of str : value)
+           Whether each walker is unbound (warped) or not and its
+           progress record.
+
+        """
+
+        min_distances = self._calc_min_distances(walkers)
+
+        return [(bool(min_distance >= self._cutoff_distance),
+                 {'min_distances' : min_distance})
+                for min_distance in min_distances]
+
     def _update_bc(self, new_walkers, warp_data, progress_data, cycle):
         """Perform an update to the boundary conditions.
 
@@ -387,7 +387,8 @@ it is a fairly straightforward task from a developers perspective.
 """
 
 import os.path as osp
-from collections import Sequence, namedtuple, defaultdict, Counter
+from collections import namedtuple, defaultdict, Counter
+from collections.abc import Sequence
 import itertools as it
 import json
 from warnings import warn
@@ -401,7 +402,7 @@ import networkx as nx
 from wepy.analysis.parents import resampling_panel
 from wepy.util.mdtraj import mdtraj_to_json_topology, json_to_mdtraj_topology, \
                              traj_fields_to_mdtraj
-from wepy.util.util import traj_box_vectors_to_lengths_angles
+from wepy.util.util import traj_box_vectors_to_lengths_angles, expand_triu_distance_matrix
 from wepy.util.json_top import json_top_subset, json_top_atom_count
 
 # optional dependencies
@@ -4482,7 +4483,77 @@ class WepyHDF5(object):
 
         """
 
-        return self.run_contig_records(run_idxs, RESAMPLER)
+        records = self.run_contig_records(run_idxs, RESAMPLER)
+
+        return self._expand_resampler_records(run_idxs, records)
+
+    def _expand_resampler_records(self, run_idxs, records):
+        """Expand the compact encodings of the images and distance
+        matrices of resampler records.
+
+        Distance matrices which were recorded as only their upper
+        triangle are expanded to the full flattened matrix, and
+        images recorded with a lower precision float dtype
+        (e.g. float32 or float16) are returned as float64. This is
+        for both the 'images' of the REVOResampler records and the
+        'image' of the new regions in the WExploreResampler records.
+
+        Parameters
+        ----------
+        run_idxs : list of int
+            The run indices that form a contig.
+
+        records : list of namedtuple objects
+            The resampler records of the contig.
+
+        Returns
+        -------
+        records : list of namedtuple objects
+
+        """
+
+        if len(records) == 0:
+            return records
+
+        record_fields = records[0]._fields
+
+        # the number of walkers is needed to tell if a distance
+        # matrix is just its upper triangle
+        expand_distance_matrix = False
+        if 'distance_matrix' in record_fields:
+
+            if all('n_walkers' in self.records_grp(run_idx, RESAMPLER)
+                   for run_idx in run_idxs):
+
+                expand_distance_matrix = True
+                n_walkers = np.concatenate([self.records_grp(run_idx, RESAMPLER)['n_walkers'][:, 0]
+                                            for run_idx in run_idxs])
+
+        expanded_records = []
+        for record_idx, record in enumerate(records):
+
+            expanded_fields = {}
+
+            # empty distance matrices weren't recorded for that cycle
+            if expand_distance_matrix:
+                n = n_walkers[record_idx]
+                n_values = len(record.distance_matrix)
+                if n_values > 0 and n_values != n * n and n_values == n * (n - 1) // 2:
+                    expanded_fields['distance_matrix'] = tuple(
+                        np.ravel(expand_triu_distance_matrix(record.distance_matrix, n)))
+
+            for image_field in ('images', 'image'):
+                if image_field in record_fields:
+                    images = np.asarray(getattr(record, image_field))
+                    if images.dtype.kind == 'f' and images.dtype.itemsize < 8:
+                        expanded_fields[image_field] = tuple(images.astype(np.float64))
+
+            if len(expanded_fields) > 0:
+                record = record._replace(**expanded_fields)
+
+            expanded_records.append(record)
+
+        return expanded_records
 
     def resampler_records_dataframe(self, run_idxs):
         """Get the records for this record group for a contig of runs in the
@@ -0,0 +1,422 @@
+"""Profiling of where the time is spent in each cycle of a simulation.
+
+The CycleProfiler is given to the simulation manager, which gives it
+to the components that support profiling (i.e. have a `profiler`
+attribute) when the simulation is initialized. The manager and the
+components then add the times of the phases of each cycle they run
+to the profiler, which are accumulated into a single record for each
+cycle. When a cycle is finished (after its reporting) the record is
+given to each of the collectors of the profiler.
+
+A record is a dictionary with the 'cycle_idx' and the times in
+seconds for each phase by name. The phases recorded by the wepy
+components are:
+
+Manager:
+
+- runner : running the segments of all walkers
+- boundary_conditions : applying the boundary conditions
+- resampling : resampling the walkers
+- reporting : running all the reporters
+- reporter/<idx>-<class name> : running each reporter
+
+WorkerMapper:
+
+- mapper/enqueue : making the tasks and putting them on the queue
+- mapper/collect : handling the results from the workers
+- mapper/result_latency : total time between the workers finishing
+  tasks and their results being received (serialization and queue
+  latency)
+- mapper/worker_idle : total time the workers were idle during the
+  mapping
+- segment/<split name> : total of the split times reported by the
+  segments (e.g. 'setup' and 'steps' for the OpenMMRunner)
+
+Resamplers:
+
+- resampler/distance_matrix : computing the distance matrix (REVO)
+- resampler/assign : assigning walkers to regions (WExplore)
+- resampler/decision : deciding the cloning and merging
+
+Components only check whether a profiler was given before timing
+anything so the overhead is negligible when there is no profiler.
+
+"""
+
+import threading
+import time
+import csv
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import h5py
+
+CYCLE_IDX = 'cycle_idx'
+"""The key of the cycle index in the profile records."""
+
+class CycleProfiler(object):
+    """Accumulates the times of the phases of each cycle and gives the
+    records for finished cycles to its collectors."""
+
+    def __init__(self, collectors=None):
+        """Constructor for CycleProfiler.
+
+        Parameters
+        ----------
+        collectors : list of objects implementing the ProfileCollector interface, optional
+            The collectors the records are given to.
+
+        """
+
+        if collectors is None:
+            self._collectors = []
+        else:
+            self._collectors = collectors
+
+        self._current_cycle_idx = None
+
+        # the records of cycles that are not finished yet, cycles may
+        # be reported on a different thread (see the pipelined
+        # reporting of the Manager) so access is locked
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+
+        # copies of profilers (e.g. in snapshots of the components
+        # they were given to) don't collect anything
+        state = self.__dict__.copy()
+        state['_collectors'] = []
+        state['_records'] = {}
+        del state['_lock']
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def collectors(self):
+        """The collectors the records are given to."""
+        return self._collectors
+
+    @property
+    def current_cycle_idx(self):
+        """The index of the cycle times are added to by default."""
+        return self._current_cycle_idx
+
+    def init(self):
+        """Runtime initialization of the collectors, e.g. opening files."""
+
+        for collector in self.collectors:
+            collector.init()
+
+    def cleanup(self):
+        """Runtime cleanup of the collectors, e.g. closing files."""
+
+        for collector in self.collectors:
+            collector.cleanup()
+
+    def start_cycle(self, cycle_idx):
+        """Start the record for a cycle and make it the current cycle.
+
+        Parameters
+        ----------
+        cycle_idx : int
+
+        """
+
+        with self._lock:
+            self._records[cycle_idx] = {CYCLE_IDX : cycle_idx}
+            self._current_cycle_idx = cycle_idx
+
+    def add_time(self, phase, seconds, cycle_idx=None):
+        """Add time to a phase of a cycle.
+
+        Times added for the same phase more than once in a cycle are
+        summed.
+
+        Parameters
+        ----------
+        phase : str
+            The name of the phase.
+
+        seconds : float
+
+        cycle_idx : int, optional
+            The cycle to add the time to, if not given the current
+            cycle.
+
+        """
+
+        if cycle_idx is None:
+            cycle_idx = self._current_cycle_idx
+
+        with self._lock:
+            record = self._records.setdefault(cycle_idx, {CYCLE_IDX : cycle_idx})
+            record[phase] = record.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, phase, cycle_idx=None):
+        """Context manager which adds the time spent in it to a phase.
+
+        Parameters
+        ----------
+        phase : str
+            The name of the phase.
+
+        cycle_idx : int, optional
+            The cycle to add the time to, if not given the current
+            cycle.
+
+        """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start, cycle_idx=cycle_idx)
+
+    def finish_cycle(self, cycle_idx):
+        """Give the record of a cycle to the collectors.
+
+        Parameters
+        ----------
+        cycle_idx : int
+
+        Returns
+        -------
+        record : dict of str : value
+            The record of the cycle.
+
+        """
+
+        with self._lock:
+            record = self._records.pop(cycle_idx, {CYCLE_IDX : cycle_idx})
+
+        for collector in self.collectors:
+            collector.collect(record)
+
+        return record
+
+
+class ProfileCollector(object):
+    """Abstract base class for collectors of profiling records."""
+
+    def init(self):
+        """Runtime initialization, e.g. opening files."""
+        pass
+
+    def collect(self, record):
+        """Collect the record of a cycle.
+
+        Parameters
+        ----------
+        record : dict of str : value
+            The 'cycle_idx' and the times of each phase.
+
+        """
+        raise NotImplementedError
+
+    def cleanup(self):
+        """Runtime cleanup, e.g. closing files."""
+        pass
+
+
+class RingBufferCollector(ProfileCollector):
+    """Keeps the records of the last cycles in memory."""
+
+    def __init__(self, maxlen=1000):
+        """Constructor for RingBufferCollector.
+
+        Parameters
+        ----------
+        maxlen : int
+            The number of records to keep.
+           (Default = 1000)
+
+        """
+
+        self._records = deque(maxlen=maxlen)
+
+    @property
+    def records(self):
+        """The kept records, oldest first."""
+        return list(self._records)
+
+    def collect(self, record):
+        # documented in superclass
+
+        self._records.append(record)
+
+
+class CSVCollector(ProfileCollector):
+    """Writes the records to a CSV file with a row for each phase of each
+    cycle, with the columns 'cycle_idx', 'phase', and 'seconds'."""
+
+    FIELDNAMES = (CYCLE_IDX, 'phase', 'seconds')
+    """The columns of the CSV file."""
+
+    def __init__(self, file_path, mode='x'):
+        """Constructor for CSVCollector.
+
+        Parameters
+        ----------
+        file_path : str
+
+        mode : str
+            The mode to open the file in, use 'a' to add to an
+            existing file.
+           (Default = 'x')
+
+        """
+
+        self.file_path = file_path
+        self.mode = mode
+
+        self._file = None
+        self._writer = None
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_writer'] = None
+
+        return state
+
+    def init(self):
+        # documented in superclass
+
+        self._file = open(self.file_path, self.mode, newline='')
+        self._writer = csv.writer(self._file)
+
+        # only write the header to new files
+        if self._file.tell() == 0:
+            self._writer.writerow(self.FIELDNAMES)
+
+    def collect(self, record):
+        # documented in superclass
+
+        cycle_idx = record[CYCLE_IDX]
+        for phase, seconds in record.items():
+            if phase != CYCLE_IDX:
+                self._writer.writerow((cycle_idx, phase, seconds))
+
+        self._file.flush()
+
+    def cleanup(self):
+        # documented in superclass
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+
+class HDF5Collector(ProfileCollector):
+    """Writes the records to a group in an HDF5 file.
+
+    The group has a 'cycle_idxs' dataset and a dataset for each phase
+    with a value for each cycle. Phases missing from the records of
+    cycles are NaN.
+
+    This should be a different file than the one a WepyHDF5Reporter
+    is writing to, since that file is held open by the reporter.
+
+    """
+
+    CYCLE_IDXS = 'cycle_idxs'
+    """The name of the dataset of cycle indices."""
+
+    def __init__(self, file_path, mode='x', group_name='profiling'):
+        """Constructor for HDF5Collector.
+
+        Parameters
+        ----------
+        file_path : str
+
+        mode : str
+            The mode to open the file in, use 'a' to add to an
+            existing file.
+           (Default = 'x')
+
+        group_name : str
+            The group the datasets will be in.
+           (Default = 'profiling')
+
+        """
+
+        self.file_path = file_path
+        self.mode = mode
+        self.group_name = group_name
+
+        self._h5 = None
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['_h5'] = None
+
+        return state
+
+    @property
+    def group(self):
+        """The group of the datasets in the open file."""
+        return self._h5[self.group_name]
+
+    def init(self):
+        # documented in superclass
+
+        self._h5 = h5py.File(self.file_path, self.mode)
+
+        if self.group_name not in self._h5:
+            grp = self._h5.create_group(self.group_name)
+            grp.create_dataset(self.CYCLE_IDXS, (0,), dtype=np.int64, maxshape=(None,))
+
+    def _append(self, dset_name, value, n_cycles):
+        """Append a value to a dataset, making it if needed."""
+
+        grp = self.group
+
+        if dset_name not in grp:
+            grp.create_dataset(dset_name, (n_cycles,), dtype=np.float64,
+                               maxshape=(None,), fillvalue=np.nan)
+
+        dset = grp[dset_name]
+        dset.resize((n_cycles + 1,))
+        dset[n_cycles] = value
+
+    def collect(self, record):
+        # documented in superclass
+
+        grp = self.group
+        n_cycles = grp[self.CYCLE_IDXS].shape[0]
+
+        self._append(self.CYCLE_IDXS, record[CYCLE_IDX], n_cycles)
+
+        # every phase gets a value for this cycle
+        phases = set(self._phase_dset_names()) | (set(record.keys()) - {CYCLE_IDX})
+        for phase in phases:
+            self._append(phase, record.get(phase, np.nan), n_cycles)
+
+        self._h5.flush()
+
+    def _phase_dset_names(self):
+        """The names (paths) of the datasets for all the phases."""
+
+        names = []
+        self.group.visititems(lambda name, obj: names.append(name)
+                              if isinstance(obj, h5py.Dataset) and name != self.CYCLE_IDXS
+                              else None)
+        return names
+
+    def cleanup(self):
+        # documented in superclass
+
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
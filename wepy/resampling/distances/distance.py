@@ -1,4 +1,9 @@
 import logging
+import itertools as it
+import multiprocessing as mp
+import weakref
+
+import numpy as np
 
 class Distance(object):
     """ """
@@ -32,6 +37,26 @@ class Distance(object):
 
         return state
 
+    def images(self, states):
+        """Compute the images of many states.
+
+        This is the abstract implementation which calls `image` for
+        every state, subclasses should override this with a batched
+        implementation if they can.
+
+        Parameters
+        ----------
+        states : list of states
+
+        Returns
+        -------
+        images : sequence of images
+            The image of each state.
+
+        """
+
+        return [self.image(state) for state in states]
+
     def image_distance(self, image_a, image_b):
         """The image_distance is the distance function computed between the
         exact images necessary for the resultant distance value.
@@ -54,6 +79,58 @@ class Distance(object):
         """
         raise NotImplementedError
 
+    def image_distances(self, images_a, images_b):
+        """Compute the matrix of distances between two collections of
+        images.
+
+        This is the abstract implementation which calls
+        `image_distance` for every pair, subclasses should override
+        this with a batched (e.g. vectorized) implementation if they
+        can.
+
+        Parameters
+        ----------
+        images_a : list of images
+
+        images_b : list of images
+
+        Returns
+        -------
+        distances : numpy.ndarray of float of shape (len(images_a), len(images_b))
+
+        """
+
+        distances = np.zeros((len(images_a), len(images_b)))
+        for i, image_a in enumerate(images_a):
+            for j, image_b in enumerate(images_b):
+                distances[i, j] = self.image_distance(image_a, image_b)
+
+        return distances
+
+    def all_image_distances(self, images):
+        """Compute the symmetric matrix of the distances between all pairs
+        of images, with zeros on the diagonal.
+
+        This is the abstract implementation which calls
+        `image_distance` once for each pair. Subclasses with batched
+        `image_distances` should override this to use it.
+
+        Parameters
+        ----------
+        images : list of images
+
+        Returns
+        -------
+        distances : numpy.ndarray of float of shape (len(images), len(images))
+
+        """
+
+        distances = np.zeros((len(images), len(images)))
+        for i, j in it.combinations(range(len(images)), 2):
+            distances[i, j] = distances[j, i] = self.image_distance(images[i], images[j])
+
+        return distances
+
     def distance(self, state_a, state_b):
         """Compute the distance between two states.
 
@@ -72,3 +149,304 @@ class Distance(object):
         return self.image_distance(self.image(state_a),
                                       self.image(state_b))
 
+
+
+class BatchedDistance(Distance):
+    """Abstract class for distances with a batched `image_distances`.
+
+    The all to all distances are computed with `image_distances` in
+    blocks of rows, so that the intermediate arrays of vectorized
+    implementations stay small for large numbers of images.
+
+    """
+
+    CHUNK_SIZE = 64
+    """The maximum number of rows of the distance matrix computed in
+    one call to `image_distances`."""
+
+    def image_distances(self, images_a, images_b):
+        # documented in superclass
+        raise NotImplementedError
+
+    def all_image_distances(self, images):
+        # documented in superclass
+
+        n_images = len(images)
+
+        distances = np.zeros((n_images, n_images))
+        for start in range(0, n_images, self.CHUNK_SIZE):
+            end = min(start + self.CHUNK_SIZE, n_images)
+            distances[start:end] = self.image_distances(images[start:end], images)
+
+        # the distance of an image to itself is zero by definition,
+        # make sure rounding doesn't say otherwise
+        np.fill_diagonal(distances, 0.0)
+
+        return distances
+
+
+def _image_distances_rows(distance, images_a, images_b):
+    """Compute a block of rows of a distance matrix in a pool process."""
+    return distance.image_distances(images_a, images_b)
+
+class ParallelDistance(Distance):
+    """Wraps a distance to compute the all to all distances in blocks of
+    rows with a pool of processes.
+
+    This is only worth it for large numbers of walkers with expensive
+    distances, since the distance and images are pickled and sent to
+    the processes each time.
+
+    The pool is started the first time it is needed and is not copied
+    or pickled along with this object.
+
+    """
+
+    def __init__(self, distance, num_processes=None, chunk_size=None):
+        """Constructor for ParallelDistance.
+
+        Parameters
+        ----------
+        distance : Distance
+            The distance to compute.
+
+        num_processes : int, optional
+            The number of processes in the pool, by default the
+            number of CPUs.
+
+        chunk_size : int, optional
+            The number of rows of the distance matrix in each task,
+            by default the rows are split evenly over the processes.
+
+        """
+
+        self.distance = distance
+        self.num_processes = num_processes if num_processes is not None else mp.cpu_count()
+        self.chunk_size = chunk_size
+
+        self._pool = None
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['_pool'] = None
+
+        return state
+
+    def __del__(self):
+
+        if self._pool is not None:
+            self._pool.terminate()
+
+    def image(self, state):
+        # documented in superclass
+        return self.distance.image(state)
+
+    def images(self, states):
+        # documented in superclass
+        return self.distance.images(states)
+
+    def image_distance(self, image_a, image_b):
+        # documented in superclass
+        return self.distance.image_distance(image_a, image_b)
+
+    def image_distances(self, images_a, images_b):
+        # documented in superclass
+        return self.distance.image_distances(images_a, images_b)
+
+    def all_image_distances(self, images):
+        # documented in superclass
+
+        n_images = len(images)
+
+        if self.chunk_size is None:
+            chunk_size = max(1, -(-n_images // self.num_processes))
+        else:
+            chunk_size = self.chunk_size
+
+        if self._pool is None:
+            self._pool = mp.Pool(self.num_processes)
+
+        chunk_starts = range(0, n_images, chunk_size)
+        blocks = self._pool.starmap(_image_distances_rows,
+                                    [(self.distance, images[start:start + chunk_size], images)
+                                     for start in chunk_starts])
+
+        distances = np.concatenate(blocks, axis=0)
+        np.fill_diagonal(distances, 0.0)
+
+        return distances
+
+
+class DistanceMatrixCache(object):
+    """Reuses the images and distances of walker states in the all to
+    all distance matrices of consecutive cycles.
+
+    States are identified by the identity of the state objects, so
+    this only helps when the same state object is seen again: clones
+    of a walker share their state, and walkers which were not
+    propagated (e.g. with the NoRunner) keep their state from the last
+    cycle. The image of each distinct state is computed once and the
+    distance of each distinct pair of states is computed once, and
+    the distances between states of the last cycle which are seen
+    again are reused.
+
+    Only weak references to the states are kept so the cache never
+    keeps states alive, and states which can't be weakly referenced
+    are simply not reused across cycles.
+
+    """
+
+    def __init__(self):
+        """Constructor for DistanceMatrixCache."""
+
+        self._clear()
+
+    def _clear(self):
+
+        # the state ids of the last cycle mapped to their weak
+        # reference, image, and index in the distance matrix
+        self._entries = {}
+
+        # the distances between the distinct states of the last cycle
+        self._distances = np.zeros((0, 0))
+
+        self.image_hit_rate = 0.0
+        self.distance_hit_rate = 0.0
+
+    def __getstate__(self):
+
+        # weak references can't be pickled, copies start empty
+        return {}
+
+    def __setstate__(self, state):
+
+        self._clear()
+
+    def _cached_entry(self, state):
+        """Get the cache entry of a state if it is still the same object."""
+
+        entry = self._entries.get(id(state))
+        if entry is not None and entry[0] is not None and entry[0]() is state:
+            return entry
+
+        return None
+
+    def all_to_all(self, distance, states, images=None):
+        """Compute the all to all distance matrix of states.
+
+        Parameters
+        ----------
+        distance : Distance
+            The distance to use.
+
+        states : list of walker states
+
+        images : list, optional
+            Already computed images of the states, None for any that
+            need to be computed.
+
+        Returns
+        -------
+        distances : numpy.ndarray of float of shape (n_states, n_states)
+
+        images : list
+            The image of each state.
+
+        """
+
+        if images is None:
+            images = [None for state in states]
+
+        # find the distinct states and which one each state is
+        unique_states = []
+        unique_images = []
+        unique_idxs = {}
+        state_unique_idxs = []
+        for state, image in zip(states, images):
+
+            unique_idx = unique_idxs.get(id(state))
+            if unique_idx is None:
+                unique_idx = len(unique_states)
+                unique_idxs[id(state)] = unique_idx
+                unique_states.append(state)
+                unique_images.append(image)
+
+            state_unique_idxs.append(unique_idx)
+
+        n_unique = len(unique_states)
+
+        # get the images from the last cycle or compute them, and the
+        # index of the states seen in the last cycle
+        old_idxs = []
+        prev_idxs = []
+        new_idxs = []
+        image_idxs = []
+        n_image_hits = len(states) - n_unique
+        for unique_idx, state in enumerate(unique_states):
+
+            entry = self._cached_entry(state)
+
+            if entry is not None:
+                old_idxs.append(unique_idx)
+                prev_idxs.append(entry[2])
+
+                if unique_images[unique_idx] is None:
+                    unique_images[unique_idx] = entry[1]
+                    n_image_hits += 1
+
+            else:
+                new_idxs.append(unique_idx)
+
+                if unique_images[unique_idx] is None:
+                    image_idxs.append(unique_idx)
+
+        # compute the missing images together
+        if len(image_idxs) > 0:
+            new_images = distance.images([unique_states[idx] for idx in image_idxs])
+            for unique_idx, image in zip(image_idxs, new_images):
+                unique_images[unique_idx] = image
+
+        # compute the distances involving the new states only
+        if len(old_idxs) == 0:
+            unique_distances = distance.all_image_distances(unique_images)
+
+        else:
+            unique_distances = np.zeros((n_unique, n_unique))
+            unique_distances[np.ix_(old_idxs, old_idxs)] = \
+                                self._distances[np.ix_(prev_idxs, prev_idxs)]
+
+            if len(new_idxs) > 0:
+                new_distances = distance.image_distances([unique_images[idx] for idx in new_idxs],
+                                                         unique_images)
+                unique_distances[new_idxs, :] = new_distances
+                unique_distances[:, new_idxs] = new_distances.T
+
+            np.fill_diagonal(unique_distances, 0.0)
+
+        # remember the distinct states of this cycle for the next one
+        self._entries = {}
+        for unique_idx, state in enumerate(unique_states):
+            try:
+                state_ref = weakref.ref(state)
+            except TypeError:
+                state_ref = None
+
+            self._entries[id(state)] = (state_ref, unique_images[unique_idx], unique_idx)
+
+        self._distances = unique_distances
+
+        # the fraction of the images and distinct pairs which didn't
+        # need to be computed
+        n_states = len(states)
+        n_pairs = n_states * (n_states - 1) // 2
+        n_computed_pairs = n_unique * (n_unique - 1) // 2 - \
+                           len(old_idxs) * (len(old_idxs) - 1) // 2
+
+        self.image_hit_rate = n_image_hits / n_states if n_states > 0 else 0.0
+        self.distance_hit_rate = 1.0 - n_computed_pairs / n_pairs if n_pairs > 0 else 0.0
+
+        distances = unique_distances[np.ix_(state_unique_idxs, state_unique_idxs)]
+        images = [unique_images[unique_idx] for unique_idx in state_unique_idxs]
+
+        return distances, images
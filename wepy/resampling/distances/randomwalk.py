@@ -6,10 +6,10 @@ import logging
 
 import numpy as np
 
-from wepy.resampling.distances.distance import Distance
+from wepy.resampling.distances.distance import BatchedDistance
 
 
-class RandomWalkDistance(Distance):
+class RandomWalkDistance(BatchedDistance):
     """Computes the distance between pairs of positions and returns a distance matrix
     where the element (d_ij) is the average of the difference between posiotion of
     walker i and j.
@@ -61,3 +61,26 @@ class RandomWalkDistance(Distance):
 
         """
         return np.average(np.abs(image_a - image_b))
+
+    def image_distances(self, images_a, images_b):
+        """Compute the distances between all pairs of positions of two
+        collections of states.
+
+        Parameters
+        ----------
+        images_a : list of arraylike
+            positions of the first states
+        images_b : list of arraylike
+            positions of the second states
+
+        Returns
+        -------
+        distances : numpy.ndarray of float of shape (len(images_a), len(images_b))
+
+        """
+
+        positions_a = np.array([np.ravel(image) for image in images_a])
+        positions_b = np.array([np.ravel(image) for image in images_b])
+
+        return np.mean(np.abs(positions_a[:, np.newaxis, :] - positions_b[np.newaxis, :, :]),
+                       axis=-1)
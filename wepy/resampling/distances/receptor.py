@@ -2,16 +2,13 @@ import logging
 
 import numpy as np
 
-from wepy.util.util import box_vectors_to_lengths_angles
+from wepy.util.util import traj_group_pair, traj_center_around, traj_superimpose
 
-from geomm.grouping import group_pair
-from geomm.superimpose import superimpose
 from geomm.rmsd import calc_rmsd
-from geomm.centering import center_around
 
-from wepy.resampling.distances.distance import Distance
+from wepy.resampling.distances.distance import BatchedDistance
 
-class ReceptorDistance(Distance):
+class ReceptorDistance(BatchedDistance):
     """ """
     def __init__(self, ligand_idxs, binding_site_idxs, ref_state):
 
@@ -35,36 +32,78 @@ class ReceptorDistance(Distance):
 
         self.ref_image = self._unaligned_image(ref_state)
 
-    def _unaligned_image(self, state):
-        """
+    def _unaligned_images(self, states):
+        """Compute the images of states before superimposing them.
 
         Parameters
         ----------
-        state :
-            
+        states : list of states
 
         Returns
         -------
+        images : numpy.ndarray of float of shape (n_states, n_image_atoms, 3)
 
         """
 
+        # only the positions of the atoms of the image are needed, so
+        # we stack just these for all of the states
+        positions = np.stack([np.asarray(state['positions'])[self._image_idxs]
+                              for state in states])
+
         # get the box lengths from the vectors
-        box_lengths, box_angles = box_vectors_to_lengths_angles(state['box_vectors'])
+        box_lengths = np.linalg.norm(np.stack([np.asarray(state['box_vectors'])
+                                               for state in states]),
+                                     axis=2)
 
         # recenter the protein-ligand complex into the center of the
         # periodic boundary conditions
 
         # regroup the ligand and protein in together
-        grouped_positions = group_pair(state['positions'], box_lengths,
-                                    self._bs_idxs, self._lig_idxs)
+        grouped_positions = traj_group_pair(positions, box_lengths,
+                                            self._image_bs_idxs, self._image_lig_idxs)
 
         # then center them around the binding site
-        centered_positions = center_around(grouped_positions, self._bs_idxs)
+        return traj_center_around(grouped_positions, self._image_bs_idxs)
+
+    def _unaligned_image(self, state):
+        """
+
+        Parameters
+        ----------
+        state :
+            
+
+        Returns
+        -------
+
+        """
+
+        return self._unaligned_images([state])[0]
+
+    def images(self, states):
+        """Compute the images of many states at once.
 
-        # slice these positions to get the image
-        state_image = centered_positions[self._image_idxs]
+        Parameters
+        ----------
+        states : list of states
 
-        return state_image
+        Returns
+        -------
+        images : numpy.ndarray of float of shape (n_states, n_image_atoms, 3)
+
+        """
+
+        if len(states) == 0:
+            return np.zeros((0, len(self._image_idxs), 3))
+
+        # get the unaligned images
+        state_images = self._unaligned_images(states)
+
+        # then superimpose them to the reference structure
+        sup_images, _, _ = traj_superimpose(self.ref_image, state_images,
+                                            idxs=self._image_bs_idxs)
+
+        return np.ascontiguousarray(sup_images)
 
     def image(self, state):
         """
@@ -79,13 +118,7 @@ class ReceptorDistance(Distance):
 
         """
 
-        # get the unaligned image
-        state_image = self._unaligned_image(state)
-
-        # then superimpose it to the reference structure
-        sup_image, _, _ = superimpose(self.ref_image, state_image, idxs=self._image_bs_idxs)
-
-        return sup_image
+        return self.images([state])[0]
 
 
 class UnbindingDistance(ReceptorDistance):
@@ -111,6 +144,32 @@ class UnbindingDistance(ReceptorDistance):
 
         return lig_rmsd
 
+    def image_distances(self, images_a, images_b):
+        """Compute the ligand RMSDs between all pairs of images of two
+        collections.
+
+        Parameters
+        ----------
+        images_a : list of arraylike
+
+        images_b : list of arraylike
+
+        Returns
+        -------
+        distances : numpy.ndarray of float of shape (len(images_a), len(images_b))
+
+        """
+
+        # the ligand coordinates of each image as a flat vector
+        ligs_a = np.array([image[self._image_lig_idxs] for image in images_a])
+        ligs_a = ligs_a.reshape((len(images_a), -1))
+        ligs_b = np.array([image[self._image_lig_idxs] for image in images_b])
+        ligs_b = ligs_b.reshape((len(images_b), -1))
+
+        sq_diffs = np.square(ligs_a[:, np.newaxis, :] - ligs_b[np.newaxis, :, :])
+
+        return np.sqrt(np.sum(sq_diffs, axis=-1) / self._n_lig_atoms)
+
 class RebindingDistance(ReceptorDistance):
     """ """
     def image_distance(self, image_a, image_b):
@@ -138,3 +197,43 @@ class RebindingDistance(ReceptorDistance):
         d = abs(1./state_a_rmsd - 1./state_b_rmsd)
 
         return d
+
+    def _ref_rmsds(self, images):
+        """Compute the ligand RMSDs of images to the reference image.
+
+        Parameters
+        ----------
+        images : list of arraylike
+
+        Returns
+        -------
+        rmsds : numpy.ndarray of float
+
+        """
+
+        ligs = np.array([image[self._image_lig_idxs] for image in images])
+        ref_lig = self.ref_image[self._image_lig_idxs]
+
+        return np.sqrt(np.sum(np.square(ligs - ref_lig), axis=(1, 2)) / self._n_lig_atoms)
+
+    def image_distances(self, images_a, images_b):
+        """Compute the distances between all pairs of images of two
+        collections.
+
+        Parameters
+        ----------
+        images_a : list of arraylike
+
+        images_b : list of arraylike
+
+        Returns
+        -------
+        distances : numpy.ndarray of float of shape (len(images_a), len(images_b))
+
+        """
+
+        # each image only needs its RMSD to the reference computed once
+        inv_rmsds_a = 1. / self._ref_rmsds(images_a)
+        inv_rmsds_b = 1. / self._ref_rmsds(images_b)
+
+        return np.abs(inv_rmsds_a[:, np.newaxis] - inv_rmsds_b[np.newaxis, :])
@@ -0,0 +1,157 @@
+"""Vantage point tree for finding the nearest image with a metric
+distance.
+
+The images are recursively split by their distance to a vantage point
+image (the median distance separating the closer and farther halves),
+and the triangle inequality is used to skip the parts of the tree
+which can't have an image closer than the nearest one found so
+far. For well behaved data this needs a number of distance
+calculations which grows like the logarithm of the number of images
+instead of linearly.
+
+The distances to the images in the leaves of the tree are computed in
+one call to `image_distances` so they are vectorized for batched
+distances.
+
+This is only valid for distances which are metrics, i.e. satisfy the
+triangle inequality (e.g. the RMSD without alignment of the
+UnbindingDistance).
+
+"""
+
+import numpy as np
+
+class VPTree(object):
+    """Vantage point tree over a list of images."""
+
+    # nodes of the tree are either a leaf, which is an array of the
+    # indices of its images, or a tuple of the index of the vantage
+    # point and the (min, max) distances of the images in the near
+    # and far subtrees to it along with the subtrees themselves
+
+    def __init__(self, distance, images, leaf_size=8):
+        """Constructor for VPTree.
+
+        Parameters
+        ----------
+        distance : Distance
+            The (metric) distance between the images.
+
+        images : list of images
+
+        leaf_size : int
+            The maximum number of images in the leaves, whose
+            distances are computed together. This is at least 2, so
+            that the images split at every vantage point are never
+            too few for both a near and a far half.
+           (Default = 8)
+
+        """
+
+        self.distance = distance
+        self.images = list(images)
+        self.leaf_size = max(2, leaf_size)
+
+        self._root = self._build(np.arange(len(self.images)))
+
+    def __len__(self):
+        return len(self.images)
+
+    def _build(self, idxs):
+        """Build the subtree of the images with the indices."""
+
+        if len(idxs) <= self.leaf_size:
+            return idxs
+
+        # the first image is the vantage point, which is deterministic
+        # so the tree is reproducible
+        vp_idx = idxs[0]
+        rest_idxs = idxs[1:]
+
+        dists = self.distance.image_distances([self.images[vp_idx]],
+                                              [self.images[i] for i in rest_idxs])[0]
+
+        # the nearer half and the farther half
+        order = np.argsort(dists, kind='stable')
+        half = len(order) // 2
+        near, far = order[:half], order[half:]
+
+        return (vp_idx,
+                (dists[near].min(), dists[near].max()), self._build(rest_idxs[near]),
+                (dists[far].min(), dists[far].max()), self._build(rest_idxs[far]))
+
+    def nearest(self, image):
+        """Find the nearest image.
+
+        Ties are broken by the lowest index, like a linear scan with
+        `np.argmin` would.
+
+        Parameters
+        ----------
+        image : image
+            The query image.
+
+        Returns
+        -------
+        idx : int
+            The index of the nearest image.
+
+        dist : float
+            The distance to it.
+
+        """
+
+        best = [np.inf, -1]
+        self._search(self._root, image, best)
+
+        return best[1], best[0]
+
+    @staticmethod
+    def _update(best, dist, idx):
+        """Keep the nearest image found, breaking ties by the lowest index."""
+
+        if dist < best[0] or (dist == best[0] and idx < best[1]):
+            best[0] = dist
+            best[1] = idx
+
+    @staticmethod
+    def _prunable(lower_bound, best_dist):
+        """Whether a subtree can't have an image as near as the best."""
+
+        # some slack for rounding errors in the bound, so that
+        # exact ties are never pruned
+        return lower_bound - best_dist > 1e-12 * max(abs(best_dist), abs(lower_bound))
+
+    def _search(self, node, image, best):
+        """Search a subtree for the nearest image."""
+
+        # leaves compute all their distances at once
+        if isinstance(node, np.ndarray):
+
+            if len(node) > 0:
+                dists = self.distance.image_distances([image],
+                                                      [self.images[i] for i in node])[0]
+                for idx, dist in zip(node, dists):
+                    self._update(best, dist, idx)
+
+            return
+
+        vp_idx, near_range, near, far_range, far = node
+
+        dist = self.distance.image_distances([image], [self.images[vp_idx]])[0, 0]
+        self._update(best, dist, vp_idx)
+
+        # the smallest possible distance to the images of each
+        # subtree by the triangle inequality
+        subtrees = []
+        for (min_dist, max_dist), subtree in ((near_range, near), (far_range, far)):
+            lower_bound = max(min_dist - dist, dist - max_dist, 0.0)
+            subtrees.append((lower_bound, subtree))
+
+        # search the most promising first
+        if subtrees[1][0] < subtrees[0][0]:
+            subtrees.reverse()
+
+        for lower_bound, subtree in subtrees:
+            if not self._prunable(lower_bound, best[0]):
+                self._search(subtree, image, best)
@@ -1,12 +1,110 @@
 import multiprocessing as mulproc
 import random as rand
-import itertools as it
-import logging
+import time
 
 import numpy as np
 
 from wepy.resampling.resamplers.resampler import Resampler
 from wepy.resampling.decisions.clone_merge import MultiCloneMergeDecision
+from wepy.resampling.distances.distance import DistanceMatrixCache
+from wepy.sim_logging import log_event, log_payload
+from wepy.util.util import triu_distance_matrix
+
+class IncrementalSpread(object):
+    """The spread of the walkers and their wsums in the clone/merge
+    optimization of the REVOResampler, updated for the walkers changed
+    by each move instead of being recomputed over all pairs.
+
+    The spread is 1/2 g^T D g and the wsums are f * (D g), where D is
+    the matrix of the scaled distances (with a zero diagonal), f are
+    the weight factors of the walkers and g = f * amp. A move which
+    changes the weights or amplitudes of k walkers only changes their
+    elements of g, so the spread and D g can be updated in O(n k)
+    time. The scaled distances are computed only once.
+
+    """
+
+    def __init__(self, resampler, walkerwt, amp, distance_matrix):
+        """Constructor for IncrementalSpread.
+
+        Parameters
+        ----------
+        resampler : REVOResampler
+            The resampler whose parameters are used.
+
+        walkerwt : list of float
+            The initial weights of the walkers.
+
+        amp : list of float
+            The initial amplitudes of the walkers.
+
+        distance_matrix : arraylike of float of shape (n_walkers, n_walkers)
+            The distances between the walkers.
+
+        """
+
+        self._resampler = resampler
+
+        # the scaled distances of the pairs (i < j), mirrored
+        d = np.triu(np.asarray(distance_matrix, dtype=float), k=1)
+        d = (d/resampler.d0)**resampler.dpower
+        self._d = d + d.T
+
+        amp = np.asarray(amp, dtype=float)
+        self._wtfac = resampler._wtfacs(walkerwt, amp)
+        self._g = self._wtfac * np.where(amp > 0, amp, 0.0)
+        self._h = self._d @ self._g
+        self._spread = float(self._g @ self._h) / 2
+
+    @property
+    def spread(self):
+        """The current spread."""
+        return self._spread
+
+    @property
+    def wsum(self):
+        """The current wsum of each walker."""
+        return self._wtfac * self._h
+
+    def update(self, walker_idxs, walkerwt, amp):
+        """Update the spread for changes to the weights or amplitudes of
+        some walkers.
+
+        Parameters
+        ----------
+        walker_idxs : list of int
+            The walkers whose weight or amplitude changed.
+
+        walkerwt : list of float
+            The weights of all the walkers.
+
+        amp : list of float
+            The amplitudes of all the walkers.
+
+        Returns
+        -------
+        spread : float
+
+        wsum : numpy.ndarray of float of shape (n_walkers,)
+
+        """
+
+        idxs = np.unique(walker_idxs)
+
+        walker_amps = np.array([amp[i] for i in idxs], dtype=float)
+        walker_wtfacs = self._resampler._wtfacs([walkerwt[i] for i in idxs], walker_amps)
+
+        delta = walker_wtfacs * np.where(walker_amps > 0, walker_amps, 0.0) - self._g[idxs]
+
+        # the change of 1/2 g^T D g
+        self._spread += float(delta @ self._h[idxs]) + \
+                        float(delta @ self._d[np.ix_(idxs, idxs)] @ delta) / 2
+
+        self._h += self._d[:, idxs] @ delta
+        self._g[idxs] += delta
+        self._wtfac[idxs] = walker_wtfacs
+
+        return self.spread, self.wsum
 
 class REVOResampler(Resampler):
     """ """
@@ -14,12 +112,13 @@ class REVOResampler(Resampler):
     DECISION = MultiCloneMergeDecision
 
     # state change data for the resampler
-    RESAMPLER_FIELDS = ('n_walkers', 'distance_matrix', 'spread', 'image_shape', 'images')
-    RESAMPLER_SHAPES = ((1,), Ellipsis, (1,), Ellipsis, Ellipsis)
-    RESAMPLER_DTYPES = (np.int, np.float, np.float, np.int, None)
+    RESAMPLER_FIELDS = ('n_walkers', 'distance_matrix', 'spread', 'image_shape', 'images',
+                        'image_cache_hit_rate', 'distance_cache_hit_rate')
+    RESAMPLER_SHAPES = ((1,), Ellipsis, (1,), Ellipsis, Ellipsis, (1,), (1,))
+    RESAMPLER_DTYPES = (np.int, np.float, np.float, np.int, None, np.float, np.float)
 
     # fields that can be used for a table like representation
-    RESAMPLER_RECORD_FIELDS = ('spread',)
+    RESAMPLER_RECORD_FIELDS = ('spread', 'image_cache_hit_rate', 'distance_cache_hit_rate')
 
     # fields for resampling data
     RESAMPLING_FIELDS = DECISION.FIELDS + ('step_idx', 'walker_idx',)
@@ -29,9 +128,16 @@ class REVOResampler(Resampler):
     # fields that can be used for a table like representation
     RESAMPLING_RECORD_FIELDS = DECISION.RECORD_FIELDS + ('step_idx', 'walker_idx',)
 
+    # a CycleProfiler (wepy.profiling) the times of computing the
+    # distance matrix and the decisions are added to, this is set by
+    # the simulation manager
+    profiler = None
 
     def __init__(self, seed=None, pmin=1e-12, pmax=0.1, dpower=4, merge_dist=2.5,
-                 d0=None, distance=None, init_state=None, weights=True):
+                 d0=None, distance=None, init_state=None, weights=True,
+                 cache_distances=False,
+                 record_image_dtype=None, record_triu_distance_matrix=False,
+                 record_every=1):
 
         self.decision = self.DECISION
 
@@ -65,11 +171,46 @@ class REVOResampler(Resampler):
         # setting the weights parameter
         self.weights = weights
 
+        # reuse the images and distances of states seen again (clones
+        # and walkers that weren't propagated), this assumes states
+        # are never modified in place
+        if cache_distances:
+            self._distance_cache = DistanceMatrixCache()
+        else:
+            self._distance_cache = None
+
+        # the images and distance matrix are the bulk of the
+        # resampler records, these can be made more compact by
+        # recording the images with a lower precision dtype
+        # (e.g. np.float32 or np.float16), only the upper triangle of
+        # the distance matrix, and only recording them every
+        # `record_every` resamplings (with empty arrays for the
+        # others). The WepyHDF5 resampler records expand these again.
+        self.record_image_dtype = record_image_dtype
+        self.record_triu_distance_matrix = record_triu_distance_matrix
+        self.record_every = record_every
+        self._n_resamplings = 0
+
         # we do not know the shape and dtype of the images until
         # runtime so we determine them here
         assert init_state is not None, "must give an initial state to infer data about the image"
         image = self.distance.image(init_state)
-        self.image_dtype = image.dtype
+        if record_image_dtype is not None:
+            self.image_dtype = np.dtype(record_image_dtype)
+        else:
+            self.image_dtype = image.dtype
+
+    def __setstate__(self, state):
+
+        # support resamplers pickled before distances could be cached
+        # or the records made more compact
+        state.setdefault('_distance_cache', None)
+        state.setdefault('record_image_dtype', None)
+        state.setdefault('record_triu_distance_matrix', False)
+        state.setdefault('record_every', 1)
+        state.setdefault('_n_resamplings', 0)
+
+        self.__dict__.update(state)
 
     # we need this to on the fly find out what the datatype of the
     # image is
@@ -85,65 +226,110 @@ class REVOResampler(Resampler):
 
         return tuple(dtypes)
 
-    def _calcspread(self, walkerwt, amp, distance_matrix):
+    def _wtfacs(self, walkerwt, amp):
+        """Calculate the weight factors of walkers for the spread.
+
+        Parameters
+        ----------
+        walkerwt : arraylike of float
+            The weights of the walkers.
+
+        amp : arraylike of float
+            The amplitudes of the walkers.
+
+        Returns
+        -------
+        wtfac : numpy.ndarray of float
+
         """
 
+        walkerwt = np.asarray(walkerwt, dtype=float)
+        amp = np.asarray(amp, dtype=float)
+
+        wtfac = np.zeros(len(walkerwt))
+
+        # only walkers with positive weights and amplitudes have one
+        has_wtfac = (walkerwt > 0) & (amp > 0)
+        if self.weights:
+            wtfac[has_wtfac] = np.log(walkerwt[has_wtfac]/amp[has_wtfac]) - self.lpmin
+        else:
+            wtfac[has_wtfac] = 1
+
+        wtfac[wtfac < 0] = 0
+
+        return wtfac
+
+    def _spread_calculator(self, walkerwt, amp, distance_matrix):
+        """Make the object which keeps track of the spread during the
+        clone/merge optimization.
+
         Parameters
         ----------
-        walkerwt :
-            
-        amp :
-            
-        distance_matrix :
-            
+        walkerwt : list of float
+            The initial weights of the walkers.
+
+        amp : list of float
+            The initial amplitudes of the walkers.
+
+        distance_matrix : arraylike of float of shape (n_walkers, n_walkers)
+            The distances between the walkers.
 
         Returns
         -------
+        spread_calculator : IncrementalSpread
 
         """
 
-        n_walkers = len(walkerwt)
-        # the value to be optimized
-        spread = 0
+        return IncrementalSpread(self, walkerwt, amp, distance_matrix)
 
-        #
-        wsum = np.zeros(n_walkers)
+    def _calcspread(self, walkerwt, amp, distance_matrix):
+        """Calculate the spread of the walkers and the contribution of
+        each walker to it (wsum).
 
-        # weight factors for the walkers
-        wtfac = np.zeros(n_walkers)
+        The spread is the sum over all pairs of walkers with positive
+        amplitudes of their scaled distances, weighted by their weight
+        factors and amplitudes. This is computed with masked arrays
+        over the whole distance matrix instead of looping over the
+        pairs.
 
-        # set the weight factors
-        for i in range(n_walkers):
+        Parameters
+        ----------
+        walkerwt : list of float
+            The weights of the walkers.
 
-            if walkerwt[i] > 0 and amp[i] > 0:
-                if self.weights:
-                    wtfac[i] = np.log(walkerwt[i]/amp[i]) - self.lpmin
-                else:
-                    wtfac[i] = 1
+        amp : list of float
+            The amplitudes of the walkers.
 
-            else:
-                wtfac[i] = 0
+        distance_matrix : arraylike of float of shape (n_walkers, n_walkers)
+            The distances between the walkers.
 
-            if wtfac[i] < 0:
-                wtfac[i] = 0
+        Returns
+        -------
+        spread : float
 
-        #
-        for i in range(n_walkers - 1):
-            if amp[i] > 0:
-                for j in range(i+1, n_walkers):
-                    if amp[j] > 0:
-                        d = ((distance_matrix[i][j]/self.d0)**self.dpower) * wtfac[i] * wtfac[j]
-                        spread += d * amp[i] * amp[j]
-                        wsum[i] += d * amp[j]
-                        wsum[j] += d * amp[i]
-
-        # another implementation for personal clarity
-        # for i, j in it.combinations(range(len(n_walkers)), 2):
-        #     if amp[i] > 0 and amp[j] > 0:
-        #         d = ((distance_matrix[i][j])**self.dpower) * wtfac[i] * wtfac[j]
-        #         spread += d * amp[i] * amp[j]
-        #         wsum[i] = += d * amp[j]
-        #         wsum[j] += d * amp[i]
+        wsum : numpy.ndarray of float of shape (n_walkers,)
+
+        """
+
+        amp = np.asarray(amp, dtype=float)
+
+        # only walkers with positive amplitudes contribute
+        alive = amp > 0
+        amp = np.where(alive, amp, 0.0)
+
+        # weight factors for the walkers
+        wtfac = self._wtfacs(walkerwt, amp)
+
+        # the weighted distances of the pairs (i < j), mirrored so
+        # each walker sees all of its pairs
+        d = np.triu(np.asarray(distance_matrix, dtype=float), k=1)
+        d = (d/self.d0)**self.dpower * np.outer(wtfac, wtfac)
+        d = d + d.T
+
+        wsum = np.where(alive, d @ amp, 0.0)
+
+        # each pair is counted twice
+        spread = float(amp @ wsum) / 2
 
         return spread, wsum
 
@@ -166,6 +352,8 @@ class REVOResampler(Resampler):
 
         n_walkers = len(walkerwt)
 
+        distance_matrix = np.asarray(distance_matrix, dtype=float)
+
         spreads = []
         merge_groups = [[] for i in range(n_walkers)]
         walker_clone_nums = [0 for i in range(n_walkers)]
@@ -174,12 +362,14 @@ class REVOResampler(Resampler):
         new_amp = amp.copy()
         # initialize the actions to nothing, will be overwritten
 
-        # calculate the initial spread which will be optimized
-        spread, wsum = self._calcspread(walkerwt, new_amp, distance_matrix)
+        # calculate the initial spread which will be optimized, this
+        # is then updated only for the walkers changed by each move
+        spread_calc = self._spread_calculator(walkerwt, new_amp, distance_matrix)
+        spread, wsum = spread_calc.spread, spread_calc.wsum
         spreads.append(spread)
 
         # maximize the variance through cloning and merging
-        logging.info("Starting variance optimization:", spread)
+        log_event('variance_optimization_started', spread=spread)
 
         productive = True
         while productive:
@@ -256,12 +446,13 @@ class REVOResampler(Resampler):
                 new_amp[maxwind] += 1
 
                 # re-determine spread function, and wsum values
-                newspread, wsum = self._calcspread(new_wt, new_amp, distance_matrix)
+                newspread, wsum = spread_calc.update([minwind, closewalk, maxwind],
+                                                     new_wt, new_amp)
 
                 if newspread > spread:
                     spreads.append(newspread)
 
-                    logging.info("Variance move to", newspread, "accepted")
+                    log_event('variance_move_accepted', spread=newspread)
 
                     productive = True
                     spread = newspread
@@ -316,12 +507,14 @@ class REVOResampler(Resampler):
                     walker_clone_nums[maxwind] += 1
 
                     # new spread for starting new stage
-                    newspread, wsum = self._calcspread(new_wt, new_amp, distance_matrix)
+                    newspread, wsum = spread_calc.update([keep_idx, squash_idx],
+                                                         new_wt, new_amp)
                     spreads.append(newspread)
 
-                    logging.info("variance after selection:", newspread)
+                    log_event('variance_selected', spread=newspread)
 
-                # if not productive
+                # if not productive, this ends the optimization so
+                # the spread is not updated for undoing the move
                 else:
                     new_amp[minwind] = 1
                     new_amp[closewalk] = 1
@@ -341,46 +534,105 @@ class REVOResampler(Resampler):
 
         return walker_actions, spreads[-1]
 
-    def _all_to_all_distance(self, walkers):
+    def _all_to_all_distance(self, walkers, images=None):
         """
 
         Parameters
         ----------
         walkers :
             
+        images : list, optional
+            The already computed images of the walker states, None
+            for any that need to be computed.
 
         Returns
         -------
 
         """
-        # initialize an all-to-all matrix, with 0.0 for self distances
-        dist_mat = np.zeros((len(walkers), len(walkers)))
+        # only compute the images and distances of states not seen
+        # before
+        if self._distance_cache is not None:
+            return self._distance_cache.all_to_all(self.distance,
+                                                   [walker.state for walker in walkers],
+                                                   images=images)
 
         # make images for all the walker states for us to compute distances on
-        images = []
-        for walker in walkers:
-            image = self.distance.image(walker.state)
-            images.append(image)
+        if images is None:
+            images = [None for walker in walkers]
+
+        images = list(images)
+        image_idxs = [i for i, image in enumerate(images) if image is None]
+        if len(image_idxs) > 0:
+            new_images = self.distance.images([walkers[i].state for i in image_idxs])
+            for i, image in zip(image_idxs, new_images):
+                images[i] = image
+
+        # compute the distances between all the walkers in one go,
+        # which is vectorized (or parallelized) if the distance
+        # supports it, with 0.0 for self distances
+        dist_mat = self.distance.all_image_distances(images)
+
+        return dist_mat, images
+
+    def _is_record_resampling(self):
+        """Whether the images and distance matrix are recorded for this
+        resampling."""
+
+        return self._n_resamplings % self.record_every == 0
+
+    def _record_distance_matrix(self, distance_matrix):
+        """Encode the distance matrix for the resampler records.
+
+        Parameters
+        ----------
+        distance_matrix : arraylike of float of shape (n_walkers, n_walkers)
+
+        Returns
+        -------
+        distance_matrix_values : numpy.ndarray of float
+            The flattened matrix or its upper triangle, empty if it
+            isn't recorded this resampling.
 
-        # get the combinations of indices for all walker pairs
-        for i, j in it.combinations(range(len(images)), 2):
+        """
+
+        if not self._is_record_resampling():
+            return np.zeros((0,))
 
-            # calculate the distance between the two walkers
-            dist = self.distance.image_distance(images[i], images[j])
+        if self.record_triu_distance_matrix:
+            return triu_distance_matrix(distance_matrix)
+        else:
+            return np.ravel(np.array(distance_matrix))
 
-            # save this in the matrix in both spots
-            dist_mat[i][j] = dist
-            dist_mat[j][i] = dist
+    def _record_images(self, images):
+        """Encode the images for the resampler records.
 
-        return [walker_dists for walker_dists in dist_mat], images
+        Parameters
+        ----------
+        images : list of images
+
+        Returns
+        -------
+        image_values : numpy.ndarray
+            The flattened images with the record image dtype, empty
+            if they aren't recorded this resampling.
 
-    def resample(self, walkers):
+        """
+
+        if not self._is_record_resampling():
+            return np.zeros((0,), dtype=self.image_dtype)
+
+        return np.ravel(np.array(images)).astype(self.image_dtype, copy=False)
+
+    def resample(self, walkers, images=None):
         """
 
         Parameters
         ----------
         walkers :
             
+        images : list, optional
+            The already computed images of the walker states, None
+            for any that need to be computed.
 
         Returns
         -------
@@ -392,14 +644,19 @@ class REVOResampler(Resampler):
         amp = [1 for i in range(n_walkers)]
 
         # calculate distance matrix
-        distance_matrix, images = self._all_to_all_distance(walkers)
+        start = time.time()
+        distance_matrix, images = self._all_to_all_distance(walkers, images=images)
+        if self.profiler is not None:
+            self.profiler.add_time('resampler/distance_matrix', time.time() - start)
 
-        logging.info("distance_matrix")
-        logging.info(np.array(distance_matrix))
+        log_payload('distance_matrix', distance_matrix=lambda: np.array(distance_matrix))
 
         # determine cloning and merging actions to be performed, by
         # maximizing the spread, i.e. the Decider
+        start = time.time()
         resampling_data, spread = self.decide_clone_merge(walkerwt, amp, distance_matrix)
+        if self.profiler is not None:
+            self.profiler.add_time('resampler/decision', time.time() - start)
 
         # convert the target idxs and decision_id to feature vector arrays
         for record in resampling_data:
@@ -408,12 +665,23 @@ class REVOResampler(Resampler):
 
         # actually do the cloning and merging of the walkers
         resampled_walkers = self.decision.action(walkers, [resampling_data])
+
+        if self._distance_cache is not None:
+            image_hit_rate = self._distance_cache.image_hit_rate
+            distance_hit_rate = self._distance_cache.distance_hit_rate
+        else:
+            image_hit_rate = 0.0
+            distance_hit_rate = 0.0
         # flatten the distance matrix and give the number of walkers
         # as well for the resampler data, there is just one per cycle
-        resampler_data = [{'distance_matrix' : np.ravel(np.array(distance_matrix)),
+        resampler_data = [{'distance_matrix' : self._record_distance_matrix(distance_matrix),
                            'n_walkers' : np.array([len(walkers)]),
                            'spread' : np.array([spread]),
-                           'images' : np.ravel(np.array(images)),
-                           'image_shape' : np.array(images[0].shape)}]
+                           'images' : self._record_images(images),
+                           'image_shape' : np.array(images[0].shape),
+                           'image_cache_hit_rate' : np.array([image_hit_rate]),
+                           'distance_cache_hit_rate' : np.array([distance_hit_rate])}]
+
+        self._n_resamplings += 1
 
         return resampled_walkers, resampling_data, resampler_data
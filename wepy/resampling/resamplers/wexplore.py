@@ -1,15 +1,17 @@
-import math
 import random as rand
 import itertools as it
 from collections import namedtuple, defaultdict
-from copy import copy, deepcopy
-import logging
+from collections.abc import Mapping
+from copy import deepcopy
+import time
+import multiprocessing as mp
 
 import numpy as np
-import networkx as nx
 
 from wepy.resampling.resamplers.resampler  import Resampler, ResamplerError
 from wepy.resampling.decisions.clone_merge import MultiCloneMergeDecision
+from wepy.resampling.distances.vptree import VPTree
+from wepy.sim_logging import log_payload
 
 class RegionTreeError(Exception):
     """ """
@@ -167,10 +169,133 @@ def calc_max_num_clones(walker_weight, min_weight, max_num_walkers):
 
     return max_n_clones
 
+def calc_max_nums_clones(walker_weights, min_weight, max_num_walkers):
+    """Compute `calc_max_num_clones` for an array of walker weights
+    at once.
 
-class RegionTree(nx.DiGraph):
+    Parameters
+    ----------
+    walker_weights : arraylike of float
+        
+    min_weight :
+        
+    max_num_walkers :
+        
+
+    Returns
+    -------
+    max_n_clones : numpy.ndarray of int
+
+    """
+
+    walker_weights = np.asarray(walker_weights, dtype=float)
+    max_num_walkers = int(max_num_walkers)
+
+    # the number of splits is the largest one (up to the max number
+    # of walkers) for which the children have at least the minimum
+    # weight, or 1 for no splitting
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n_splits = np.floor(walker_weights / min_weight)
+
+    n_splits = np.clip(np.nan_to_num(n_splits), 1, max(max_num_walkers, 1)).astype(int)
+
+    # correct the estimate for rounding so that it agrees with
+    # dividing the weight by the number of splits
+    too_many = (n_splits > 1) & (walker_weights / n_splits < min_weight)
+    while too_many.any():
+        n_splits[too_many] -= 1
+        too_many = (n_splits > 1) & (walker_weights / n_splits < min_weight)
+
+    too_few = (n_splits < max_num_walkers) & (walker_weights / (n_splits + 1) >= min_weight)
+    while too_few.any():
+        n_splits[too_few] += 1
+        too_few = (n_splits < max_num_walkers) & (walker_weights / (n_splits + 1) >= min_weight)
+
+    # we want the number of clones so we subtract one from the
+    # number of splits
+    return n_splits - 1
+
+
+
+def _assign_states(args):
+    """Compute the images and the assignments of states to a region tree.
+
+    Parameters
+    ----------
+    args : tuple
+        The region tree, the states, and the already computed images
+        of the states (or None).
+
+    Returns
+    -------
+    pre_assignments : list of tuple
+        The image, assignment, and distances of each state.
+
+    """
+
+    region_tree, states, images = args
+
+    # compute the missing images together
+    images = list(images)
+    image_idxs = [i for i, image in enumerate(images) if image is None]
+    if len(image_idxs) > 0:
+        new_images = region_tree.distance.images([states[i] for i in image_idxs])
+        for i, image in zip(image_idxs, new_images):
+            images[i] = image
+
+    pre_assignments = []
+    for state, image in zip(states, images):
+
+        assignment, distances = region_tree.assign(state, image=image)
+        pre_assignments.append((image, assignment, distances))
+
+    return pre_assignments
+
+class RegionNodes(Mapping):
+    """Read only view of the nodes of a RegionTree.
+
+    This maps the node ids to a dictionary of the node attributes
+    ('image_idx', 'n_walkers', 'walker_idxs', 'n_squashable',
+    'n_possible_clones', and 'balance') like the nodes of a networkx
+    graph. The dictionaries are made from the node arrays of the tree
+    when they are accessed, so changing them doesn't change the tree.
+
+    """
+
+    def __init__(self, region_tree):
+        """Constructor for RegionNodes.
+
+        Parameters
+        ----------
+        region_tree : RegionTree
+
+        """
+
+        self._region_tree = region_tree
+
+    def __getitem__(self, node_id):
+        return self._region_tree._node_attributes(node_id)
+
+    def __iter__(self):
+        for level_node_ids in self._region_tree._level_node_ids:
+            yield from level_node_ids
+
+    def __len__(self):
+        return len(self._region_tree._node_level_idxs)
+
+    def __contains__(self, node_id):
+        return node_id in self._region_tree._node_level_idxs
+
+class RegionTree(object):
     """ """
 
+    # The nodes (regions) are kept in arrays, each node is identified
+    # by its level and its index in that level, these are in the
+    # order the nodes were made so they never change as the tree
+    # grows. The values of the nodes (the number of walkers etc.) are
+    # kept in flat arrays over all the nodes ordered by level where
+    # the nodes of each level start at the offset for that level.
+
     # the strings for choosing a method of solving how deciding how
     # many walkers can be merged together given a group of walkers and
     # the associated algorithm for actually choosing them
@@ -200,9 +325,8 @@ class RegionTree(nx.DiGraph):
                  max_region_sizes=None,
                  distance=None,
                  pmin=None, pmax=None,
-                 merge_method='single'):
-
-        super().__init__()
+                 merge_method='single',
+                 region_index_min_size=None):
 
         if (max_n_regions is None) or \
            (max_region_sizes is None) or \
@@ -229,37 +353,131 @@ class RegionTree(nx.DiGraph):
 
         self._merge_method = merge_method
 
+        # the spatial indices (VPTree) of the images of the children
+        # of regions with many children, which are used for finding
+        # the closest child if a minimum number is given
+        self._region_index_min_size = region_index_min_size
+        self._region_indices = {}
+
         self._walker_weights = []
         self._walker_assignments = []
 
+        self._init_node_arrays()
+
         image_idx = 0
         # get the image using the distance object
         image = self.distance.image(init_state)
         self._images = [image]
 
         parent_id = self.ROOT_NODE
-        self.add_node(parent_id, image_idx=0,
-                      n_walkers=0,
-                      n_squashable=0,
-                      n_possible_clones=0,
-                      balance=0,
-                      walker_idxs=[])
+        self._add_node(parent_id, None, image_idx)
 
         # make the first branch
         for level in range(len(max_n_regions)):
             child_id = parent_id + (0,)
-            self.add_node(child_id, image_idx=image_idx,
-                          n_walkers=0,
-                          n_squashable=0,
-                          n_possible_clones=0,
-                          balance=0,
-                          walker_idxs=[])
-            self.add_edge(parent_id, child_id)
+            self._add_node(child_id, parent_id, image_idx)
             parent_id = child_id
 
         # add the region for this branch to the regions list
         self._regions = [tuple([0 for i in range(self._n_levels)])]
 
+    def _init_node_arrays(self):
+        """Make the empty node arrays for a tree without nodes."""
+
+        # for each level the node ids, the image idxs of the nodes,
+        # the index of the parent of each node in the level above,
+        # and the indices of the children of each node in the level
+        # below
+        self._level_node_ids = [[] for level in range(self._n_levels + 1)]
+        self._level_image_idxs = [[] for level in range(self._n_levels + 1)]
+        self._level_parent_idxs = [[] for level in range(self._n_levels + 1)]
+        self._level_children_idxs = [[] for level in range(self._n_levels + 1)]
+
+        # the index of each node in its level
+        self._node_level_idxs = {}
+
+        # the offsets of each level in the flat node arrays, with the
+        # total number of nodes at the end
+        self._level_offsets = np.zeros(self._n_levels + 2, dtype=int)
+
+        # the flat array of the parent of each node, made when needed
+        self._parent_idxs = None
+
+        # the values of the nodes in flat arrays
+        self._n_walkers = np.zeros(0, dtype=int)
+        self._n_squashable = np.zeros(0, dtype=int)
+        self._n_possible_clones = np.zeros(0, dtype=int)
+        self._balances = np.zeros(0, dtype=int)
+
+        # the index of the node of each walker at each level, of
+        # shape (n_levels + 1, n_walkers)
+        self._walker_level_idxs = np.zeros((self._n_levels + 1, 0), dtype=int)
+
+    def __setstate__(self, state):
+
+        # trees pickled when this class was a networkx graph have the
+        # nodes and their attributes in the graph instead of the
+        # arrays, these are converted
+        graph_nodes = state.pop('_node', None)
+        for graph_key in ('graph', '_adj', '_succ', '_pred', '__networkx_cache__'):
+            state.pop(graph_key, None)
+
+        # or before the regions could have spatial indices
+        state.setdefault('_region_index_min_size', None)
+        state.setdefault('_region_indices', {})
+
+        self.__dict__.update(state)
+
+        if graph_nodes is not None:
+            self._graph_nodes_to_arrays(graph_nodes)
+
+    def _graph_nodes_to_arrays(self, graph_nodes):
+        """Make the node arrays from the nodes of a networkx graph.
+
+        Parameters
+        ----------
+        graph_nodes : dict of tuple of int : dict
+            The node ids mapped to their attributes, in the order they
+            were added to the graph.
+
+        """
+
+        self._init_node_arrays()
+
+        # the nodes were added to the graph in the order they were
+        # made, which is the order of their indices in their levels
+        for node_id, node_attrs in graph_nodes.items():
+
+            if node_id == self.ROOT_NODE:
+                parent_id = None
+            else:
+                parent_id = node_id[:-1]
+
+            self._add_node(node_id, parent_id, node_attrs['image_idx'])
+
+        # the values of the nodes from the last placement of walkers,
+        # in the order of the flat node arrays
+        flat_node_attrs = [graph_nodes[node_id]
+                           for level_node_ids in self._level_node_ids
+                           for node_id in level_node_ids]
+
+        for array_name, attr_key in (('_n_walkers', 'n_walkers'),
+                                     ('_n_squashable', 'n_squashable'),
+                                     ('_n_possible_clones', 'n_possible_clones'),
+                                     ('_balances', 'balance')):
+
+            setattr(self, array_name, np.array([node_attrs.get(attr_key, 0)
+                                                for node_attrs in flat_node_attrs],
+                                               dtype=int))
+
+        # the nodes of the walkers last placed
+        if len(self._walker_assignments) > 0:
+            leaf_level_idxs = np.array([self._node_level_idxs[assignment]
+                                        for assignment in self._walker_assignments],
+                                       dtype=int)
+            walker_node_idxs = self._branch_node_idxs(leaf_level_idxs)
+            self._walker_level_idxs = walker_node_idxs - self._level_offsets[:-1, np.newaxis]
+
     @property
     def merge_method(self):
         """ """
@@ -315,6 +533,112 @@ class RegionTree(nx.DiGraph):
         """ """
         return self._regions
 
+    @property
+    def nodes(self):
+        """The node ids mapped to their attributes."""
+        return RegionNodes(self)
+
+    def _add_node(self, node_id, parent_id, image_idx):
+        """Add a node to the node arrays.
+
+        Parameters
+        ----------
+        node_id : tuple of int
+
+        parent_id : tuple of int or None
+            The parent of the node, None for the root.
+
+        image_idx : int
+
+        """
+
+        level = len(node_id)
+        level_idx = len(self._level_node_ids[level])
+
+        if parent_id is None:
+            parent_level_idx = -1
+        else:
+            parent_level_idx = self._node_level_idxs[parent_id]
+            self._level_children_idxs[level - 1][parent_level_idx].append(level_idx)
+
+        self._level_node_ids[level].append(node_id)
+        self._level_image_idxs[level].append(image_idx)
+        self._level_parent_idxs[level].append(parent_level_idx)
+        self._level_children_idxs[level].append([])
+        self._node_level_idxs[node_id] = level_idx
+
+        # the new node goes at the end of its level in the flat
+        # arrays, with no walkers
+        flat_idx = self._level_offsets[level + 1]
+        self._n_walkers = np.insert(self._n_walkers, flat_idx, 0)
+        self._n_squashable = np.insert(self._n_squashable, flat_idx, 0)
+        self._n_possible_clones = np.insert(self._n_possible_clones, flat_idx, 0)
+        self._balances = np.insert(self._balances, flat_idx, 0)
+
+        self._level_offsets[level + 1:] += 1
+        self._parent_idxs = None
+
+    def _node_idx(self, node_id):
+        """Get the index of a node in the flat node arrays."""
+        return self._level_offsets[len(node_id)] + self._node_level_idxs[node_id]
+
+    def _flat_parent_idxs(self):
+        """Get the flat array of the index of the parent of each node,
+        -1 for the root."""
+
+        if self._parent_idxs is None:
+            self._parent_idxs = np.concatenate(
+                [np.array([-1])] +
+                [np.array(self._level_parent_idxs[level], dtype=int) + self._level_offsets[level - 1]
+                 for level in range(1, self.n_levels + 1)])
+
+        return self._parent_idxs
+
+    def _branch_node_idxs(self, leaf_level_idxs):
+        """Get the nodes on the branches of leaves.
+
+        Parameters
+        ----------
+        leaf_level_idxs : arraylike of int
+            The indices of the leaves in the leaf level.
+
+        Returns
+        -------
+        branch_node_idxs : numpy.ndarray of int of shape (n_levels + 1, n_leaves)
+            The flat index of the node of each branch at each level.
+
+        """
+
+        parent_idxs = self._flat_parent_idxs()
+
+        branch_node_idxs = np.zeros((self.n_levels + 1, len(leaf_level_idxs)), dtype=int)
+        branch_node_idxs[self.n_levels] = self._level_offsets[self.n_levels] + \
+                                          np.asarray(leaf_level_idxs, dtype=int)
+        for level in reversed(range(self.n_levels)):
+            branch_node_idxs[level] = parent_idxs[branch_node_idxs[level + 1]]
+
+        return branch_node_idxs
+
+    def _node_walker_idxs(self, node_id):
+        """Get the indices of the walkers in a node, in order."""
+
+        level = len(node_id)
+        return np.flatnonzero(self._walker_level_idxs[level] ==
+                              self._node_level_idxs[node_id]).tolist()
+
+    def _node_attributes(self, node_id):
+        """Get the attributes of a node as a dictionary."""
+
+        level = len(node_id)
+        node_idx = self._node_idx(node_id)
+
+        return {'image_idx' : self._level_image_idxs[level][self._node_level_idxs[node_id]],
+                'n_walkers' : int(self._n_walkers[node_idx]),
+                'walker_idxs' : self._node_walker_idxs(node_id),
+                'n_squashable' : int(self._n_squashable[node_idx]),
+                'n_possible_clones' : int(self._n_possible_clones[node_idx]),
+                'balance' : int(self._balances[node_idx])}
+
     def add_child(self, parent_id, image_idx):
         """
 
@@ -331,22 +655,17 @@ class RegionTree(nx.DiGraph):
         """
         # make a new child id which will be the next index of the
         # child with the parent id
-        child_id = parent_id + (len(self.children(parent_id)), )
+        child_id = parent_id + (self._n_children(parent_id), )
 
         # create the node with the image_idx
-        self.add_node(child_id,
-                      image_idx=image_idx,
-                      n_walkers=0,
-                      n_squashable=0,
-                      n_possible_clones=0,
-                      balance=0,
-                      walker_idxs=[])
-
-        # make the edge to the child
-        self.add_edge(parent_id, child_id)
+        self._add_node(child_id, parent_id, image_idx)
 
         return child_id
 
+    def _n_children(self, parent_id):
+        """The number of children of a node."""
+        return len(self._level_children_idxs[len(parent_id)][self._node_level_idxs[parent_id]])
+
     def children(self, parent_id):
         """
 
@@ -359,10 +678,12 @@ class RegionTree(nx.DiGraph):
         -------
 
         """
-        children_ids = list(self.adj[parent_id].keys())
-        # sort them
-        children_ids.sort()
-        return children_ids
+
+        # the children are made in order of their ids
+        level = len(parent_id)
+        return [self._level_node_ids[level + 1][child_level_idx]
+                for child_level_idx
+                in self._level_children_idxs[level][self._node_level_idxs[parent_id]]]
 
     def level_nodes(self, level):
         """Get the nodes/regions at the specified level.
@@ -380,8 +701,7 @@ class RegionTree(nx.DiGraph):
         if level > self.n_levels:
             raise ValueError("level is greater than the number of levels for this tree")
 
-        return [node_id for node_id in self.nodes
-                if len(node_id) == level]
+        return list(self._level_node_ids[level])
 
     def leaf_nodes(self):
         """ """
@@ -492,67 +812,85 @@ class RegionTree(nx.DiGraph):
         self._min_num_walkers = None
 
 
-    def assign(self, state):
+    def assign(self, state, image=None):
         """
 
         Parameters
         ----------
         state :
             
+        image : optional
+            The already computed image of the state.
 
         Returns
         -------
 
         """
 
+        # compute the image of the state only once for all the
+        # distance calculations
+        if image is None:
+            image = self.distance.image(state)
+
         assignment = []
         dists = []
 
         # a cache for the distance calculations so they need not be
-        # performed more than once
+        # performed more than once, since the same image is used for
+        # the regions of a branch at different levels
         dist_cache = {}
 
         # perform a n-ary search through the hierarchy of regions by
         # performing a distance calculation to the images at each
         # level starting at the top
         node = self.ROOT_NODE
+        node_level_idx = self._node_level_idxs[node]
         for level in range(self.n_levels):
-            level_nodes = self.children(node)
-
-            # perform a distance calculation to all nodes at this
-            # level
-            image_dists = []
-            for level_node in level_nodes:
-
-                # get the image
-                image_idx = self.node[level_node]['image_idx']
-                image = self.images[image_idx]
-
-                # if this distance is already calculated don't
-                # calculate it again and just get it from the cache
-                if image_idx in dist_cache:
-                    dist = dist_cache[image_idx]
-                # otherwise calculate it and save it in the cache
-                else:
-                    # image of the state
-                    state_image = self.distance.image(state)
-
-                    # there is the possibility of
-                    try:
-                        dist = self.distance.image_distance(state_image, image)
-                    except ValueError:
-                        print("state: ", state.dict())
-                        print("state_image: ", state_image)
-                        print("image: ", image)
-                        raise ValueError("If you have triggered this error you have"
-                                         " encountered a rare bug. Please attempt to"
-                                         " report this using the printed outputs.")
-
-                    # save in the dist_cache
-                    dist_cache[image_idx] = dist
-
-                # add it to the dists for this state
-                image_dists.append(dist)
+            children_level_idxs = self._level_children_idxs[level][node_level_idx]
+            level_image_idxs = [self._level_image_idxs[level + 1][child_level_idx]
+                                for child_level_idx in children_level_idxs]
+
+            # search the index of the children images if there are
+            # many
+            if self._region_index_min_size is not None and \
+               len(children_level_idxs) >= self._region_index_min_size:
+
+                level_closest_child_idx, level_closest_image_dist = \
+                                    self._nearest_child(node, level_image_idxs, image)
+
+                closest_image_idx = level_image_idxs[level_closest_child_idx]
+                dist_cache[closest_image_idx] = level_closest_image_dist
+
+                assignment.append(level_closest_child_idx)
+                dists.append(level_closest_image_dist)
+
+                node = node + (level_closest_child_idx,)
+                node_level_idx = children_level_idxs[level_closest_child_idx]
+
+                continue
+
+            # calculate the distances to all the images at this
+            # level not already calculated in one call
+            new_image_idxs = [image_idx for image_idx in dict.fromkeys(level_image_idxs)
+                              if image_idx not in dist_cache]
+
+            if len(new_image_idxs) > 0:
+
+                # there is the possibility of
+                try:
+                    new_dists = self.distance.image_distances(
+                        [image], [self.images[image_idx] for image_idx in new_image_idxs])[0]
+                except ValueError:
+                    print("state: ", state.dict())
+                    print("state_image: ", image)
+                    print("images: ", [self.images[image_idx] for image_idx in new_image_idxs])
+                    raise ValueError("If you have triggered this error you have"
+                                     " encountered a rare bug. Please attempt to"
+                                     " report this using the printed outputs.")
+
+                dist_cache.update(zip(new_image_idxs, new_dists))
+
+            image_dists = [dist_cache[image_idx] for image_idx in level_image_idxs]
 
             # get the index of the image that is closest
             level_closest_child_idx = np.argmin(image_dists)
@@ -564,10 +902,96 @@ class RegionTree(nx.DiGraph):
             dists.append(level_closest_image_dist)
 
             # set this node as the next node
-            node = level_nodes[level_closest_child_idx]
+            node = node + (int(level_closest_child_idx),)
+            node_level_idx = children_level_idxs[level_closest_child_idx]
 
         return tuple(assignment), tuple(dists)
 
+    def _nearest_child(self, parent_id, image_idxs, image):
+        """Find the child region with the closest image using the spatial
+        index of the children of a region.
+
+        The index is built the first time it is needed and rebuilt
+        when many children have been added since, the distances to
+        the children added since it was built are computed directly.
+
+        Parameters
+        ----------
+        parent_id : tuple of int
+            The region whose children are searched.
+
+        image_idxs : list of int
+            The image idxs of the children of the region in order.
+
+        image : image
+            The image of the state being assigned.
+
+        Returns
+        -------
+        child_idx : int
+            The index of the closest child, the lowest one for ties.
+
+        dist : float
+            The distance to the image of the closest child.
+
+        """
+
+        index = self._region_indices.get(parent_id)
+        if index is None or \
+           len(image_idxs) - len(index) > max(index.leaf_size, len(index) // 4):
+
+            index = VPTree(self.distance, [self.images[image_idx] for image_idx in image_idxs])
+            self._region_indices[parent_id] = index
+
+        child_idx, dist = index.nearest(image)
+
+        # the children added since the index was built come after
+        # the indexed ones so only win when strictly closer
+        n_indexed = len(index)
+        if n_indexed < len(image_idxs):
+            new_dists = self.distance.image_distances(
+                [image], [self.images[image_idx] for image_idx in image_idxs[n_indexed:]])[0]
+
+            for new_child_idx, new_dist in enumerate(new_dists, start=n_indexed):
+                if new_dist < dist:
+                    child_idx, dist = new_child_idx, new_dist
+
+        return int(child_idx), dist
+
+    def _map_assign(self, walkers, images, map_func, n_chunks):
+        """Compute the images and assignments of walkers to the current
+        tree with a map function.
+
+        Parameters
+        ----------
+        walkers : list of walkers
+
+        images : list
+            The already computed images of the walker states, None
+            for any that need to be computed.
+
+        map_func : callable
+
+        n_chunks : int
+
+        Returns
+        -------
+        pre_assignments : list of tuple
+            The image, assignment, and distances of each walker.
+
+        """
+
+        # chunks of consecutive walkers
+        chunk_size = max(1, -(-len(walkers) // n_chunks))
+        chunks = [(self,
+                   [walker.state for walker in walkers[start:start + chunk_size]],
+                   images[start:start + chunk_size])
+                  for start in range(0, len(walkers), chunk_size)]
+
+        return [pre_assignment
+                for chunk_pre_assignments in map_func(_assign_states, chunks)
+                for pre_assignment in chunk_pre_assignments]
+
     def clear_walkers(self):
         """Remove all walkers from the regions."""
 
@@ -575,41 +999,90 @@ class RegionTree(nx.DiGraph):
         self._walker_assignments = []
         self._walker_weights = []
 
-        # set all the node attributes to their defaults
-        for node_id in self.nodes:
-            self.node[node_id]['n_walkers'] = 0
-            self.node[node_id]['walker_idxs'] = []
+        # set all the node values to their defaults
+        n_nodes = self._level_offsets[-1]
+        self._n_walkers = np.zeros(n_nodes, dtype=int)
+        self._n_squashable = np.zeros(n_nodes, dtype=int)
+        self._n_possible_clones = np.zeros(n_nodes, dtype=int)
+        self._balances = np.zeros(n_nodes, dtype=int)
 
-            self.node[node_id]['n_squashable'] = 0
-            self.node[node_id]['n_possible_clones'] = 0
-            self.node[node_id]['balance'] = 0
+        self._walker_level_idxs = np.zeros((self.n_levels + 1, 0), dtype=int)
 
 
-    def place_walkers(self, walkers):
+    def place_walkers(self, walkers, images=None, map_func=None, n_chunks=1):
         """
 
         Parameters
         ----------
         walkers :
             
+        images : list, optional
+            The already computed images of the walker states, None
+            for any that need to be computed.
+
+        map_func : callable, optional
+            A map function (e.g. the `map` method of a process pool)
+            used to compute the images and assignments of all the
+            walkers to the current tree in parallel, in `n_chunks`
+            chunks of walkers. Walkers whose assignment could be
+            changed by the regions made for the walkers before them
+            are then assigned again, so the placement is identical to
+            placing them one at a time.
+
+        n_chunks : int
+            The number of chunks of walkers given to the map function.
+           (Default = 1)
 
         Returns
         -------
 
         """
 
+        if images is None:
+            images = [None for walker in walkers]
+
+        # assign all the walkers to the current tree in parallel
+        if map_func is not None:
+            pre_assignments = self._map_assign(walkers, images, map_func, n_chunks)
+
+        # otherwise compute the missing images together
+        else:
+            images = list(images)
+            image_idxs = [i for i, image in enumerate(images) if image is None]
+            if len(image_idxs) > 0:
+                new_images = self.distance.images([walkers[i].state for i in image_idxs])
+                for i, image in zip(image_idxs, new_images):
+                    images[i] = image
+
         # clear all the walkers and reset node attributes to defaults
         self.clear_walkers()
 
         # keep track of new branches made
         new_branches = []
 
+        # the regions given new children while placing walkers
+        branched_parent_ids = []
+
         # place each walker
         for walker_idx, walker in enumerate(walkers):
 
-            # assign the state of the walker to the tree and get the
-            # distances to the images at each level
-            assignment, distances = self.assign(walker.state)
+            if map_func is not None:
+                image, assignment, distances = pre_assignments[walker_idx]
+
+                # only a new child of a region on the walker's path
+                # could change its assignment
+                if any(assignment[:len(parent_id)] == parent_id
+                       for parent_id in branched_parent_ids):
+                    assignment, distances = self.assign(walker.state, image=image)
+
+            else:
+                # the image of the walker is used for the assignment and
+                # for a new region so only make it once
+                image = images[walker_idx]
+
+                # assign the state of the walker to the tree and get the
+                # distances to the images at each level
+                assignment, distances = self.assign(walker.state, image=image)
 
             # check the distances going down the levels to see if a
             # branching (region creation) is necessary
@@ -619,11 +1092,11 @@ class RegionTree(nx.DiGraph):
                 # not above max number of regions we have found a new
                 # region so we branch the region_tree at that level
                 if distance > self.max_region_sizes[level] and \
-                   len(self.children(assignment[:level])) < self.max_n_regions[level]:
+                   self._n_children(assignment[:level]) < self.max_n_regions[level]:
 
-                    # make an image for the region
-                    image = self.distance.image(walker.state)
+                    # the walker's image is the image for the region
                     parent_id = assignment[:level]
+                    branched_parent_ids.append(parent_id)
 
                     # make the new branch
                     assignment = self.branch_tree(parent_id, image)
@@ -642,51 +1115,53 @@ class RegionTree(nx.DiGraph):
             self._walker_assignments.append(assignment)
             self._walker_weights.append(walker.weight)
 
-            # go back through the nodes in this walker's branch
-            # increase the n_walkers for each node, and save the
-            # walkers (index in self.walker_assignments) it has, and
-            # save increase the number above pmin if valid
-            for level in range(len(assignment) + 1):
-                node_id = assignment[:level]
+        # the node of each walker at each level, walkers are counted
+        # in all the nodes on the branch of their leaf
+        leaf_level_idxs = np.array([self._node_level_idxs[assignment]
+                                    for assignment in self._walker_assignments], dtype=int)
+        walker_node_idxs = self._branch_node_idxs(leaf_level_idxs)
+        self._walker_level_idxs = walker_node_idxs - self._level_offsets[:-1, np.newaxis]
 
-                self.node[node_id]['n_walkers'] += 1
-                self.node[node_id]['walker_idxs'].append(walker_idx)
+        n_nodes = self._level_offsets[-1]
+        self._n_walkers = np.bincount(walker_node_idxs.ravel(), minlength=n_nodes)
 
         # We also want to find out some details about the ability of
         # the leaf nodes to clone and merge walkers. This is useful
         # for being able to balance the tree. Once this has been
         # figured out for the leaf nodes we want to aggregate these
         # numbers for the higher level regions
-        for node_id in self.leaf_nodes():
-
-            leaf_walker_idxs = self.node[node_id]['walker_idxs']
-            leaf_weights = [self.walker_weights[i] for i in leaf_walker_idxs]
-
-            # first figure out how many walkers are squashable (AKA
-            # reducible)
-            n_squashable = self._calc_squashable_walkers(leaf_weights)
-
-            # get the max number of clones for each walker and sum
-            # them up to get the total number of cloneable walkers
-            walker_max_n_clones = [self._calc_max_num_clones(walker_weight)
-                                   for walker_weight in leaf_weights]
-            n_possible_clones = sum(walker_max_n_clones)
 
-            # actually set them as attributes for the node
-            self.node[node_id]['n_squashable'] = n_squashable
-            self.node[node_id]['n_possible_clones'] = n_possible_clones
-
-            # also add this amount to all of the nodes above it
-
-            # n_squashable
-            for level in reversed(range(self.n_levels)):
-                branch_node_id = node_id[:level]
-                self.node[branch_node_id]['n_squashable'] += n_squashable
-
-            # n_posssible_clones
-            for level in reversed(range(self.n_levels)):
-                branch_node_id = node_id[:level]
-                self.node[branch_node_id]['n_possible_clones'] += n_possible_clones
+        # first figure out how many walkers are squashable (AKA
+        # reducible) in each leaf with walkers, grouping the weights
+        # of the walkers by leaf
+        n_leaves = len(self._level_node_ids[self.n_levels])
+        leaf_n_squashable = np.zeros(n_leaves, dtype=int)
+
+        walker_order = np.argsort(leaf_level_idxs, kind='stable')
+        occupied_leaf_idxs, leaf_starts = np.unique(leaf_level_idxs[walker_order],
+                                                    return_index=True)
+        leaves_weights = np.split(np.array(self._walker_weights)[walker_order], leaf_starts[1:])
+
+        for leaf_level_idx, leaf_weights in zip(occupied_leaf_idxs, leaves_weights):
+            leaf_n_squashable[leaf_level_idx] = self._calc_squashable_walkers(leaf_weights.tolist())
+
+        # and add them up for the nodes on the branch of each leaf
+        leaf_node_idxs = self._branch_node_idxs(np.arange(n_leaves))
+        self._n_squashable = np.bincount(leaf_node_idxs.ravel(),
+                                         weights=np.tile(leaf_n_squashable, self.n_levels + 1),
+                                         minlength=n_nodes).astype(int)
+
+        # get the max number of clones for each walker and sum them
+        # up for all the nodes on its branch to get the total number
+        # of cloneable walkers
+        walker_max_n_clones = self._calc_max_nums_clones(self._walker_weights)
+        self._n_possible_clones = np.bincount(walker_node_idxs.ravel(),
+                                              weights=np.tile(walker_max_n_clones,
+                                                              self.n_levels + 1),
+                                              minlength=n_nodes).astype(int)
+
+        # no balances have been decided yet
+        self._balances = np.zeros(n_nodes, dtype=int)
 
         return new_branches
 
@@ -800,15 +1275,32 @@ class RegionTree(nx.DiGraph):
 
         return calc_max_num_clones(walker_weight, self.pmin, self.max_num_walkers)
 
-    def _propagate_and_balance_shares(self, parental_balance, children_node_ids):
+    def _calc_max_nums_clones(self, walker_weights):
         """
 
         Parameters
         ----------
-        parental_balance :
+        walker_weights : arraylike of float
             
-        children_node_ids :
+
+        Returns
+        -------
+        max_n_clones : numpy.ndarray of int
+
+        """
+
+        return calc_max_nums_clones(walker_weights, self.pmin, self.max_num_walkers)
+
+    def _propagate_and_balance_shares(self, parental_balance, children_node_idxs):
+        """
+
+        Parameters
+        ----------
+        parental_balance :
             
+        children_node_idxs : numpy.ndarray of int
+            The indices of the children in the flat node arrays, in
+            order.
 
         Returns
         -------
@@ -818,44 +1310,31 @@ class RegionTree(nx.DiGraph):
 
         # talk about "shares" which basically are the number of
         # slots/replicas that will be allocated to this region for
-        # running sampling on
+        # running sampling on, these are arrays over the children
 
         # we get the current number of shares for each child
-        orig_children_shares = {child_id : len(self.node[child_id]['walker_idxs'])
-                           for child_id in children_node_ids}
-
-        # the copy to use as a tally of the shares
-        children_shares = copy(orig_children_shares)
+        orig_children_shares = self._n_walkers[children_node_idxs]
 
         # the donatable (squashable) walkers to start with
-        children_donatable_shares = {child_id : self.node[child_id]['n_squashable']
-                                     for child_id in children_node_ids}
+        children_donatable_shares = self._n_squashable[children_node_idxs]
 
-        # the donatable (squashable) walkers to start with
-        children_receivable_shares = {child_id : self.node[child_id]['n_possible_clones']
-                                     for child_id in children_node_ids}
+        # the receivable (cloneable) walkers to start with
+        children_receivable_shares = self._n_possible_clones[children_node_idxs]
 
         # Our first goal in this subroutine is to dispense a parental
         # balance to it's children in a simply valid manner
         children_dispensations = self._dispense_parental_shares(
-                                           parental_balance, children_shares,
+                                           parental_balance, orig_children_shares,
                                            children_donatable_shares,
                                            children_receivable_shares)
 
-        for child_id, dispensation in children_dispensations.items():
-
-            # update the shares, donatables, and receivables which we
-            # will then balance between regions
-            children_shares[child_id] += dispensation
-
-
-            # add the dispensation to the number of the donatable
-            # shares
-            children_donatable_shares[child_id] += dispensation
-
-            # subtract the dispensation from the number of receivable
-            # shares
-            children_receivable_shares[child_id] -= dispensation
+        # update the shares, donatables, and receivables which we
+        # will then balance between regions. The dispensation is
+        # added to the number of the donatable shares and subtracted
+        # from the number of receivable shares
+        children_shares = orig_children_shares + children_dispensations
+        children_donatable_shares = children_donatable_shares + children_dispensations
+        children_receivable_shares = children_receivable_shares - children_dispensations
 
         # Now that we have dispensed the shares to the children in a
         # valid way we use an algorithm to now distribute the shares
@@ -866,22 +1345,18 @@ class RegionTree(nx.DiGraph):
 
 
         # calculate the net change in the balances for each region
-        net_balances = {child_id : children_shares[child_id] - orig_children_shares[child_id]
-                        for child_id in children_shares.keys()}
+        net_balances = children_shares - orig_children_shares
 
-        children_balances = [balance for balance in net_balances.values()]
-        if sum(children_balances) != parental_balance:
+        if net_balances.sum() != parental_balance:
 
             raise RegionTreeError(
                 "The balances of the child nodes ({}) do not balance to the parental balance ({})".format(
-                    children_balances, parental_balance))
+                    net_balances.tolist(), parental_balance))
 
         # no state changes to the object have been made up until this
         # point, but now that the net change in the balances for the
         # children have been generated we set them into their nodes
-        for child_node_id, child_net_balance in net_balances.items():
-
-            self.node[child_node_id]['balance'] = child_net_balance
+        self._balances[children_node_idxs] = net_balances
 
 
     def _dispense_parental_shares(self, parental_balance, children_shares,
@@ -900,35 +1375,32 @@ class RegionTree(nx.DiGraph):
         ----------
         parental_balance :
             
-        children_shares :
+        children_shares : numpy.ndarray of int
             
-        children_donatable_shares :
+        children_donatable_shares : numpy.ndarray of int
             
-        children_receivable_shares :
+        children_receivable_shares : numpy.ndarray of int
             
 
         Returns
         -------
+        children_dispensations : numpy.ndarray of int
 
         """
 
         # this will be the totaled up dispensations for each child
         # region
-        children_dispensations = {child_id : 0 for child_id in children_shares.keys()}
+        children_dispensations = np.zeros(len(children_shares), dtype=int)
 
         # if there is only one child it just inherits all of the
         # balance no matter what
-        if len(children_shares.keys()) == 1:
-
-            child_node_id = list(children_shares.keys())[0]
+        if len(children_shares) == 1:
 
-            # we put the shares for this only child in a dictionary
-            # like the other methods would produce
-            children_dispensations[child_node_id] = parental_balance
+            children_dispensations[0] = parental_balance
 
         # there are more than one child so we accredit balances
         # between them
-        elif len(children_shares.keys()) > 1:
+        elif len(children_shares) > 1:
 
             # if the parent has a non-zero balance we either
             # increase (clone) or decrease (merge) the balance
@@ -963,66 +1435,38 @@ class RegionTree(nx.DiGraph):
         ----------
         parental_balance :
             
-        children_shares :
+        children_shares : numpy.ndarray of int
             
-        children_donatable_shares :
+        children_donatable_shares : numpy.ndarray of int
             
 
         Returns
         -------
+        children_dispensations : numpy.ndarray of int
 
         """
 
-        children_donatable_shares = copy(children_donatable_shares)
+        # dispense the negative shares as quickly as possible, they
+        # will be balanced later. Going through the children in
+        # order each pays as much of the remaining debt as it has
+        # squashable walkers for, so the total paid after each child
+        # is the running sum of the donatable shares up to the debt
+        paid_debt = np.minimum(np.cumsum(np.maximum(children_donatable_shares, 0)),
+                               abs(parental_balance))
 
-        children_dispensations = {child_id : 0 for child_id in children_shares.keys()}
+        # if the parental balance is still not zero after all the
+        # children then the children cannot balance it given their
+        # constraints and there is an error
+        if len(paid_debt) == 0 or paid_debt[-1] < abs(parental_balance):
+            raise RegionTreeError("Children cannot pay their parent's debt")
 
-        # list of the keys so we can iterate through them
-        children_node_ids = list(children_shares.keys())
-
-        # dispense the negative shares as quickly as possible,
-        # they will be balanced later
-        child_iter = iter(children_node_ids)
-        remaining_balance = parental_balance
-        while remaining_balance < 0:
-            # get the node id
-            try:
-                child_node_id = next(child_iter)
-            except StopIteration:
-                # if the parental balance is still not zero and there
-                # are no more children then the children cannot
-                # balance it given their constraints and there is an
-                # error
-                raise RegionTreeError("Children cannot pay their parent's debt")
-
-            n_donatable = children_donatable_shares[child_node_id]
-
-            # if this child has any squashable walkers
-            if n_donatable > 0:
-
-                # we use those for paying the parent's debt
-
-                # the amount of the parental debt that can be
-                # paid (the payment) for this child region is
-                # either the number of squashable walkers or
-                # the absolute value of the parental balance
-                # (since it is negative for debts), whichever
-                # is smaller
-                payment = min(n_donatable, abs(remaining_balance))
-
-                # take this from the remaining balance
-                remaining_balance += payment
-
-                # and take it away from the childs due balance and shares
-                children_dispensations[child_node_id] -= payment
-
-                # also account for that in its donatable shares
-                children_donatable_shares[child_node_id] -= payment
+        # the payments are taken away from the childs due balance
+        children_dispensations = -np.diff(paid_debt, prepend=0)
 
         # double check the balance is precisely 0, we want to
         # dispense all the shares as well as not accidentally
         # overdispensing
-        assert remaining_balance == 0, "balance is not 0"
+        assert children_dispensations.sum() == parental_balance, "balance is not 0"
 
 
         return children_dispensations
@@ -1035,119 +1479,72 @@ class RegionTree(nx.DiGraph):
         ----------
         parental_balance :
             
-        children_shares :
+        children_shares : numpy.ndarray of int
             
-        children_receivable_shares :
+        children_receivable_shares : numpy.ndarray of int
             
 
         Returns
         -------
+        children_dispensations : numpy.ndarray of int
 
         """
 
-        children_receivable_shares = copy(children_receivable_shares)
+        # dispense the shares to the able children as quickly as
+        # possible, they will be redistributed in the next step. Going
+        # through the children in order each is given as much of the
+        # remaining balance as it can clone walkers for, so the total
+        # given after each child is the running sum of the receivable
+        # shares up to the balance
+        given_credit = np.minimum(np.cumsum(np.maximum(children_receivable_shares, 0)),
+                                  parental_balance)
 
-        children_dispensations = {child_id : 0 for child_id in children_shares.keys()}
+        # if the parental balance is still not zero after all the
+        # children then the children cannot balance it given their
+        # constraints and there is an error
+        if len(given_credit) == 0 or given_credit[-1] < parental_balance:
+            raise RegionTreeError("Children cannot accept their parent's credit")
 
-        # list of the keys so we can iterate through them
-        children_node_ids = list(children_shares.keys())
-
-        # dispense the shares to the able children as quickly
-        # as possible, they will be redistributed in the next
-        # step
-        child_iter = iter(children_node_ids)
-        remaining_balance = parental_balance
-        while remaining_balance > 0:
-
-            # get the node id
-            try:
-                child_node_id = next(child_iter)
-            except StopIteration:
-                # if the parental balance is still not zero and there
-                # are no more children then the children cannot
-                # balance it given their constraints and there is an
-                # error
-                raise RegionTreeError("Children cannot accept their parent's credit")
-
-            # give as much of the parental balance as we can
-            # to the walkers. In the next step all this
-            # balance will be shared among the children so all
-            # we need to do is dispense all the shares without
-            # care as to who gets them, as long as they can
-            # keep it
-            n_receivable = children_receivable_shares[child_node_id]
-
-            # the amount to be disbursed to this region is
-            # either the number of possible clones (the
-            # maximum it can receive) or the full parental
-            # balance, whichever is smaller
-            disbursement = min(n_receivable, abs(remaining_balance))
-
-            # give this disbursement by taking away from the
-            # positive balance
-            remaining_balance -= disbursement
-
-            # add these shares to the net balances and share
-            # totals
-            children_dispensations[child_node_id] += disbursement
-
-            # also subtract this from the number of receivable shares
-            # for the child
-            children_receivable_shares[child_node_id] -= disbursement
+        children_dispensations = np.diff(given_credit, prepend=0)
 
         # double check the balance is precisely 0, we want to
         # dispense all the shares as well as not accidentally
         # overdispensing
-        assert remaining_balance == 0, "balance is not 0"
+        assert children_dispensations.sum() == parental_balance, "balance is not 0"
 
         return children_dispensations
 
     def _balance_children_shares(self, children_shares,
                                  children_donatable_shares,
                                  children_receivable_shares):
-        """Given a dictionary mapping the child node_ids to the total number
-        of shares they currently hold we balance between them in order
-        to get an even distribution of the shares as possible.
+        """Given an array of the total number of shares the children nodes
+        currently hold we balance between them in order to get an even
+        distribution of the shares as possible.
 
         Parameters
         ----------
-        children_shares :
+        children_shares : numpy.ndarray of int
             
-        children_donatable_shares :
+        children_donatable_shares : numpy.ndarray of int
             
-        children_receivable_shares :
+        children_receivable_shares : numpy.ndarray of int
             
 
         Returns
         -------
+        children_shares : numpy.ndarray of int
 
         """
 
-        children_shares = copy(children_shares)
+        children_shares = children_shares.copy()
+        children_donatable_shares = children_donatable_shares.copy()
+        children_receivable_shares = children_receivable_shares.copy()
 
         # generate the actual donation pair and the amount that should
-        # be donated for the best outcome
-        donor_node_id, acceptor_node_id, donation_amount = \
-                                    self._gen_best_donation(children_shares,
-                                                            children_donatable_shares,
-                                                            children_receivable_shares)
-
-        # if the donation amount is zero we make no donation
-        if donation_amount > 0:
-
-            # account for this donation in the shares
-            children_shares[donor_node_id] -= donation_amount
-            children_shares[acceptor_node_id] += donation_amount
-
-            # subtract the donation donatable_shares from the donor
-            # and add the donation to the donatable_shares of the
-            # acceptor
-            children_donatable_shares[donor_node_id] -= donation_amount
-            children_donatable_shares[acceptor_node_id] += donation_amount
-
-            # do the opposite to the receivable shares
-            children_receivable_shares[donor_node_id] += donation_amount
-            children_receivable_shares[acceptor_node_id] -= donation_amount
+        # be donated for the best outcome and make it
+        donation_amount = self._make_best_donation(children_shares,
+                                                   children_donatable_shares,
+                                                   children_receivable_shares)
 
         # we have decided the first donation, however more will be
         # performed as long as the amount of the donation is either 0
@@ -1156,8 +1553,7 @@ class RegionTree(nx.DiGraph):
         # balance and the latter in an odd scenario and the last odd
         # share would get passed back and forth
 
-        # we keep track of the previous donation, and initialize it to
-        # None for now
+        # we keep track of the previous donation
         previous_donation_amount = donation_amount
 
         while (donation_amount > 0) and \
@@ -1166,52 +1562,76 @@ class RegionTree(nx.DiGraph):
             # update the previous donation amount
             previous_donation_amount = donation_amount
 
-            # get the next best donation
-            donor_node_id, acceptor_node_id, donation_amount = \
-                                            self._gen_best_donation(children_shares,
-                                                                    children_donatable_shares,
-                                                                    children_receivable_shares)
+            # make the next best donation
+            donation_amount = self._make_best_donation(children_shares,
+                                                       children_donatable_shares,
+                                                       children_receivable_shares)
+
+        return children_shares
+
+
+    def _make_best_donation(self, children_shares,
+                                  children_donatable_shares,
+                                  children_receivable_shares):
+        """Generate the best donation and account for it in the arrays
+        of shares, which are modified in place.
+
+        Parameters
+        ----------
+        children_shares : numpy.ndarray of int
+            
+        children_donatable_shares : numpy.ndarray of int
+            
+        children_receivable_shares : numpy.ndarray of int
+            
 
-            # if there is a donation to be made make it
-            if donation_amount > 0:
+        Returns
+        -------
+        donation_amount : int
 
-                # account for this donation in the shares
-                children_shares[donor_node_id] -= donation_amount
-                children_shares[acceptor_node_id] += donation_amount
+        """
 
-                # subtract the donation donatable_shares from the donor
-                # and add the donation to the donatable_shares of the
-                # acceptor
-                children_donatable_shares[donor_node_id] -= donation_amount
-                children_donatable_shares[acceptor_node_id] += donation_amount
+        donor_idx, acceptor_idx, donation_amount = \
+                                self._gen_best_donation(children_shares,
+                                                        children_donatable_shares,
+                                                        children_receivable_shares)
 
-                # do the opposite to the receivable shares
-                children_receivable_shares[donor_node_id] += donation_amount
-                children_receivable_shares[acceptor_node_id] -= donation_amount
+        # if the donation amount is zero we make no donation
+        if donation_amount > 0:
 
+            # account for this donation in the shares
+            children_shares[donor_idx] -= donation_amount
+            children_shares[acceptor_idx] += donation_amount
 
+            # subtract the donation donatable_shares from the donor
+            # and add the donation to the donatable_shares of the
+            # acceptor
+            children_donatable_shares[donor_idx] -= donation_amount
+            children_donatable_shares[acceptor_idx] += donation_amount
 
-        return children_shares
+            # do the opposite to the receivable shares
+            children_receivable_shares[donor_idx] += donation_amount
+            children_receivable_shares[acceptor_idx] -= donation_amount
 
+        return donation_amount
 
     def _gen_best_donation(self, children_shares,
                                  children_donatable_shares,
                                  children_receivable_shares):
         """Given a the children shares generate the best donation. Returns the
-        donor_node_id the acceptor_node_id and the donation that
+        index of the donor and acceptor children and the donation that
         should be done between them and that will be guaranteed to be
-        valid. (this is done by checking the attributes of the regions
-        node however, no changes to node state are performed)
+        valid. (no changes to node state are performed)
         
-        returns donor_node_id, acceptor_node_id, donation_amount
+        returns donor_idx, acceptor_idx, donation_amount
 
         Parameters
         ----------
-        children_shares :
+        children_shares : numpy.ndarray of int
             
-        children_donatable_shares :
+        children_donatable_shares : numpy.ndarray of int
             
-        children_receivable_shares :
+        children_receivable_shares : numpy.ndarray of int
             
 
         Returns
@@ -1232,117 +1652,48 @@ class RegionTree(nx.DiGraph):
         # object because so this can be done in an iterative manner
         # before modifying the node attributes.
 
-        # default values for the results
-        best_pair = (None, None)
-        best_donation_amount = 0
-
         # if there are not enough children regions to acutally make
-        # pairings between then we just return the default negative
-        # result
+        # pairings between then we just return no donation
         if len(children_shares) < 2:
-            donor_node_id, acceptor_node_id = best_pair
-            return donor_node_id, acceptor_node_id, best_donation_amount
-
-
-        # we want to get the list of pairings where each pairing is
-        # (donor, acceptor)
-        pairings = []
-        for a, b in it.combinations(children_shares.keys(), 2):
+            return None, None, 0
 
-
-            # find the largest difference comparing (a,b) and (b,a),
-            # this will give the donor, acceptor pair
-            permutations = [(a,b), (b,a)]
-            perm_idx = np.argmax([children_shares[i] - children_shares[j]
-                               for i, j in permutations])
-
-            donor_acceptor_pair = permutations[perm_idx]
-
-            pairings.append(donor_acceptor_pair)
+        # we want the pairings (donor, acceptor) of every pair of
+        # children where the one with more shares is the donor, the
+        # first child for ties
+        a_idxs, b_idxs = np.triu_indices(len(children_shares), 1)
+        swap = children_shares[b_idxs] > children_shares[a_idxs]
+        donor_idxs = np.where(swap, b_idxs, a_idxs)
+        acceptor_idxs = np.where(swap, a_idxs, b_idxs)
 
         # to find the best match we first calculate the differences in
-        # the number of shares for each possible pairing between
-        # children shares
-        pairings_differences = [children_shares[donor_id] - children_shares[acceptor_id]
-                                for donor_id, acceptor_id in pairings]
-
-        pairings_donations = []
-        # then we find all the non-zero pairings
-        for i, difference in enumerate(pairings_differences):
-
-            # if there is a positive difference then we calculate what
-            # the largest donation would be
-            if difference > 0:
+        # the number of shares for each pairing
+        pairings_differences = children_shares[donor_idxs] - children_shares[acceptor_idxs]
 
-                donor_node_id, acceptor_node_id = pairings[i]
+        # then the largest donation for the pairings with a positive
+        # difference
+        pairings_donations = np.where(pairings_differences > 0,
+                                      self._calc_share_donation(
+                                          children_shares[donor_idxs],
+                                          children_shares[acceptor_idxs],
+                                          children_donatable_shares[donor_idxs],
+                                          children_receivable_shares[acceptor_idxs]),
+                                      0)
 
-                # get the total numbers of shares for each
-                donor_n_shares = children_shares[donor_node_id]
-                acceptor_n_shares = children_shares[acceptor_node_id]
+        # the best donation is the positive donation of the pairing
+        # that has the highest difference then the largest donation,
+        # note there may be other pairings with the same numbers, of
+        # which the last children are chosen
+        donating_pairs = np.flatnonzero(pairings_donations > 0)
 
-                # as well as the donatable and receivable shares
-                donor_donatable_shares = children_donatable_shares[donor_node_id]
-                acceptor_receivable_shares = children_receivable_shares[acceptor_node_id]
+        if len(donating_pairs) == 0:
+            return None, None, 0
 
-                # actually calculate the maximum donation
-                donation_amount = self._calc_share_donation(donor_n_shares, acceptor_n_shares,
-                                                            donor_donatable_shares,
-                                                            acceptor_receivable_shares)
+        best_pair = donating_pairs[np.lexsort((acceptor_idxs[donating_pairs],
+                                               donor_idxs[donating_pairs],
+                                               pairings_donations[donating_pairs],
+                                               pairings_differences[donating_pairs]))[-1]]
 
-                pairings_donations.append(donation_amount)
-
-            # if there is no difference then the donation amount will also be zero
-            else:
-                pairings_donations.append(0)
-
-        # now we can zip them all together and then sort them such
-        # that we first sort on the size of the number of shares and
-        # then on the size of the donation
-        pair_values = list(zip(pairings_differences, pairings_donations, pairings))
-        pair_values.sort()
-        # largest to smallest
-        pair_values.reverse()
-
-        # now we take the pairing that has the highest difference and
-        # has a nonzero donation size. Note there may be other
-        # pairings with the same numbers that will just be ignored.
-        pair_iter = iter(pair_values)
-
-
-        # loop through until the first best donation is found.
-        # get the first pairing
-        try:
-            diff, donation, pairing = next(pair_iter)
-        except StopIteration:
-            raise RegionTreeError("No pairings to make donations between")
-
-        done = False
-        while not done:
-
-            # since the pair_values are sorted first by the total diff
-            # and then the donation size, the first one that has a
-            # positive donation is the best donation
-            if donation > 0:
-                best_pair = pairing
-                best_donation_amount = donation
-                done = True
-
-            # try to get the next pairing if there is one
-            try:
-                diff, donation, pairing = next(pair_iter)
-            except StopIteration:
-                # we are done, use the last pairing we had as the
-                # pair, its just as good as any of the others let the
-                # calling method decide what to do in this situation
-                best_pair = pairing
-                break
-
-
-        # now we have the best donation and the pair is already in the
-        # donor, acceptor order from when we created it
-        donor_node_id, acceptor_node_id = best_pair
-
-        return donor_node_id, acceptor_node_id, best_donation_amount
+        return donor_idxs[best_pair], acceptor_idxs[best_pair], pairings_donations[best_pair]
 
 
     def _find_best_donation_pair(self, children_donatable_shares,
@@ -1457,14 +1808,15 @@ class RegionTree(nx.DiGraph):
         # To decide how many it shall give we first propose a desired
         # donation that will make them the most similar, rounding down
         # (i.e. midpoint)
-        desired_donation = math.floor((donor_n_shares - acceptor_n_shares)/2)
+        desired_donation = (donor_n_shares - acceptor_n_shares) // 2
 
         # however, the donor only has a certain capability of donation
         # and the acceptor has a certain capacity of receiving. Out of
-        # the three we can only actually donate the smallest amount
-        actual_donation = min(desired_donation,
-                              donor_donatable_shares,
-                              acceptor_receivable_shares)
+        # the three we can only actually donate the smallest
+        # amount. These may be arrays of the values for many pairs
+        actual_donation = np.minimum(np.minimum(desired_donation,
+                                                donor_donatable_shares),
+                                     acceptor_receivable_shares)
 
         return actual_donation
 
@@ -1490,13 +1842,13 @@ class RegionTree(nx.DiGraph):
         walker_idxs = list(range(len(merge_groups)))
 
         # the balance of this leaf
-        leaf_balance = self.node[leaf]['balance']
+        leaf_balance = int(self._balances[self._node_idx(leaf)])
 
         # there should not be any taken walkers in this leaf since a
         # leaf should only have this method run for it once during
         # decision making, so the mergeable walkers are just all the
         # walkers in this leaf
-        leaf_walker_idxs = self.node[leaf]['walker_idxs']
+        leaf_walker_idxs = self._node_walker_idxs(leaf)
         leaf_walker_weights = [self.walker_weights[walker_idx] for walker_idx in leaf_walker_idxs]
 
 
@@ -1639,15 +1991,16 @@ class RegionTree(nx.DiGraph):
 
         # if this leaf node was assigned a debt we need to merge
         # walkers
-        leaf_balance = self.node[leaf]['balance']
-        leaf_walker_idxs = self.node[leaf]['walker_idxs']
+        leaf_balance = int(self._balances[self._node_idx(leaf)])
+        leaf_walker_idxs = self._node_walker_idxs(leaf)
         leaf_walker_weights = {walker_idx : self.walker_weights[walker_idx]
-                               for walker_idx in self.node[leaf]['walker_idxs']}
+                               for walker_idx in leaf_walker_idxs}
 
         # calculate the maximum possible number of clones each free walker
         # could produce
-        walker_n_possible_clones = {walker_idx : self._calc_max_num_clones(leaf_weight)
-                                    for walker_idx, leaf_weight in leaf_walker_weights.items()}
+        walker_n_possible_clones = dict(zip(leaf_walker_weights.keys(),
+                                            self._calc_max_nums_clones(
+                                                list(leaf_walker_weights.values())).tolist()))
 
         # the sum of the possible clones needs to be greater than or
         # equal to the balance
@@ -1773,13 +2126,11 @@ class RegionTree(nx.DiGraph):
 
         # get all the leaf balances
         leaf_nodes = self.leaf_nodes()
-        leaf_balances = [self.node[leaf]['balance'] for leaf in leaf_nodes]
+        leaf_balances = self._balances[self._level_offsets[self.n_levels]:]
 
         # get the negative and positive balanced leaves
-        neg_leaves = [leaf_nodes[leaf_idx[0]] for leaf_idx in
-                      np.argwhere(np.array(leaf_balances) < 0)]
-        pos_leaves = [leaf_nodes[leaf_idx[0]] for leaf_idx in
-                      np.argwhere(np.array(leaf_balances) > 0)]
+        neg_leaves = [leaf_nodes[leaf_idx] for leaf_idx in np.flatnonzero(leaf_balances < 0)]
+        pos_leaves = [leaf_nodes[leaf_idx] for leaf_idx in np.flatnonzero(leaf_balances > 0)]
 
         # we decide on how the walkers will be cloned and
         # merged. These steps are purely functional and do not modify
@@ -1972,27 +2323,36 @@ class RegionTree(nx.DiGraph):
         """
 
         # set the delta walkers to the balance of the root node
-        self.node[self.ROOT_NODE]['balance'] = delta_walkers
+        self._balances[self._node_idx(self.ROOT_NODE)] = delta_walkers
+
+        # go down the levels and balance the children of each node
+        for level in range(self.n_levels):
+
+            parent_offset = self._level_offsets[level]
+            children_offset = self._level_offsets[level + 1]
 
-        # do a breadth first traversal and balance at each level
-        for parent, children in nx.bfs_successors(self, self.ROOT_NODE):
+            for parent_level_idx, children_level_idxs in \
+                                enumerate(self._level_children_idxs[level]):
 
-            # pass on the balance of this parent to the children from the
-            # parents, distribute walkers between
-            parental_balance = self.node[parent]['balance']
+                # pass on the balance of this parent to the children
+                # from the parents, distribute walkers between
+                parental_balance = int(self._balances[parent_offset + parent_level_idx])
 
-            # this will both propagate the balance set for the root
-            # walker down the tree and balance between the children
-            self._propagate_and_balance_shares(parental_balance, children)
+                # this will both propagate the balance set for the
+                # root walker down the tree and balance between the
+                # children
+                self._propagate_and_balance_shares(
+                    parental_balance,
+                    children_offset + np.array(children_level_idxs, dtype=int))
 
         # check that the sum of the balances of the leaf nodes
         # balances to delta_walkers
-        leaf_balances = [self.node[leaf]['balance'] for leaf in self.leaf_nodes()]
-        if sum(leaf_balances) != delta_walkers:
+        leaf_balances = self._balances[self._level_offsets[self.n_levels]:]
+        if leaf_balances.sum() != delta_walkers:
 
             raise RegionTreeError(
                 "The balances of the leaf nodes ({}) do not balance to delta_walkers ({})".format(
-                    leaf_balances, delta_walkers))
+                    leaf_balances.tolist(), delta_walkers))
 
         # decide on how to settle all the balances between leaves
         merge_groups, walkers_num_clones = self._decide_settle_balance()
@@ -2048,12 +2408,19 @@ class WExploreResampler(Resampler):
     RESAMPLING_RECORD_FIELDS = DECISION.RECORD_FIELDS + \
                                ('step_idx', 'walker_idx', 'region_assignment',)
 
+    # a CycleProfiler (wepy.profiling) the times of assigning the
+    # walkers and of the decisions are added to, this is set by the
+    # simulation manager
+    profiler = None
 
     def __init__(self, seed=None, pmin=1e-12, pmax=0.1,
                  distance=None,
                  max_n_regions=(10, 10, 10, 10),
                  max_region_sizes=(1, 0.5, 0.35, 0.25),
                  init_state=None,
+                 region_index_min_size=None,
+                 placement_processes=None,
+                 record_image_dtype=None,
                  **kwargs
                 ):
 
@@ -2088,11 +2455,30 @@ class WExploreResampler(Resampler):
         # distance metric
         self.distance = distance
 
+        # regions with at least this many children are searched with
+        # a spatial index (VPTree) of their images when assigning
+        # walkers, this requires the distance to be a metric
+        self.region_index_min_size = region_index_min_size
+
+        # the walkers are assigned to the regions in parallel with a
+        # pool of this many processes if given, the pool is started
+        # the first time it is needed
+        self.placement_processes = placement_processes
+        self._placement_pool = None
+
         # we do not know the shape and dtype of the images until
         # runtime so we determine them here
         image = self.distance.image(init_state)
         self.image_shape = image.shape
-        self.image_dtype = image.dtype
+
+        # the images of new regions can be recorded with a lower
+        # precision dtype (e.g. np.float32 or np.float16) to make the
+        # resampler records more compact
+        self.record_image_dtype = record_image_dtype
+        if record_image_dtype is not None:
+            self.image_dtype = np.dtype(record_image_dtype)
+        else:
+            self.image_dtype = image.dtype
 
 
         # initialize the region tree with the first state
@@ -2101,7 +2487,32 @@ class WExploreResampler(Resampler):
                                        max_region_sizes=self.max_region_sizes,
                                        distance=self.distance,
                                        pmin=self.pmin,
-                                       pmax=self.pmax)
+                                       pmax=self.pmax,
+                                       region_index_min_size=region_index_min_size)
+
+    def __getstate__(self):
+
+        # the pool can't be copied or pickled
+        state = self.__dict__.copy()
+        state['_placement_pool'] = None
+
+        return state
+
+    def __setstate__(self, state):
+
+        # support resamplers pickled before the region indices,
+        # parallel placement, and compact image records were added
+        state.setdefault('region_index_min_size', None)
+        state.setdefault('placement_processes', None)
+        state.setdefault('_placement_pool', None)
+        state.setdefault('record_image_dtype', None)
+
+        self.__dict__.update(state)
+
+    def __del__(self):
+
+        if getattr(self, '_placement_pool', None) is not None:
+            self._placement_pool.terminate()
 
     def resampler_field_shapes(self):
         """ """
@@ -2152,13 +2563,16 @@ class WExploreResampler(Resampler):
         return self._region_tree
 
 
-    def assign(self, walkers):
+    def assign(self, walkers, images=None):
         """
 
         Parameters
         ----------
         walkers :
             
+        images : list, optional
+            The already computed images of the walker states, None
+            for any that need to be computed.
 
         Returns
         -------
@@ -2168,12 +2582,26 @@ class WExploreResampler(Resampler):
         ## images which assign them to bins/leaf-nodes, possibly
         ## creating new regions, do this by calling the method to
         ## "place_walkers"  on the tree which changes the tree's state
-        new_branches = self.region_tree.place_walkers(walkers)
+        if self.placement_processes is not None:
+
+            if self._placement_pool is None:
+                self._placement_pool = mp.Pool(self.placement_processes)
+
+            new_branches = self.region_tree.place_walkers(walkers, images=images,
+                                                          map_func=self._placement_pool.map,
+                                                          n_chunks=self.placement_processes)
+
+        else:
+            new_branches = self.region_tree.place_walkers(walkers, images=images)
 
         # data records about changes to the resampler, here is just
         # the new branches data
         resampler_data = new_branches
 
+        if self.record_image_dtype is not None:
+            for new_branch in resampler_data:
+                new_branch['image'] = np.asarray(new_branch['image']).astype(self.image_dtype)
+
         # the assignments
         assignments = np.array(self.region_tree.walker_assignments)
 
@@ -2203,13 +2631,12 @@ class WExploreResampler(Resampler):
         merge_groups, walkers_num_clones = \
                         self.region_tree.balance_tree(delta_walkers=delta_walkers)
 
-        logging.info("merge_groups\n{}".format(merge_groups))
-        logging.info("Walker number of clones\n{}".format(walkers_num_clones))
-        logging.info("Walker assignments\n{}".format(self.region_tree.walker_assignments))
-        logging.info("Walker weights\n{}".format(self.region_tree.walker_weights))
-
-        # check to make sure we have selected appropriate walkers to clone
-        logging.info("images_assignments\n{}".format(self.region_tree.regions))
+        log_payload('balanced_tree',
+                    merge_groups=merge_groups,
+                    walkers_num_clones=walkers_num_clones,
+                    walker_assignments=lambda: self.region_tree.walker_assignments,
+                    walker_weights=lambda: self.region_tree.walker_weights,
+                    regions=lambda: self.region_tree.regions)
 
         # take the specs for cloning and merging and generate the
         # actual resampling actions (instructions) for each walker,
@@ -2366,13 +2793,16 @@ class WExploreResampler(Resampler):
         self.region_tree.min_num_walkers = False
 
 
-    def resample(self, walkers):
+    def resample(self, walkers, images=None):
         """
 
         Parameters
         ----------
         walkers :
             
+        images : list, optional
+            The already computed images of the walker states, None
+            for any that need to be computed.
 
         Returns
         -------
@@ -2385,11 +2815,17 @@ class WExploreResampler(Resampler):
 
         ## assign/score the walkers, also getting changes in the
         ## resampler state
-        assignments, resampler_data = self.assign(walkers)
+        start = time.time()
+        assignments, resampler_data = self.assign(walkers, images=images)
+        if self.profiler is not None:
+            self.profiler.add_time('resampler/assign', time.time() - start)
 
         # make the decisions for the the walkers for only a single
         # step
+        start = time.time()
         resampling_data = self.decide(delta_walkers=0)
+        if self.profiler is not None:
+            self.profiler.add_time('resampler/decision', time.time() - start)
 
         # perform the cloning and merging, the action function expects
         # records a lists of lists for steps and walkers
@@ -14,8 +14,11 @@ datastructures. This gives better performance by not performing copies
 to a WalkerState dictionary.
 
 Second, is the OpenMMWalker which is identical to the Walker class
-except that it enforces the state is an actual instantiation of
-OpenMMState. Use of this is optional.
+except that it enforces the state is a WalkerState, either an actual
+instantiation of OpenMMState or a plain WalkerState of the arrays of
+one (e.g. the initial states of warped walkers or walkers sent through
+a shared memory transport) which the OpenMMRunner can also set. Use of
+this is optional.
 
 Finally, is the OpenMMGPUWorker class. This is to be used as the
 worker type for the WorkerMapper work mapper. This is necessary to
@@ -103,7 +106,8 @@ UNIT_NAMES = (('positions_unit', unit.nanometer.get_name()),
 class OpenMMRunner(Runner):
     """Runner for OpenMM simulations."""
 
-    def __init__(self, system, topology, integrator, platform=None):
+    def __init__(self, system, topology, integrator, platform=None,
+                 reuse_simulation=False):
         """Constructor for OpenMMRunner.
 
         Parameters
@@ -124,6 +128,15 @@ class OpenMMRunner(Runner):
             Reference, CUDA, OpenCL
            (Default = None)
 
+        reuse_simulation : bool
+            If True the Simulation object (and its Context) is made
+            only once for the process running segments and is reused
+            for every following segment by only setting the state of
+            the walker. Otherwise a new Simulation is made for every
+            segment. When used with the WorkerMapper each worker
+            will have its own Simulation.
+           (Default = False)
+
         """
 
         # we save the different components. However, if we are to make
@@ -136,6 +149,33 @@ class OpenMMRunner(Runner):
         self.topology = topology
         self.platform_name = platform
 
+        self.reuse_simulation = reuse_simulation
+
+        # the cached simulation and the platform properties it was
+        # made with, only used when reusing simulations
+        self._simulation = None
+        self._simulation_platform_kwargs = None
+
+    def __getstate__(self):
+
+        # the cached simulation is bound to a compute context in this
+        # process and cannot be pickled so we never send it, it will
+        # be regenerated wherever this runner is used next
+        state = self.__dict__.copy()
+        state['_simulation'] = None
+        state['_simulation_platform_kwargs'] = None
+
+        return state
+
+    def __setstate__(self, state):
+
+        # support runners pickled before simulations could be reused
+        state.setdefault('reuse_simulation', False)
+        state.setdefault('_simulation', None)
+        state.setdefault('_simulation_platform_kwargs', None)
+
+        self.__dict__.update(state)
+
     #TODO: deprecate?
     def _openmm_swig_objects(self):
         """Just returns all of the foreign OpenMM module objects this class
@@ -148,7 +188,110 @@ class OpenMMRunner(Runner):
 
         return (self.system, self.integrator)
 
-    def run_segment(self, walker, segment_length, getState_kwargs=None, **kwargs):
+    def _generate_simulation(self, platform_kwargs):
+        """Make a new Simulation object from the system, topology,
+        integrator, and platform of this runner.
+
+        Parameters
+        ----------
+        platform_kwargs : dict of str : value
+            Properties to set for the platform if they apply to it.
+
+        Returns
+        -------
+        simulation : simtk.openmm.app.Simulation object
+
+        """
+
+        # make a copy of the integrator for this particular simulation
+        new_integrator = copy(self.integrator)
+        # force setting of random seed to 0, which is a special
+        # value that forces the integrator to choose another
+        # random number
+        new_integrator.setRandomNumberSeed(0)
+
+        # if a platform was given we use it to make a Simulation object
+        if self.platform_name is not None:
+            # get the platform by its name to use
+            platform = omm.Platform.getPlatformByName(self.platform_name)
+            # set properties from the kwargs if they apply to the platform
+            for key, value in platform_kwargs.items():
+                if key in platform.getPropertyNames():
+                    platform.setPropertyDefaultValue(key, value)
+
+            # make a new simulation object
+            simulation = omma.Simulation(self.topology, self.system,
+                                         new_integrator, platform)
+
+        # otherwise just use the default or environmentally defined one
+        else:
+            simulation = omma.Simulation(self.topology, self.system,
+                                         new_integrator)
+
+        return simulation
+
+    def _cached_simulation(self, platform_kwargs):
+        """Get the cached Simulation object, making it if it doesn't exist
+        yet or if the platform properties have changed.
+
+        Parameters
+        ----------
+        platform_kwargs : dict of str : value
+            Properties to set for the platform if they apply to it.
+
+        Returns
+        -------
+        simulation : simtk.openmm.app.Simulation object
+
+        """
+
+        if (self._simulation is None) or \
+           (self._simulation_platform_kwargs != platform_kwargs):
+
+            self._simulation = self._generate_simulation(platform_kwargs)
+            self._simulation_platform_kwargs = dict(platform_kwargs)
+
+        return self._simulation
+
+    @staticmethod
+    def _set_state_arrays(context, state):
+        """Set the state of a context from the plain arrays of a walker
+        state (i.e. one that is not an OpenMMState wrapping an OpenMM
+        State object).
+
+        The arrays are taken to be in the units of UNITS. Parameters
+        are taken from the 'parameters/<name>' keys.
+
+        Parameters
+        ----------
+        context : simtk.openmm.Context object
+
+        state : object implementing the WalkerState interface
+
+        """
+
+        state_d = state.dict()
+
+        # the box vectors must be set before the positions
+        if state_d.get('box_vectors', None) is not None:
+            context.setPeriodicBoxVectors(*[omm.Vec3(*vec) for vec
+                                            in np.asarray(state_d['box_vectors'])])
+
+        context.setPositions(np.asarray(state_d['positions']) * unit.nanometer)
+
+        if state_d.get('velocities', None) is not None:
+            context.setVelocities(np.asarray(state_d['velocities']) * \
+                                  (unit.nanometer/unit.picosecond))
+
+        if state_d.get('time', None) is not None:
+            context.setTime(float(state_d['time']))
+
+        for key, value in state_d.items():
+            if key.startswith('parameters/'):
+                context.setParameter(key[len('parameters/'):], float(value))
+
+    def run_segment(self, walker, segment_length, getState_kwargs=None,
+                    split_times=None, **kwargs):
         """Run dynamics for the walker.
 
         Parameters
@@ -166,6 +309,11 @@ class OpenMMRunner(Runner):
             GET_STATE_KWARG_DEFAULTS module constant.
              (Default value = None)
 
+        split_times : dict of str : float, optional
+            If given the times (in seconds) for setting up the
+            simulation ('setup'), running the steps ('steps'), and
+            getting the new state ('get_state') will be set in it.
+             (Default value = None)
 
         Returns
         -------
@@ -185,33 +333,22 @@ class OpenMMRunner(Runner):
 
         gen_sim_start = time.time()
 
-        # make a copy of the integrator for this particular segment
-        new_integrator = copy(self.integrator)
-        # force setting of random seed to 0, which is a special
-        # value that forces the integrator to choose another
-        # random number
-        new_integrator.setRandomNumberSeed(0)
-
-        # if a platform was given we use it to make a Simulation object
-        if self.platform_name is not None:
-            # get the platform by its name to use
-            platform = omm.Platform.getPlatformByName(self.platform_name)
-            # set properties from the kwargs if they apply to the platform
-            for key, value in kwargs.items():
-                if key in platform.getPropertyNames():
-                    platform.setPropertyDefaultValue(key, value)
-
-            # make a new simulation object
-            simulation = omma.Simulation(self.topology, self.system,
-                                         new_integrator, platform)
-
-        # otherwise just use the default or environmentally defined one
+        # when reusing the simulation the random number generator of
+        # the integrator is never reseeded (OpenMM only applies seeds
+        # when a Context is made) but it just continues its stream so
+        # every segment still gets new random numbers
+        if self.reuse_simulation:
+            simulation = self._cached_simulation(kwargs)
         else:
-            simulation = omma.Simulation(self.topology, self.system,
-                                         new_integrator)
+            simulation = self._generate_simulation(kwargs)
 
-        # set the state to the context from the walker
-        simulation.context.setState(walker.state.sim_state)
+        # set the state to the context from the walker, walkers sent
+        # through a transport (e.g. shared memory) only have the plain
+        # arrays of the state
+        if isinstance(walker.state, OpenMMState):
+            simulation.context.setState(walker.state.sim_state)
+        else:
+            self._set_state_arrays(simulation.context, walker.state)
 
         gen_sim_end = time.time()
         gen_sim_time = gen_sim_end - gen_sim_start
@@ -247,6 +384,11 @@ class OpenMMRunner(Runner):
         run_segment_time = run_segment_end - run_segment_start
         logging.info("Total internal run_segment time: {}".format(run_segment_time))
 
+        if split_times is not None:
+            split_times['setup'] = gen_sim_time
+            split_times['steps'] = steps_time
+            split_times['get_state'] = get_state_time
+
         return new_walker
 
 
@@ -852,16 +994,22 @@ class OpenMMState(WalkerState):
 class OpenMMWalker(Walker):
     """Walker for OpenMMRunner simulations.
 
-    This simply enforces the use of an OpenMMState object for the
-    walker state attribute.
+    This simply enforces the use of a WalkerState object for the
+    walker state attribute. This is either an OpenMMState or a plain
+    WalkerState with the values of one as arrays (in the units of
+    UNITS), which is what the OpenMMRunner can set into a simulation.
 
     """
 
+    ARRAY_STATES = True
+    """Plain WalkerStates of the arrays of OpenMMStates are accepted,
+    so these walkers can be sent through a SharedMemoryTransport."""
+
     def __init__(self, state, weight):
         # documented in superclass
 
-        assert isinstance(state, OpenMMState), \
-            "state must be an instance of class OpenMMState not {}".format(type(state))
+        assert isinstance(state, WalkerState), \
+            "state must be an instance of class WalkerState not {}".format(type(state))
 
         super().__init__(state, weight)
 
@@ -889,9 +1037,10 @@ class OpenMMCPUWorker(Worker):
     def run_task(self, task):
         # documented in superclass
 
-        # run the task and pass in the DeviceIndex for OpenMM to
-        # assign work to the correct GPU
-        return task(CpuThreads=self.attributes['num_threads'])
+        # run the task and pass in the number of threads for OpenMM
+        # to use, and get the split times of the segment
+        return task(CpuThreads=self.attributes['num_threads'],
+                    split_times=self.task_split_times)
 
 
 class OpenMMGPUWorker(Worker):
@@ -913,5 +1062,7 @@ class OpenMMGPUWorker(Worker):
         # documented in superclass
 
         # run the task and pass in the DeviceIndex for OpenMM to
-        # assign work to the correct GPU
-        return task(DeviceIndex=str(self.worker_idx))
+        # assign work to the correct GPU, and get the split times of
+        # the segment
+        return task(DeviceIndex=str(self.worker_idx),
+                    split_times=self.task_split_times)
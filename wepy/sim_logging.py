@@ -0,0 +1,147 @@
+"""Lazy, level gated structured logging for the simulation loop.
+
+The components of a simulation log events from every cycle (and every
+task in the work mappers), so these messages should cost nothing when
+the level they are logged at is not enabled, and they should never
+contain the walkers themselves or other large arrays (e.g. distance
+matrices) since formatting these can take longer than the cycle.
+
+Events are logged with `log_event` as an event name with a few small
+'key=value' fields, e.g.:
+
+    result_retrieved task_idx=3 worker_idx=1 task_time=0.53
+
+The message is only made if the level of the event is enabled for
+the logger, and only formatted as a string when it is emitted by a
+handler.
+
+Large data (which we call payloads) is only logged with `log_payload`
+when payload logging has been explicitly enabled, either by calling
+`enable_payload_logging` or by setting the environment variable
+WEPY_LOG_PAYLOADS=1 (which also applies to the worker processes of
+the work mappers), and when the DEBUG level is enabled. The values of
+payloads can be given as functions which are only called when they
+will actually be logged.
+
+"""
+
+import os
+import logging
+
+PAYLOAD_LOGGING_ENV_VAR = 'WEPY_LOG_PAYLOADS'
+"""The environment variable which enables payload logging if set to
+anything besides '' or '0'."""
+
+_payload_logging = os.environ.get(PAYLOAD_LOGGING_ENV_VAR, '') not in ('', '0')
+
+def enable_payload_logging(enabled=True):
+    """Enable (or disable) the logging of payloads in this process.
+
+    Parameters
+    ----------
+    enabled : bool
+       (Default = True)
+
+    """
+
+    global _payload_logging
+    _payload_logging = enabled
+
+def payload_logging_enabled():
+    """Whether payloads are logged in this process.
+
+    Returns
+    -------
+    enabled : bool
+
+    """
+
+    return _payload_logging
+
+class LogEvent(object):
+    """A structured log message which is only formatted when it is
+    emitted."""
+
+    __slots__ = ('event', 'fields')
+
+    def __init__(self, event, fields):
+        """Constructor for LogEvent.
+
+        Parameters
+        ----------
+        event : str
+            The name of the event.
+
+        fields : dict of str : value
+            The values describing the event.
+
+        """
+
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+
+        if not self.fields:
+            return self.event
+
+        return "{} {}".format(self.event,
+                              " ".join("{}={}".format(key, value)
+                                       for key, value in self.fields.items()))
+
+def log_event(event, level=logging.INFO, logger=None, **fields):
+    """Log an event with small fields if the level is enabled.
+
+    Parameters
+    ----------
+    event : str
+        The name of the event.
+
+    level : int
+        The logging level.
+       (Default = logging.INFO)
+
+    logger : logging.Logger, optional
+        The logger to use, if not given the root logger.
+
+    **fields
+        The values describing the event, these should be small
+        (e.g. indices and times) and never walkers.
+
+    """
+
+    if logger is None:
+        logger = logging.getLogger()
+
+    if logger.isEnabledFor(level):
+        logger.log(level, LogEvent(event, fields))
+
+def log_payload(event, logger=None, **payloads):
+    """Log large data at the DEBUG level only if payload logging is
+    enabled.
+
+    Parameters
+    ----------
+    event : str
+        The name of the event.
+
+    logger : logging.Logger, optional
+        The logger to use, if not given the root logger.
+
+    **payloads
+        The data to log. Values which are callable are called (with
+        no arguments) to get the data only if it will be logged.
+
+    """
+
+    if not _payload_logging:
+        return
+
+    if logger is None:
+        logger = logging.getLogger()
+
+    if logger.isEnabledFor(logging.DEBUG):
+        payloads = {key : value() if callable(value) else value
+                    for key, value in payloads.items()}
+
+        logger.debug(LogEvent(event, payloads))
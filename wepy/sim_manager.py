@@ -44,8 +44,13 @@ to be determined adaptively (e.g. according to some time limit).
 
 import sys
 import time
+import inspect
 from copy import deepcopy
 import logging
+import threading
+import queue
+
+from wepy.sim_logging import log_payload
 
 class Manager(object):
     """The class that coordinates wepy simulations.
@@ -77,6 +82,12 @@ class Manager(object):
     - resampler
     - reporters
 
+    Optionally reporting can be pipelined with the next cycle. In
+    this case the report of a cycle is put on a bounded queue which
+    is consumed by the reporters on a background thread and the
+    resampled walkers are returned to be run in the next cycle
+    immediately.
+
     """
 
 
@@ -84,7 +95,8 @@ class Manager(object):
                         'new_walkers', 'resampled_walkers',
                         'warp_data', 'bc_data', 'progress_data',
                         'resampling_data', 'resampler_data',
-                        'worker_segment_times', 'cycle_runner_time',
+                        'worker_segment_times', 'worker_segment_split_times',
+                        'cycle_runner_time',
                         'cycle_bc_time', 'cycle_resampling_time',)
     """Keys of values that will be passed to reporters.
 
@@ -96,7 +108,10 @@ class Manager(object):
                  work_mapper = None,
                  resampler = None,
                  boundary_conditions = None,
-                 reporters = None):
+                 reporters = None,
+                 pipeline_reporting = False,
+                 report_queue_size = 1,
+                 profiler = None):
         """Constructor for Manager.
 
         Arguments
@@ -121,6 +136,24 @@ class Manager(object):
         reporters : list of objects implenting the Reporter interface, optional
             Reporters to be used. You should provide these if you want to keep data.
 
+        pipeline_reporting : bool, optional
+            If True the reporters are run on a background thread for
+            each cycle report while the next cycle is run.
+             (Default = False)
+
+        report_queue_size : int, optional
+            The maximum number of cycle reports that can be waiting
+            to be reported when pipelining reporting. When the queue
+            is full the next cycle will wait for the reporters.
+             (Default = 1)
+
+        profiler : CycleProfiler, optional
+            If given the times of the phases of each cycle are
+            recorded in it, it is also given to the components which
+            support profiling (i.e. that have a `profiler` attribute)
+            in `init`. See the wepy.profiling module.
+             (Default = None)
+
         Warnings
         --------
 
@@ -137,6 +170,30 @@ class Manager(object):
             checkpointing, restarting, reporter localization, and configuration hotswapping
             with command line interface.
 
+        Notes
+        -----
+
+        When pipelining reporting the reporters are run in the same
+        process as the simulation manager (so they can keep their
+        file handles) and may lag behind the cycles by the size of
+        the report queue. All waiting reports are finished in the
+        `cleanup` method. Errors raised by reporters are raised
+        either at the next call to `run_cycle` or in `cleanup`.
+
+        When the work mapper streams results (i.e. has a
+        `map_streaming` method, like the AsyncMapper) the progress of
+        the boundary conditions and the images of the resampler's
+        distance are computed for each walker as its segment
+        finishes, see `run_segment_streaming`. This time is then
+        included in the runner time of the cycle.
+
+        Boundary conditions with a true `worker_progress` attribute
+        (e.g. the ReceptorBC with the `worker_progress` option) have
+        the progress of each walker computed by the work mapper right
+        after its segment (i.e. in the worker processes of the
+        WorkerMapper) and only the warping is done in the main
+        process. This time is also included in the runner time.
+
         """
 
         self.init_walkers = init_walkers
@@ -157,6 +214,107 @@ class Manager(object):
 
         self.work_mapper = work_mapper
 
+        self.pipeline_reporting = pipeline_reporting
+        self.report_queue_size = report_queue_size
+
+        self.profiler = profiler
+
+        # the functions the work mapper applies to each walker after
+        # its segment, these are set in `init`
+        self._segment_result_funcs = {}
+
+        # the queue and thread for pipelined reporting, these are
+        # made at runtime in `init`
+        self._report_queue = None
+        self._report_thread = None
+        self._reporting_error = None
+
+    def _report_loop(self):
+        """Consume cycle reports from the report queue and report them to
+        the reporters until the stop signal (None) is received.
+
+        This is the target of the background reporting thread when
+        pipelining reporting.
+
+        """
+
+        while True:
+
+            report = self._report_queue.get()
+
+            # the stop signal
+            if report is None:
+                self._report_queue.task_done()
+                break
+
+            # if a reporter has already failed we don't report
+            # anything else but keep consuming so the simulation
+            # isn't blocked before the error is raised
+            if self._reporting_error is None:
+                try:
+                    self._report(report)
+                except Exception as err:
+                    self._reporting_error = err
+
+            self._report_queue.task_done()
+
+    def _report(self, report):
+        """Report a cycle report to all the reporters.
+
+        Parameters
+        ----------
+        report : dict of str : value
+            The cycle report with the keys in REPORT_ITEM_KEYS.
+
+        """
+
+        if self.profiler is None:
+            for reporter in self.reporters:
+                reporter.report(**report)
+
+            return
+
+        # time each reporter when profiling
+        cycle_idx = report['cycle_idx']
+        reporting_start = time.time()
+        for reporter_idx, reporter in enumerate(self.reporters):
+
+            start = time.time()
+            reporter.report(**report)
+            self.profiler.add_time('reporter/{}-{}'.format(reporter_idx,
+                                                           type(reporter).__name__),
+                                   time.time() - start, cycle_idx=cycle_idx)
+
+        self.profiler.add_time('reporting', time.time() - reporting_start,
+                               cycle_idx=cycle_idx)
+
+        # this is the last thing done for a cycle
+        self.profiler.finish_cycle(cycle_idx)
+
+    def _raise_reporting_error(self):
+        """Raise an error from a reporter on the background reporting
+        thread if one occured."""
+
+        if self._reporting_error is not None:
+
+            err = self._reporting_error
+            self._reporting_error = None
+
+            raise err
+
+    def _finish_reporting(self):
+        """Wait for all pipelined cycle reports to be reported and stop the
+        background reporting thread."""
+
+        if self._report_thread is None:
+            return
+
+        # send the stop signal and wait for everything to be reported
+        self._report_queue.put(None)
+        self._report_thread.join()
+
+        self._report_queue = None
+        self._report_thread = None
 
     def run_segment(self, walkers, segment_length):
         """Run a time segment for all walkers using the available workers.
@@ -192,6 +350,64 @@ class Manager(object):
 
         return new_walkers
 
+    def run_segment_streaming(self, walkers, segment_length):
+        """Run a time segment for all walkers with a work mapper that
+        streams results (e.g. the AsyncMapper), computing the
+        per-walker parts of the boundary conditions and resampling as
+        soon as each walker's segment is done.
+
+        The progress of each walker towards the boundary conditions
+        is computed if they have a `progress` method (e.g. the
+        ReceptorBC) and the distance image of each walker is computed
+        if the resampler has a `distance` and its `resample` method
+        accepts the precomputed images (e.g. the REVOResampler and
+        WExploreResampler).
+
+        Parameters
+        ----------
+        walkers : list of walkers
+        segment_length : int
+            Number of steps to run in each segment.
+
+        Returns
+        -------
+
+        new_walkers : list of walkers
+           The walkers after the segment of sampling simulation.
+
+        streamed : dict of str : list
+           The per-walker values that were computed. The progress
+           under the key 'progress' and the images under 'image'.
+
+        """
+
+        num_walkers = len(walkers)
+
+        result_funcs = {}
+
+        # unless it is already computed by the work mapper
+        if hasattr(self.boundary_conditions, 'progress') and \
+           'progress' not in self._segment_result_funcs:
+            result_funcs['progress'] = self.boundary_conditions.progress
+
+        # the images are only useful if they can be given to the
+        # resampler, which is not part of the Resampler interface
+        distance = getattr(self.resampler, 'distance', None)
+        accepts_images = 'images' in inspect.signature(self.resampler.resample).parameters
+        if distance is not None and accepts_images:
+            result_funcs['image'] = lambda walker: distance.image(walker.state)
+
+        logging.info("Starting segment")
+
+        new_walkers, streamed = self.work_mapper.map_streaming(
+            walkers,
+            (segment_length for i in range(num_walkers)),
+            result_funcs=result_funcs)
+
+        logging.info("Ending segment")
+
+        return list(new_walkers), streamed
+
     def run_cycle(self, walkers, n_segment_steps, cycle_idx):
         """Run a full cycle of weighted ensemble simulation using each
         component.
@@ -265,9 +481,23 @@ class Manager(object):
 
         logging.info("Begin cycle {}".format(cycle_idx))
 
-        # run the segment
+        if self.profiler is not None:
+            self.profiler.start_cycle(cycle_idx)
+
+        # run the segment, if the work mapper supports it parts of the
+        # boundary conditions and resampling are done as the results
+        # stream in
         start = time.time()
-        new_walkers = self.run_segment(walkers, n_segment_steps)
+        if hasattr(self.work_mapper, 'map_streaming'):
+            new_walkers, streamed = self.run_segment_streaming(walkers, n_segment_steps)
+        else:
+            new_walkers = self.run_segment(walkers, n_segment_steps)
+            streamed = {}
+
+        # the values the work mapper computed right after each
+        # segment, e.g. the progress computed in the workers
+        if len(self._segment_result_funcs) > 0:
+            streamed.update(self.work_mapper.segment_func_results)
         end = time.time()
         runner_time = end - start
 
@@ -286,8 +516,13 @@ class Manager(object):
 
             # apply rules of boundary conditions and warp walkers through space
             start = time.time()
-            bc_results  = self.boundary_conditions.warp_walkers(new_walkers,
-                                                                cycle_idx)
+            if 'progress' in streamed:
+                bc_results  = self.boundary_conditions.warp_walkers(
+                    new_walkers, cycle_idx,
+                    walker_progresses=streamed['progress'])
+            else:
+                bc_results  = self.boundary_conditions.warp_walkers(new_walkers,
+                                                                    cycle_idx)
             end = time.time()
             bc_time = end - start
 
@@ -302,9 +537,19 @@ class Manager(object):
 
 
 
-        # resample walkers
+        # resample walkers, using the streamed images for those that
+        # weren't warped
         start = time.time()
-        resampling_results = self.resampler.resample(warped_walkers)
+        if 'image' in streamed:
+
+            images = list(streamed['image'])
+            for warp_record in warp_data:
+                images[int(warp_record['walker_idx'][0])] = None
+
+            resampling_results = self.resampler.resample(warped_walkers, images=images)
+
+        else:
+            resampling_results = self.resampler.resample(warped_walkers)
         end = time.time()
         resampling_time = end - start
 
@@ -312,14 +557,28 @@ class Manager(object):
         resampling_data = resampling_results[1]
         resampler_data = resampling_results[2]
 
+        if self.profiler is not None:
+            self.profiler.add_time('runner', runner_time)
+            self.profiler.add_time('boundary_conditions', bc_time)
+            self.profiler.add_time('resampling', resampling_time)
+
         # log the weights of the walkers after resampling
-        result_template_str = "|".join(["{:^5}" for i in range(self.n_init_walkers + 1)])
-        walker_weight_str = result_template_str.format("weight",
-            *[round(walker.weight, 3) for walker in resampled_walkers])
-        logging.info(walker_weight_str)
+        log_payload('resampled_weights',
+                    weights=lambda: [round(walker.weight, 3) for walker in resampled_walkers])
 
         # make a dictionary of all the results that will be reported
 
+        # the segment times are owned by the work mapper and may be
+        # changed by it in the next cycle while this report is still
+        # waiting to be reported, so we report copies of them
+        worker_segment_times = {worker_idx : list(segment_times)
+                                for worker_idx, segment_times
+                                in self.work_mapper.worker_segment_times.items()}
+        worker_segment_split_times = {worker_idx : [dict(split_times)
+                                                    for split_times in segments_split_times]
+                                      for worker_idx, segments_split_times
+                                      in getattr(self.work_mapper,
+                                                 'worker_segment_split_times', {}).items()}
 
         report = {'cycle_idx' : cycle_idx,
                   'new_walkers' : new_walkers,
@@ -329,7 +588,8 @@ class Manager(object):
                   'resampling_data' : resampling_data,
                   'resampler_data' : resampler_data,
                   'n_segment_steps' : n_segment_steps,
-                  'worker_segment_times' : self.work_mapper.worker_segment_times,
+                  'worker_segment_times' : worker_segment_times,
+                  'worker_segment_split_times' : worker_segment_split_times,
                   'cycle_runner_time' : runner_time,
                   'cycle_bc_time' : bc_time,
                   'cycle_resampling_time' : resampling_time,
@@ -340,9 +600,17 @@ class Manager(object):
         assert all([True if rep_key in report else False
                     for rep_key in self.REPORT_ITEM_KEYS])
 
-        # report results to the reporters
-        for reporter in self.reporters:
-            reporter.report(**report)
+        # report results to the reporters, if pipelining this only
+        # waits for the reporters if the report queue is full
+        if self._report_thread is not None:
+
+            # raise any errors from reporting previous cycles
+            self._raise_reporting_error()
+
+            self._report_queue.put(report)
+
+        else:
+            self._report(report)
 
         # prepare resampled walkers for running new state changes
         walkers = resampled_walkers
@@ -378,9 +646,12 @@ class Manager(object):
 
         - work_mapper
         - reporters
+        - profiler (if given)
 
         Passes the segment_func of the runner and the number of
-        workers to the work_mapper.
+        workers to the work_mapper. If the boundary conditions have a
+        true `worker_progress` attribute their `progress` method is
+        also passed as a segment result function.
 
         Passes the following things to each reporter `init` method:
 
@@ -409,8 +680,19 @@ class Manager(object):
         # initialize the work_mapper with the function it will be
         # mapping and the number of workers, this may include things like starting processes
         # etc.
+        # boundary conditions can have the progress of each walker
+        # computed by the work mapper right after its segment
+        self._segment_result_funcs = {}
+        if getattr(self.boundary_conditions, 'worker_progress', False):
+            self._segment_result_funcs['progress'] = self.boundary_conditions.progress
+
+        mapper_kwargs = {}
+        if len(self._segment_result_funcs) > 0:
+            mapper_kwargs['segment_result_funcs'] = self._segment_result_funcs
+
         self.work_mapper.init(segment_func=self.runner.run_segment,
-                              num_workers=num_workers)
+                              num_workers=num_workers,
+                              **mapper_kwargs)
 
         # init the reporter
         for reporter in self.reporters:
@@ -422,6 +704,26 @@ class Manager(object):
                           reporters=self.reporters,
                           continue_run=continue_run)
 
+        # give the profiler to the components that support it
+        if self.profiler is not None:
+
+            self.profiler.init()
+
+            for component in (self.runner, self.work_mapper,
+                              self.resampler, self.boundary_conditions):
+                if hasattr(component, 'profiler'):
+                    component.profiler = self.profiler
+
+        # start the background thread for reporting
+        if self.pipeline_reporting:
+
+            self._reporting_error = None
+            self._report_queue = queue.Queue(maxsize=self.report_queue_size)
+            self._report_thread = threading.Thread(target=self._report_loop,
+                                                   name="wepy-reporting",
+                                                   daemon=True)
+            self._report_thread.start()
+
     def cleanup(self):
         """Perform cleanup actions for wepy configuration components.
 
@@ -432,6 +734,11 @@ class Manager(object):
 
         - work_mapper
         - reporters
+        - profiler (if given)
+
+        If reporting is pipelined all waiting reports are reported
+        before the reporters are cleaned up and any error raised by a
+        reporter is raised after cleaning up.
 
         Passes nothing to the work mapper.
 
@@ -448,6 +755,9 @@ class Manager(object):
         # cleanup the mapper
         self.work_mapper.cleanup()
 
+        # finish off any reports still in the pipeline
+        self._finish_reporting()
+
         # cleanup things associated with the reporter
         for reporter in self.reporters:
             reporter.cleanup(runner=self.runner,
@@ -456,6 +766,12 @@ class Manager(object):
                              boundary_conditions=self.boundary_conditions,
                              reporters=self.reporters)
 
+        if self.profiler is not None:
+            self.profiler.cleanup()
+
+        # then raise any errors from the reporters
+        self._raise_reporting_error()
+
 
     def run_simulation_by_time(self, run_time, segments_length, num_workers=None):
         """Run a simulation for a certain amount of time.
@@ -0,0 +1,171 @@
+"""Neighbor search through periodic boundary conditions with k-d trees.
+
+This is used for finding the minimum distance between two sets of
+coordinates (e.g. a ligand and its receptor) when it is below a
+cutoff, without computing the distances between all of the pairs of
+them.
+
+A k-d tree is built over the second set of coordinates (wrapped into
+the box) and the first set is queried with the cutoff as an upper
+bound on the distance, so only the parts of the tree near the query
+points are searched. For rectangular boxes the tree handles the
+periodic boundaries itself, while for triclinic boxes the query
+points are replicated into the neighboring images of the box, the
+same images that are checked in `traj_min_pair_distances`.
+
+When the minimum distance is not below the cutoff no distance is
+found (it is infinite) and the brute force
+`wepy.util.util.traj_min_pair_distances` should be used if the exact
+value is needed.
+
+"""
+
+import itertools as it
+
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+# the shifts (in box vectors) of the neighboring images of the box
+IMAGE_SHIFTS = np.array([shift for shift in it.product((-1, 0, 1), repeat=3)
+                         if shift != (0, 0, 0)])
+
+def is_rectangular_box(box_vectors):
+    """Test whether the box vectors of a frame are for a rectangular box.
+
+    Parameters
+    ----------
+    box_vectors : arraylike of float of shape (3, 3)
+
+    Returns
+    -------
+    is_rectangular : bool
+
+    """
+
+    box_vectors = np.asarray(box_vectors)
+
+    return not np.any(box_vectors[~np.eye(3, dtype=bool)] != 0.0)
+
+def wrap_coords(coords, box_vectors):
+    """Wrap coordinates into the (possibly triclinic) periodic box.
+
+    Parameters
+    ----------
+    coords : arraylike of float of shape (n_coords, 3)
+
+    box_vectors : arraylike of float of shape (3, 3)
+        The box vectors as rows.
+
+    Returns
+    -------
+    wrapped_coords : numpy.ndarray of float of shape (n_coords, 3)
+
+    """
+
+    coords = np.asarray(coords, dtype=np.float64)
+    box_vectors = np.asarray(box_vectors, dtype=np.float64)
+
+    # the coordinates in units of the box vectors
+    frac_coords = np.linalg.solve(box_vectors.T, coords.T).T
+
+    frac_coords -= np.floor(frac_coords)
+
+    # rounding can leave a fractional coordinate at exactly 1
+    frac_coords[frac_coords >= 1.0] = 0.0
+
+    return np.dot(frac_coords, box_vectors)
+
+def periodic_min_distance(coords_a, coords_b, box_vectors, cutoff):
+    """The minimum distance between two sets of coordinates through the
+    periodic boundary conditions, if it is less than a cutoff.
+
+    Parameters
+    ----------
+    coords_a : arraylike of float of shape (n_coords_a, 3)
+        The coordinates to query, this should be the smaller set.
+
+    coords_b : arraylike of float of shape (n_coords_b, 3)
+        The coordinates the k-d tree is built for.
+
+    box_vectors : arraylike of float of shape (3, 3)
+        The box vectors as rows, triclinic boxes must be in the
+        reduced form used by OpenMM (i.e. lower triangular).
+
+    cutoff : float
+        Only distances less than this are searched for.
+
+    Returns
+    -------
+    min_distance : float
+        The minimum distance, or infinity if no distance is less
+        than the cutoff.
+
+    """
+
+    box_vectors = np.asarray(box_vectors, dtype=np.float64)
+
+    wrapped_a = wrap_coords(coords_a, box_vectors)
+    wrapped_b = wrap_coords(coords_b, box_vectors)
+
+    if is_rectangular_box(box_vectors):
+
+        # the tree does the periodic boundaries itself, and the
+        # wrapped coordinates must be strictly inside the box
+        box_lengths = np.diag(box_vectors)
+        wrapped_b = np.where(wrapped_b < box_lengths, wrapped_b, 0.0)
+
+        tree = cKDTree(wrapped_b, boxsize=box_lengths)
+
+        query_coords = wrapped_a
+
+    else:
+
+        tree = cKDTree(wrapped_b)
+
+        # query the images of the coordinates in the neighboring
+        # boxes as well
+        shift_vectors = np.dot(IMAGE_SHIFTS, box_vectors)
+        query_coords = np.concatenate(
+            [wrapped_a] +
+            [wrapped_a + shift_vector for shift_vector in shift_vectors])
+
+    distances, _ = tree.query(query_coords, k=1, distance_upper_bound=cutoff)
+
+    return distances.min()
+
+def traj_periodic_min_distances(traj_coords, traj_box_vectors,
+                                idxs_a, idxs_b, cutoff):
+    """For many frames, the minimum distance between two sets of
+    coordinates through the periodic boundary conditions, if it is
+    less than a cutoff.
+
+    Parameters
+    ----------
+    traj_coords : arraylike of float of shape (n_frames, n_coords, 3)
+
+    traj_box_vectors : arraylike of float of shape (n_frames, 3, 3)
+        The box vectors (as rows) of each frame.
+
+    idxs_a : arraylike of int
+        The indices of the coordinates to query, this should be the
+        smaller set.
+
+    idxs_b : arraylike of int
+        The indices of the coordinates the k-d trees are built for.
+
+    cutoff : float
+        Only distances less than this are searched for.
+
+    Returns
+    -------
+    traj_min_distances : numpy.ndarray of float of shape (n_frames,)
+        The minimum distance of each frame, or infinity when no
+        distance is less than the cutoff.
+
+    """
+
+    return np.array([periodic_min_distance(coords[idxs_a], coords[idxs_b],
+                                           box_vectors, cutoff)
+                     for coords, box_vectors in zip(traj_coords, traj_box_vectors)],
+                    dtype=np.float64).reshape((-1,))
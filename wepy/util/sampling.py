@@ -0,0 +1,118 @@
+"""Sampling of indices from discrete probability distributions."""
+
+import numpy as np
+
+class AliasSampler(object):
+    """Sampler of indices with given weights using the alias method
+    (Vose's variant).
+
+    The probability and alias tables are built once in linear time,
+    after which each sample only takes a uniform random integer and a
+    uniform random float, regardless of the number of indices.
+
+    """
+
+    def __init__(self, weights):
+        """Constructor for AliasSampler.
+
+        Parameters
+        ----------
+        weights : arraylike of float
+            The (unnormalized) weight of each index.
+
+        Raises
+        ------
+        ValueError
+            If the weights are empty, negative or all zero.
+
+        """
+
+        weights = np.asarray(weights, dtype=np.float64).reshape((-1,))
+
+        if weights.shape[0] == 0:
+            raise ValueError("At least one weight must be given")
+
+        if np.any(weights < 0.0) or not np.all(np.isfinite(weights)):
+            raise ValueError("Weights must be finite and non-negative")
+
+        total_weight = weights.sum()
+        if total_weight <= 0.0:
+            raise ValueError("At least one weight must be positive")
+
+        n = weights.shape[0]
+
+        # the probabilities scaled so that the average is 1, each
+        # column of the table is then filled up to 1 with an alias
+        scaled_probs = weights * (n / total_weight)
+
+        self._probs = np.ones(n)
+        self._aliases = np.arange(n)
+
+        small = [idx for idx in range(n) if scaled_probs[idx] < 1.0]
+        large = [idx for idx in range(n) if scaled_probs[idx] >= 1.0]
+
+        while len(small) > 0 and len(large) > 0:
+
+            small_idx = small.pop()
+            large_idx = large.pop()
+
+            self._probs[small_idx] = scaled_probs[small_idx]
+            self._aliases[small_idx] = large_idx
+
+            # the large index gives up what the small one was missing
+            scaled_probs[large_idx] = (scaled_probs[large_idx] +
+                                       scaled_probs[small_idx]) - 1.0
+
+            if scaled_probs[large_idx] < 1.0:
+                small.append(large_idx)
+            else:
+                large.append(large_idx)
+
+        # whatever is left over is only from rounding errors and is
+        # kept with a probability of 1
+
+    def __len__(self):
+        return self._probs.shape[0]
+
+    @property
+    def probs(self):
+        """The probability of keeping the index of each column of the
+        table instead of taking its alias."""
+        return self._probs
+
+    @property
+    def aliases(self):
+        """The alias index of each column of the table."""
+        return self._aliases
+
+    def sample(self, random_state=None, size=None):
+        """Sample indices.
+
+        Parameters
+        ----------
+        random_state : numpy.random.RandomState, optional
+            The random number generator to use. If not given the
+            global numpy one is used.
+
+        size : int or tuple of int, optional
+            The shape of the samples to draw. If not given a single
+            index is returned.
+
+        Returns
+        -------
+        idxs : int or numpy.ndarray of int
+
+        """
+
+        if random_state is None:
+            random_state = np.random
+
+        columns = random_state.randint(len(self), size=size)
+        uniforms = random_state.random_sample(size=size)
+
+        idxs = np.where(uniforms < self._probs[columns], columns, self._aliases[columns])
+
+        if size is None:
+            return int(idxs)
+        else:
+            return idxs
@@ -1,6 +1,7 @@
 """Miscellaneous functions needed by wepy."""
 
 import json
+import itertools as it
 import warnings
 
 import numpy as np
@@ -78,6 +79,261 @@ def box_vectors_to_lengths_angles(box_vectors):
 
     return unitcell_lengths, unitcell_angles
 
+def traj_group_pair(traj_coords, traj_unitcell_side_lengths, member_a_idxs, member_b_idxs):
+    """For many frames, move the coordinates of member_b of a pair to
+    the image of the periodic unitcell that minimizes the difference
+    between the centers of geometry of the two members.
+
+    This is the same as `geomm.grouping.group_pair` for every frame.
+
+    Parameters
+    ----------
+    traj_coords : arraylike of float of shape (n_frames, n_coords, 3)
+
+    traj_unitcell_side_lengths : arraylike of float of shape (n_frames, 3)
+        The lengths of the sides of the rectangular unitcell of each
+        frame.
+
+    member_a_idxs : arraylike of int of rank 1
+
+    member_b_idxs : arraylike of int of rank 1
+
+    Returns
+    -------
+    traj_grouped_coords : numpy.ndarray of float of shape (n_frames, n_coords, 3)
+
+    """
+
+    traj_coords = np.asarray(traj_coords)
+    traj_unitcell_side_lengths = np.asarray(traj_unitcell_side_lengths)
+
+    traj_grouped_coords = np.copy(traj_coords)
+
+    # the difference between the centroids of the members
+    centroid_dists = traj_coords[:, member_a_idxs].mean(axis=1) - \
+                     traj_coords[:, member_b_idxs].mean(axis=1)
+
+    # shift member_b by a unitcell length in the dimensions where
+    # the difference is more than half of it
+    unitcell_half_lengths = traj_unitcell_side_lengths * 0.5
+    shifts = np.where(centroid_dists > unitcell_half_lengths, traj_unitcell_side_lengths, 0.0) - \
+             np.where(centroid_dists < -unitcell_half_lengths, traj_unitcell_side_lengths, 0.0)
+
+    traj_grouped_coords[:, member_b_idxs] += shifts[:, np.newaxis, :]
+
+    return traj_grouped_coords
+
+def traj_center_around(traj_coords, idxs):
+    """For many frames, center the coordinates at the origin based on
+    the centroid of a subset of them.
+
+    Parameters
+    ----------
+    traj_coords : arraylike of float of shape (n_frames, n_coords, 3)
+
+    idxs : arraylike of int
+        The idxs of the coordinates to compute the centroid of.
+
+    Returns
+    -------
+    traj_centered_coords : numpy.ndarray of float of shape (n_frames, n_coords, 3)
+
+    """
+
+    traj_coords = np.asarray(traj_coords)
+
+    return traj_coords - traj_coords[:, idxs].mean(axis=1, keepdims=True)
+
+def traj_superimpose(ref_coords, traj_coords, idxs=None):
+    """Superimpose the coordinates of many frames to reference
+    coordinates with the Kabsch algorithm.
+
+    Like `geomm.superimpose.superimpose` this assumes that the
+    coordinates are centered, the optimal rotation is applied to the
+    coordinates which are then translated to the centroid of the
+    reference coordinates.
+
+    Parameters
+    ----------
+    ref_coords : arraylike of float of shape (n_coords, 3)
+
+    traj_coords : arraylike of float of shape (n_frames, n_coords, 3)
+
+    idxs : arraylike of int, optional
+        If given the superposition is based only on these
+        coordinates, although the rotation is applied to all of
+        them.
+
+    Returns
+    -------
+    traj_sup_coords : numpy.ndarray of float of shape (n_frames, n_coords, 3)
+
+    rotation_matrices : numpy.ndarray of float of shape (n_frames, 3, 3)
+        The rotation matrix of each frame, which are applied as
+        `np.dot(coords, rotation_matrix)`.
+
+    rmsds : numpy.ndarray of float of shape (n_frames,)
+        The RMSD of the aligned coordinates after superimposing.
+
+    """
+
+    ref_coords = np.asarray(ref_coords, dtype=np.float64)
+    traj_coords = np.asarray(traj_coords, dtype=np.float64)
+
+    if idxs is None:
+        align_ref_coords = ref_coords
+        align_traj_coords = traj_coords
+    else:
+        align_ref_coords = ref_coords[idxs]
+        align_traj_coords = traj_coords[:, idxs]
+
+    # the SVD of the covariance matrices of each frame with the
+    # reference gives the rotations, corrected so they are never
+    # reflections
+    covariances = np.einsum('fai,aj->fij', align_traj_coords, align_ref_coords)
+    u, s, vt = np.linalg.svd(covariances)
+
+    signs = np.sign(np.linalg.det(np.matmul(u, vt)))
+    signs[signs == 0] = 1.0
+    u[:, :, -1] *= signs[:, np.newaxis]
+
+    rotation_matrices = np.matmul(u, vt)
+
+    traj_sup_coords = np.matmul(traj_coords, rotation_matrices) + align_ref_coords.mean(axis=0)
+
+    # the RMSD of the aligned coordinates, like for Theobald-QCP this
+    # is for the coordinates as given (i.e. assumed to be centered)
+    align_diffs = np.matmul(align_traj_coords, rotation_matrices) - align_ref_coords
+    rmsds = np.sqrt((align_diffs**2).sum(axis=2).mean(axis=1))
+
+    return traj_sup_coords, rotation_matrices, rmsds
+
+def triu_distance_matrix(distance_matrix):
+    """Get the values of a symmetric distance matrix above the diagonal,
+    which is all that is needed to store it.
+
+    Parameters
+    ----------
+    distance_matrix : arraylike of float of shape (n, n)
+
+    Returns
+    -------
+    triu_values : numpy.ndarray of float of shape (n * (n - 1) / 2,)
+        The values above the diagonal row by row.
+
+    """
+
+    distance_matrix = np.asarray(distance_matrix)
+
+    return distance_matrix[np.triu_indices(distance_matrix.shape[0], k=1)]
+
+def expand_triu_distance_matrix(triu_values, n):
+    """Make the full symmetric distance matrix from the values above its
+    diagonal, with zeros on the diagonal.
+
+    Parameters
+    ----------
+    triu_values : arraylike of float of shape (n * (n - 1) / 2,)
+        The values above the diagonal row by row, as given by
+        `triu_distance_matrix`.
+
+    n : int
+        The number of rows of the matrix.
+
+    Returns
+    -------
+    distance_matrix : numpy.ndarray of float of shape (n, n)
+
+    """
+
+    triu_values = np.asarray(triu_values)
+
+    distance_matrix = np.zeros((n, n), dtype=triu_values.dtype)
+
+    rows, cols = np.triu_indices(n, k=1)
+    distance_matrix[rows, cols] = triu_values
+    distance_matrix[cols, rows] = triu_values
+
+    return distance_matrix
+
+# the maximum number of pair displacement vectors to compute at once
+# in `traj_min_pair_distances`, to bound the memory used
+MAX_CHUNK_PAIRS = 2**20
+
+def traj_min_pair_distances(traj_coords, traj_box_vectors, pairs):
+    """For many frames, the minimum of the distances between pairs of
+    coordinates through the periodic boundary conditions.
+
+    The minimum image convention is used the same way as
+    `mdtraj.compute_distances`: for rectangular boxes the displacements
+    are wrapped into the box and for triclinic boxes (which must be in
+    the reduced form used by OpenMM, i.e. lower triangular) the
+    neighboring images of the wrapped displacements are also checked.
+
+    Parameters
+    ----------
+    traj_coords : arraylike of float of shape (n_frames, n_coords, 3)
+
+    traj_box_vectors : arraylike of float of shape (n_frames, 3, 3)
+        The box vectors (as rows) of each frame.
+
+    pairs : arraylike of int of shape (n_pairs, 2)
+        The indices of the pairs of coordinates.
+
+    Returns
+    -------
+    traj_min_distances : numpy.ndarray of float of shape (n_frames,)
+
+    """
+
+    traj_coords = np.asarray(traj_coords)
+    traj_box_vectors = np.asarray(traj_box_vectors, dtype=np.float64)
+    pairs = np.asarray(pairs)
+
+    n_frames = traj_coords.shape[0]
+    n_pairs = pairs.shape[0]
+
+    # compute the distances for chunks of frames at a time
+    chunk_size = max(1, MAX_CHUNK_PAIRS // max(1, n_pairs))
+
+    traj_min_distances = np.zeros(n_frames)
+    for chunk_start in range(0, n_frames, chunk_size):
+        chunk_slice = slice(chunk_start, chunk_start + chunk_size)
+
+        box_vectors = traj_box_vectors[chunk_slice]
+
+        # the displacements of the pairs in each frame
+        disps = (traj_coords[chunk_slice][:, pairs[:, 1]] -
+                 traj_coords[chunk_slice][:, pairs[:, 0]]).astype(np.float64)
+
+        # wrap the displacements into the box, starting with the last
+        # box vector which is the only one with a z component
+        for dim_idx in (2, 1, 0):
+            box_vector = box_vectors[:, dim_idx]
+            shifts = np.round(disps[..., dim_idx] / box_vector[:, np.newaxis, dim_idx])
+            disps -= shifts[..., np.newaxis] * box_vector[:, np.newaxis, :]
+
+        distances = np.sqrt((disps**2).sum(axis=-1))
+
+        # for triclinic boxes the wrapped displacement isn't always
+        # the shortest so we check the neighboring images too
+        off_diagonal = box_vectors[:, ~np.eye(3, dtype=bool)]
+        if np.any(off_diagonal != 0.0):
+
+            for image_shift in it.product((-1, 0, 1), repeat=3):
+
+                if image_shift == (0, 0, 0):
+                    continue
+
+                shift_vectors = np.einsum('i,fij->fj', np.array(image_shift), box_vectors)
+                image_distances = np.sqrt(((disps + shift_vectors[:, np.newaxis, :])**2).sum(axis=-1))
+
+                distances = np.minimum(distances, image_distances)
+
+        traj_min_distances[chunk_slice] = distances.min(axis=1)
+
+    return traj_min_distances
+
 
 
 # License applicable to the function 'lengths_and_angles_to_box_vectors'
@@ -62,6 +62,12 @@ values of time (in seconds) for each task (i.e. segment of walker
 dynamics) it ran in the last cycle only (not cumulative over
 consecutive cycles).
 
+- worker_segment_split_times : dict of int : list of dict of str : float
+
+Which is similar but each element is a dictionary of named times for
+parts of each segment (e.g. the 'setup' and 'steps' times reported by
+the OpenMMRunner) which may be empty.
+
 The `init` method is called at runtime by the simulation manager at
 the beginning of the simulation and allows for performing such actions
 as opening file handles or starting worker processes (as is the case
@@ -88,6 +94,36 @@ The only interfacing that facilitates their usage is that the
 simulation manager will pass a required keyword argument 'num_workers'
 to the call to `init`.
 
+The WorkerMapper gives the 'segment_func' to each worker only once
+when the worker processes are started, where it is cached. The tasks
+put on the queue every cycle then only carry the arguments (i.e. the
+walker and the segment length) and not the runner itself, which can
+be very large (e.g. an OpenMM System for a big molecular system).
+
+The walkers themselves can also be sent to and from the workers
+without pickling their arrays through the queues by giving the
+WorkerMapper a SharedMemoryTransport (wepy.work_mapper.transport)
+which lays them out in shared memory.
+
+The AsyncMapper (wepy.work_mapper.mapper.AsyncMapper) is a
+WorkerMapper that collects results with asyncio futures. With its
+`map_streaming` method functions can be applied to each result as
+soon as it is done while other segments are still running. The
+simulation manager uses this to compute the per-walker boundary
+condition progress and resampler distance images.
+
+Functions can also be given to `init` as 'segment_result_funcs' which
+are cached in the workers along with the 'segment_func' and applied
+to each new walker right after its segment in the worker process
+itself. Their values for the last mapping are in the
+`segment_func_results` attribute. The simulation manager uses this
+for boundary conditions that have their progress computed in the
+workers (e.g. the ReceptorBC with `worker_progress`).
+
+Both restart workers that die while a mapping is running and retry
+the tasks they were running, raising a WorkerMapperError if a task
+keeps failing or the mapping goes over its timeout.
+
 See the simulation manager module to see what fields are passed to the
 mappers. These will likely not be removed in the future, although more
 may be added.
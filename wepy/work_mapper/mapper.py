@@ -5,16 +5,115 @@ wepy simulation cycles.
 """
 
 import multiprocessing as mp
-from multiprocessing import Queue, JoinableQueue
+from multiprocessing import JoinableQueue
+from multiprocessing.connection import wait as wait_connections
+from collections import deque
 import queue
 import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from warnings import warn
 
-from wepy.work_mapper.worker import Worker, Task
+import numpy as np
+
+from wepy.work_mapper.worker import Worker, Task, TaskBatch, ResultPipe, \
+    TASK_STARTED, TASK_COMPLETED
+from wepy.sim_logging import log_event, log_payload
 
 PY_MAP = map
 
+class WorkerMapperError(Exception):
+    """Error for when the WorkerMapper cannot finish a mapping, e.g. when
+    workers keep dying or the mapping times out."""
+    pass
+
+class ResultPipes(object):
+    """The receiving ends of the result pipes of the workers, with the
+    `get` method of a queue.
+
+    Each worker sends its messages through its own pipe (see
+    ResultPipe) so that a worker dying can only break its own pipe. A
+    new pipe is made for each worker that is started, and the pipes
+    of dead workers are read until they are empty and then dropped.
+
+    """
+
+    def __init__(self):
+
+        self._readers = []
+
+        # messages received but not yet gotten
+        self._messages = deque()
+
+    def new_pipe(self):
+        """Make a pipe for a new worker.
+
+        Returns
+        -------
+        result_pipe : ResultPipe
+            The sending end to give to the worker, which should be
+            closed in this process after the worker is started.
+
+        """
+
+        reader, writer = mp.Pipe(duplex=False)
+
+        self._readers.append(reader)
+
+        return ResultPipe(writer)
+
+    def get(self, timeout=None):
+        """Get the next message from any of the workers.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The time in seconds to wait for a message.
+
+        Returns
+        -------
+        message : object
+
+        Raises
+        ------
+        queue.Empty
+            If no message was received before the timeout.
+
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        while len(self._messages) == 0:
+
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+
+            for reader in wait_connections(self._readers, timeout=remaining):
+
+                try:
+                    self._messages.append(reader.recv())
+
+                # the worker on the other end died and everything it
+                # sent has been read (or it died while sending)
+                except (EOFError, OSError):
+                    self._readers.remove(reader)
+                    reader.close()
+
+            if len(self._messages) == 0 and deadline is not None and time.time() >= deadline:
+                raise queue.Empty
+
+        return self._messages.popleft()
+
+    def close(self):
+        """Close the receiving ends of all the pipes."""
+
+        for reader in self._readers:
+            reader.close()
+
+        self._readers = []
+        self._messages.clear()
+
+
 class ABCMapper(object):
     """Abstract base class for a Mapper. Useful only for showing the
     interface stubs."""
@@ -47,8 +146,12 @@ class Mapper(object):
 
         self._segment_func = segment_func
         self._worker_segment_times = {0 : []}
+        self._worker_segment_split_times = {0 : []}
+
+        self._segment_result_funcs = {}
+        self._segment_func_results = {}
 
-    def init(self, segment_func=None, **kwargs):
+    def init(self, segment_func=None, segment_result_funcs=None, **kwargs):
         """Runtime initialization and setting of function to map over walkers.
 
         Parameters
@@ -56,6 +159,13 @@ class Mapper(object):
         segment_func : callable implementing the Runner.run_segment interface
              (Default value = None)
 
+        segment_result_funcs : dict of str : callable, optional
+            Functions to apply to each result of 'segment_func' right
+            after it is run, where it is run (i.e. in the worker
+            processes for the WorkerMapper). Their values for the
+            last mapping are in `segment_func_results`.
+             (Default value = None)
+
         """
 
         if segment_func is None:
@@ -63,11 +173,38 @@ class Mapper(object):
 
         self._func = segment_func
 
+        if segment_result_funcs is None:
+            self._segment_result_funcs = {}
+        else:
+            self._segment_result_funcs = segment_result_funcs
+
+        self._segment_func_results = {}
+
     @property
     def segment_func(self):
         """The function that will be called for new data in the `map` method."""
         return self._func
 
+    @property
+    def segment_result_funcs(self):
+        """The functions applied to each result of 'segment_func' right
+        after it is run."""
+        return self._segment_result_funcs
+
+    @property
+    def segment_func_results(self):
+        """The values of the segment result functions for each result of
+        the last mapping.
+
+        Returns
+        -------
+        segment_func_results : dict of str : list
+            The values of each function for each result, in the same
+            order as the results.
+
+        """
+        return self._segment_func_results
+
     def cleanup(self, **kwargs):
         """Runtime post-simulation tasks.
 
@@ -108,6 +245,7 @@ class Mapper(object):
 
         segment_times = []
         results = []
+        func_results = {key : [] for key in self.segment_result_funcs.keys()}
         for arg_idx in range(len(args[0])):
             start = time.time()
             result = self._func(*[arg[arg_idx] for arg in args])
@@ -117,7 +255,13 @@ class Mapper(object):
 
             results.append(result)
 
-        self._worker_segment_times[0] = segment_times
+            for key, func in self.segment_result_funcs.items():
+                func_results[key].append(func(result))
+
+        # a new dictionary, not updated in place, since the last one
+        # may still be in a report waiting to be reported
+        self._worker_segment_times = {0 : segment_times}
+        self._segment_func_results = func_results
 
         return results
 
@@ -134,16 +278,91 @@ class Mapper(object):
         """
         return self._worker_segment_times
 
+    @property
+    def worker_segment_split_times(self):
+        """The named split times for parts of each segment (e.g. 'setup'
+        and 'steps') for each walker, if the segments reported them.
+
+        The Mapper does not collect split times so the lists are
+        always empty.
+
+        Returns
+        -------
+        worker_seg_split_times : dict of int : list of dict of str : float
+            Dictionary mapping worker indices to a list of dictionaries
+            of split times for each segment run.
+
+        """
+        return self._worker_segment_split_times
+
 class WorkerMapper(Mapper):
     """Work mapper implementation using multiple worker processes and task
     queue.
 
     Uses the python multiprocessing module to spawn multiple worker
     processes which watch a task queue of walker segments.
+
+    Tasks can be put on the queue in order of their predicted run time
+    (longest first) so that the long tasks don't end up being run at
+    the end of the cycle while most workers are idle. The prediction
+    is simply the last run time of the task with the same index.
+
+    Optionally, tasks which are taking much longer than the others
+    (stragglers) can be speculatively run again on idle workers, the
+    result from whichever finishes first is used and the other is
+    ignored.
+
+    Worker processes are monitored while waiting for results. Workers
+    which die (e.g. killed for running out of memory or from a
+    segfault in a compiled library) are restarted and the task they
+    were running is put back on the queue. A task will only be retried
+    a limited number of times before a WorkerMapperError is raised. A
+    timeout for the whole mapping can also be given, after which a
+    WorkerMapperError is raised.
+
+    For cheap segments with many walkers the overhead of the queues
+    for each task can dominate. The walkers can then be sent to the
+    workers in batches (TaskBatch) which are run in one go, either of
+    a fixed size or chosen automatically from the measured run time
+    of each segment. When batching the tasks on the queue (and their
+    indices in the messages from the workers) are the batches.
+
+    The segment result functions (given in `init`) are run in the
+    worker processes right after each segment and their values are
+    sent back with the new walker, e.g. so that the progress of the
+    boundary conditions isn't computed serially in the main process
+    after all the segments are done.
+
+    """
+
+    WORKER_JOIN_TIMEOUT = 5.0
+    """The time in seconds to wait for the workers to exit in `cleanup`
+    before terminating them."""
+
+    profiler = None
+    """A CycleProfiler (wepy.profiling) the times of the mapping phases
+    are added to, this is set by the simulation manager."""
+
+    TASK_ORDERS = ('fifo', 'longest_first',)
+    """The orders tasks can be put on the queue in.
+
+    'fifo' : in the order of the arguments (i.e. the walkers).
+
+    'longest_first' : by decreasing predicted run time.
     """
 
     def __init__(self, num_workers=None, worker_type=None,
-                 worker_attributes=None, **kwargs):
+                 worker_attributes=None,
+                 task_order='fifo',
+                 speculative=False,
+                 straggler_factor=2.0,
+                 poll_interval=0.1,
+                 transport=None,
+                 max_task_retries=3,
+                 map_timeout=None,
+                 batch_size=1,
+                 min_batch_time=0.05,
+                 **kwargs):
         """Constructor for WorkerMapper.
 
         kwargs are ignored.
@@ -163,8 +382,131 @@ class WorkerMapper(Mapper):
             A dictionary of values that are passed to the worker
             constructor as key-word arguments.
 
+        task_order : str
+            One of the TASK_ORDERS for the order tasks are put on the
+            queue.
+           (Default = 'fifo')
+
+        speculative : bool
+            Whether to speculatively run straggling tasks again on idle
+            workers.
+           (Default = False)
+
+        straggler_factor : float
+            A running task is considered straggling when it has been
+            running for longer than this factor times the median run
+            time of the tasks already finished in the mapping.
+           (Default = 2.0)
+
+        poll_interval : float
+            The time in seconds to wait for results before checking
+            the workers are alive and for stragglers when running
+            speculatively.
+           (Default = 0.1)
+
+        transport : SharedMemoryTransport, optional
+            If given the arrays of walker states are sent to and from
+            the workers through it (e.g. in shared memory) and only
+            small descriptors are sent through the queues. Otherwise
+            the whole walkers are pickled through the queues.
+           (Default = None)
+
+        max_task_retries : int
+            The number of times a task is put back on the queue after
+            the worker running it died, before giving up.
+           (Default = 3)
+
+        map_timeout : float, optional
+            If given, the time in seconds after which a mapping (i.e.
+            running the segments of a cycle) that is not finished is
+            given up on.
+           (Default = None)
+
+        batch_size : int or 'auto'
+            The number of walkers to send to a worker in each task. If
+            'auto' it is chosen every mapping so that each batch is
+            predicted to run for at least `min_batch_time`, from the
+            last run times of the segments, while still giving every
+            worker a batch.
+           (Default = 1)
+
+        min_batch_time : float
+            The minimum predicted run time in seconds of a batch when
+            choosing the batch size automatically.
+           (Default = 0.05)
+
+        Warnings
+        --------
+
+        Speculative execution should only be used when the time a
+        segment takes is not correlated with the dynamics of the
+        walker (e.g. when it is due to differences in hardware),
+        since otherwise it will bias the results to the walkers with
+        faster segments.
+
+        The losing copy of a speculatively run task cannot be
+        interrupted and will keep its worker busy until it finishes,
+        its result is just ignored. Copies that are still on the queue
+        when the mapping finishes are skipped by the workers.
+
         """
 
+        if task_order not in self.TASK_ORDERS:
+            raise ValueError("task_order must be one of {}, not {}".format(
+                self.TASK_ORDERS, task_order))
+
+        if batch_size != 'auto' and not (isinstance(batch_size, int) and batch_size >= 1):
+            raise ValueError("batch_size must be a positive integer or 'auto', not {}".format(
+                batch_size))
+
+        self._task_order = task_order
+        self._speculative = speculative
+        self._straggler_factor = straggler_factor
+        self._poll_interval = poll_interval
+        self._transport = transport
+        self._max_task_retries = max_task_retries
+        self._map_timeout = map_timeout
+        self._batch_size = batch_size
+        self._min_batch_time = min_batch_time
+
+        # the tasks of the current mapping as they are put on the
+        # queue, and the indices of the walkers in each task if they
+        # are batches
+        self._tasks = []
+        self._batches = None
+
+        # the values of the segment result functions sent back with
+        # the results of each task of the current mapping
+        self._task_func_results = {}
+
+        # the segment result functions are given in `init`
+        self._segment_result_funcs = {}
+        self._segment_func_results = {}
+
+        # the last run time of the task for each task index, which is
+        # used as the prediction of their next run times
+        self._task_times = {}
+
+        # the index of the current mapping, used to identify and
+        # ignore results of speculative tasks from previous mappings
+        self._map_idx = 0
+
+        # the time the current mapping was started
+        self._map_start = None
+
+        # the id of the task each worker is currently running, or
+        # None if idle
+        self._worker_tasks = {}
+
+        # the shared arrays the workers write the id of the last task
+        # they took off the queue to, made in `init`
+        self._task_claims = []
+
+        # the shared index of the last finished mapping, the workers
+        # skip the tasks of finished mappings still on the queue
+        # (e.g. speculative copies), made in `init`
+        self._finished_map_idx = None
+
         if worker_attributes is not None:
             self._worker_attributes = worker_attributes
         else:
@@ -172,6 +514,7 @@ class WorkerMapper(Mapper):
 
         self._num_workers = num_workers
         self._worker_segment_times = {i : [] for i in range(self.num_workers)}
+        self._worker_segment_split_times = {i : [] for i in range(self.num_workers)}
 
         # choose the type of the worker
         if worker_type is None:
@@ -208,6 +551,56 @@ class WorkerMapper(Mapper):
         """
         return self._worker_type
 
+    @property
+    def task_order(self):
+        """The order tasks are put on the queue in, one of TASK_ORDERS."""
+        return self._task_order
+
+    @property
+    def speculative(self):
+        """Whether straggling tasks are speculatively run again."""
+        return self._speculative
+
+    @property
+    def straggler_factor(self):
+        """The factor of the median task time above which running tasks
+        are considered straggling."""
+        return self._straggler_factor
+
+    @property
+    def poll_interval(self):
+        """The time in seconds to wait for results before checking for
+        stragglers."""
+        return self._poll_interval
+
+    @property
+    def transport(self):
+        """The transport walkers are sent to and from workers through,
+        or None if they are sent through the queues."""
+        return self._transport
+
+    @property
+    def max_task_retries(self):
+        """The number of times a task is retried after its worker died."""
+        return self._max_task_retries
+
+    @property
+    def batch_size(self):
+        """The number of walkers sent to a worker in each task, or 'auto'."""
+        return self._batch_size
+
+    @property
+    def min_batch_time(self):
+        """The minimum predicted run time of a batch when choosing the
+        batch size automatically."""
+        return self._min_batch_time
+
+    @property
+    def map_timeout(self):
+        """The time in seconds after which a mapping is given up on, or
+        None for no limit."""
+        return self._map_timeout
+
     # TODO remove after testing
     # @worker_type.setter
     # def worker_type(self, worker_type):
@@ -235,6 +628,11 @@ class WorkerMapper(Mapper):
         segment_func : callable implementing the Runner.run_segment interface
              (Default value = None)
 
+        segment_result_funcs : dict of str : callable, optional
+            Functions which are applied to each new walker in the
+            worker processes right after its segment is run.
+             (Default value = None)
+
         """
 
         super().init(**kwargs)
@@ -251,21 +649,62 @@ class WorkerMapper(Mapper):
 
         # Establish communication queues
         self._task_queue = JoinableQueue()
-        self._result_queue = Queue()
+        self._result_queue = ResultPipes()
 
-        # Start workers, giving them all the queues
-        self._workers = []
-        for i in range(num_workers):
-            worker = self.worker_type(i, self._task_queue, self._result_queue,
-                                      **self._worker_attributes)
-            self._workers.append(worker)
+        # make the shared buffers before the workers so they can get
+        # the names of them
+        if self.transport is not None:
+            self.transport.init(num_workers)
 
-        # start the worker processes
-        for worker in self._workers:
-            worker.start()
+        # Start workers
+        self._task_claims = [mp.Array('q', 2) for i in range(num_workers)]
+        self._finished_map_idx = mp.Value('q', self._map_idx)
+        self._workers = [self._start_worker(i) for i in range(num_workers)]
+
+        # none of the workers are running tasks yet
+        self._worker_tasks = {i : None for i in range(num_workers)}
+
+    def _start_worker(self, worker_idx):
+        """Make and start a worker process.
+
+        The worker is given all the queues and the segment function
+        (and segment result functions) which it will cache so that it
+        is not sent with each task.
+
+        Parameters
+        ----------
+        worker_idx : int
+
+        Returns
+        -------
+        worker : object implementing the Worker interface
+
+        """
+
+        # no task has been claimed by the new worker yet
+        with self._task_claims[worker_idx].get_lock():
+            self._task_claims[worker_idx][0] = -1
+            self._task_claims[worker_idx][1] = -1
 
-            logging.info("Worker process started as name: {}; PID: {}".format(worker.name,
-                                                                              worker.pid))
+        result_pipe = self._result_queue.new_pipe()
+
+        worker = self.worker_type(worker_idx, self._task_queue, result_pipe,
+                                  task_claim=self._task_claims[worker_idx],
+                                  finished_map_idx=self._finished_map_idx,
+                                  segment_func=self._func,
+                                  transport=self.transport,
+                                  segment_result_funcs=self.segment_result_funcs,
+                                  **self._worker_attributes)
+        worker.start()
+
+        # only the worker sends on its pipe, so that we can tell when
+        # it has died
+        result_pipe.close()
+
+        logging.info("Worker process started as name: {}; PID: {}".format(worker.name,
+                                                                          worker.pid))
+
+        return worker
 
     def cleanup(self, **kwargs):
         """Runtime post-simulation tasks.
@@ -281,16 +720,32 @@ class WorkerMapper(Mapper):
 
         # send poison pills (Stop signals) to the queues to stop them in a nice way
         # and let them finish up
-        for i in range(self.num_workers):
+        for i in range(len(self._workers)):
             self._task_queue.put((None, None))
 
+        # wait for the workers to exit, workers which are still
+        # running tasks (e.g. after a mapping timed out) are killed
+        join_deadline = time.time() + self.WORKER_JOIN_TIMEOUT
+        for worker in self._workers:
+            worker.join(max(0.0, join_deadline - time.time()))
+
+            if worker.is_alive():
+                logging.warning("Worker {} did not exit, terminating it".format(worker.name))
+                worker.terminate()
+                worker.join()
+
+        # then free the shared buffers they were using
+        if self.transport is not None:
+            self.transport.cleanup()
+
         # delete the queues and workers
         self._task_queue = None
+        self._result_queue.close()
         self._result_queue = None
         self._workers = None
 
     def _make_task(self, *args, **kwargs):
-        """Generate a task from 'segment_func' attribute.
+        """Generate a task for the 'segment_func' attribute.
 
         Similar to partial evaluation (or currying).
 
@@ -298,73 +753,803 @@ class WorkerMapper(Mapper):
         'segment_func' by the worker processes when they receive the
         task from the queue.
 
+        The function itself is not put in the task since the workers
+        already cached it when they were started. Only the arguments
+        (e.g. the walker and segment length) are sent through the
+        queue.
+
         Returns
         -------
         task : Task object
 
         """
-        return Task(self._func, *args, **kwargs)
+        return Task(None, *args, **kwargs)
 
-    def map(self, *args):
-        # docstring in superclass
+    def _make_batch(self, args_list):
+        """Generate a batch of tasks for the 'segment_func' attribute.
 
-        map_process = mp.current_process()
-        logging.info("Mapping from process {}; PID {}".format(map_process.name, map_process.pid))
+        Parameters
+        ----------
+        args_list : list of tuple
+            The arguments for each call of 'segment_func'.
+
+        Returns
+        -------
+        task_batch : TaskBatch object
+
+        """
+        return TaskBatch(None, args_list)
+
+    def _choose_batch_size(self, num_tasks):
+        """Choose the number of walkers in each batch for a mapping.
+
+        Parameters
+        ----------
+        num_tasks : int
+            The number of calls of 'segment_func' in the mapping.
+
+        Returns
+        -------
+        batch_size : int
+
+        """
+
+        if self.batch_size != 'auto':
+            return self.batch_size
+
+        # nothing to base predictions on
+        if len(self._task_times) == 0:
+            return 1
+
+        mean_time = np.mean(list(self._task_times.values()))
+
+        # never make so few batches that workers are left idle
+        max_batch_size = max(1, int(np.ceil(num_tasks / len(self._workers))))
+
+        if mean_time <= 0.0:
+            return max_batch_size
+
+        batch_size = int(np.ceil(self.min_batch_time / mean_time))
+
+        return max(1, min(batch_size, max_batch_size))
+
+    def _schedule(self, num_tasks):
+        """Order the task indices for putting them on the queue.
+
+        Parameters
+        ----------
+        num_tasks : int
+            The number of tasks in the mapping.
+
+        Returns
+        -------
+        task_idxs : list of int
+            The task indices in the order they should be put on the queue.
+
+        """
+
+        task_idxs = list(range(num_tasks))
+
+        # nothing to base predictions on
+        if self.task_order == 'fifo' or len(self._task_times) == 0:
+            return task_idxs
+
+        elif self.task_order == 'longest_first':
+
+            # tasks we don't have times for are predicted to take the
+            # mean of the others
+            default_time = np.mean(list(self._task_times.values()))
+
+            return sorted(task_idxs,
+                          key=lambda task_idx: self._task_times.get(task_idx, default_time),
+                          reverse=True)
+
+    def _speculate(self, n_queued, task_start_times, results, speculated):
+        """Put copies of straggling tasks on the queue if there are idle
+        workers to run them.
+
+        Parameters
+        ----------
+        n_queued : int
+            The number of tasks of this mapping on the queue that have
+            not been started.
+
+        task_start_times : dict of int : float
+            The time each task of this mapping was started.
+
+        results : dict of int : tuple
+            The results of the finished tasks of this mapping.
+
+        speculated : set of int
+            The indices of the tasks that have already been copied,
+            new copies are added to this.
+
+        Returns
+        -------
+        n_queued : int
+            The number of tasks on the queue after adding the copies.
+
+        """
+
+        # we only speculate once all the tasks have been started,
+        # otherwise workers are not idle
+        if n_queued > 0 or len(results) == 0:
+            return n_queued
+
+        idle_workers = [worker_idx for worker_idx, task_id in self._worker_tasks.items()
+                        if task_id is None]
+
+        if len(idle_workers) == 0:
+            return n_queued
+
+        # the run times of batches are the total of their segments
+        median_time = np.median([np.sum(result[1]) for result in results.values()])
+
+        # get the running tasks that are straggling, longest running first
+        now = time.time()
+        stragglers = sorted([(now - start_time, task_idx)
+                             for task_idx, start_time in task_start_times.items()
+                             if (task_idx not in results) and
+                                (task_idx not in speculated) and
+                                (now - start_time > self.straggler_factor * median_time)],
+                            reverse=True)
+
+        for run_time, task_idx in stragglers[:len(idle_workers)]:
+
+            logging.info("Speculatively running task {} after {} s".format(task_idx, run_time))
+
+            self._task_queue.put(((self._map_idx, task_idx), self._tasks[task_idx]))
+
+            speculated.add(task_idx)
+            n_queued += 1
+
+        return n_queued
+
+    def _enqueue_tasks(self, *args):
+        """Put the tasks for a new mapping on the task queue.
+
+        Parameters
+        ----------
+        *args : list of list
+            Each element is the argument to one call of 'segment_func'.
+
+        Returns
+        -------
+        num_tasks : int
+            The number of tasks put on the queue, which is less than
+            the number of calls when they are batched.
+
+        """
+
+        enqueue_start = time.time()
+        self._map_start = enqueue_start
+
+        self._task_func_results = {}
 
         # make tuples for the arguments to each function call
-        task_args = zip(*args)
+        task_args = list(zip(*args))
+
+        # put the walkers into the transport, so only their
+        # descriptors will be put on the queue
+        if self.transport is not None:
+            task_args = self.transport.pack_tasks_args(task_args)
+
+        # tasks are identified by the index of the mapping and their
+        # index so that results of tasks from previous mappings can
+        # be ignored
+        self._map_idx += 1
+
+        # the order given by the scheduler
+        task_order = self._schedule(len(task_args))
+
+        batch_size = self._choose_batch_size(len(task_args))
+
+        if batch_size == 1:
+            self._batches = None
+            self._tasks = [self._make_task(*args) for args in task_args]
+            queue_order = task_order
+
+        # group the calls into batches in the order of the scheduler
+        else:
+            self._batches = [task_order[i:i + batch_size]
+                             for i in range(0, len(task_order), batch_size)]
+            self._tasks = [self._make_batch([task_args[task_idx] for task_idx in batch])
+                           for batch in self._batches]
+            queue_order = range(len(self._batches))
+
+            logging.info("Running {} segments in {} batches of {}".format(
+                len(task_args), len(self._batches), batch_size))
 
-        num_tasks = len(args[0])
         # Enqueue the jobs
-        for task_idx, task_arg in enumerate(task_args):
+        for task_idx in queue_order:
 
-            # a task will be the actual task and its task idx so we can
+            # a task will be the actual task and its task id so we can
             # sort them later
-            self._task_queue.put((task_idx, self._make_task(*task_arg)))
+            self._task_queue.put(((self._map_idx, task_idx), self._tasks[task_idx]))
 
+        if self.profiler is not None:
+            self.profiler.add_time('mapper/enqueue', time.time() - enqueue_start)
 
-        logging.info("Waiting for tasks to be run")
+        return len(self._tasks)
+
+    def _handle_message(self, message, results, task_start_times):
+        """Update the state of the current mapping from a message from a
+        worker.
+
+        Parameters
+        ----------
+        message : tuple
+            The message from the result queue.
+
+        results : dict of int : tuple
+            The results of the finished tasks of this mapping, a new
+            result is added to this.
+
+        task_start_times : dict of int : float
+            The time each task of this mapping was started, a newly
+            started task is added to this.
+
+        Returns
+        -------
+        kind : str
+            The kind of the message.
+
+        task_idx : int or None
+            The index of the task of this mapping the message was
+            about. None if it was for a task of a previous mapping or
+            a result for a task that was already finished.
+
+        """
+
+        kind, (map_idx, task_idx), worker_idx, payload = message
+
+        if kind == TASK_STARTED:
+
+            self._worker_tasks[worker_idx] = (map_idx, task_idx)
+
+            if map_idx != self._map_idx:
+                return kind, None
 
-        # Wait for all of the tasks to finish
-        self._task_queue.join()
+            task_start_times.setdefault(task_idx, time.time())
 
-        # workers_done = [worker.done for worker in self._workers]
+            return kind, task_idx
 
-        # if all(workers_done):
+        # otherwise the task was completed
+        self._worker_tasks[worker_idx] = None
+
+        # first result wins, ignore results from old mappings and
+        # the losing copies of speculative tasks
+        if map_idx != self._map_idx or task_idx in results:
+
+            log_event('result_ignored', map_idx=map_idx, task_idx=task_idx)
+            return kind, None
+
+        collect_start = time.time()
+
+        task_time, split_times, result, func_results = payload
+
+        # get the walker out of the transport
+        if self.transport is not None:
+            if self._batches is not None:
+                result = [self.transport.unpack(batch_result) for batch_result in result]
+            else:
+                result = self.transport.unpack(result)
+
+        results[task_idx] = (worker_idx, task_time, split_times, result)
+        self._task_func_results[task_idx] = func_results
+
+        log_event('result_retrieved', task_idx=task_idx, worker_idx=worker_idx)
+        log_payload('result', task_idx=task_idx, result=result)
+
+        if self.profiler is not None:
+
+            # the time from the task being done in the worker to
+            # receiving it here, i.e. sending the result
+            latency = collect_start - task_start_times.get(task_idx, collect_start) \
+                      - np.sum(task_time)
+
+            self.profiler.add_time('mapper/result_latency', max(0.0, latency))
+            self.profiler.add_time('mapper/collect', time.time() - collect_start)
+
+        return kind, task_idx
+
+    def _check_workers(self, results, task_retries):
+        """Restart any workers that died and put the tasks they were
+        running back on the queue.
+
+        The task a worker is running is known from the id it writes
+        to its shared task claim array as soon as it takes the task
+        off the queue, so it is not lost when the worker dies before
+        its started message is received (or even sent).
+
+        Parameters
+        ----------
+        results : dict of int : tuple
+            The results of the finished tasks of this mapping.
+
+        task_retries : dict of int : int
+            The number of times each task has been retried, this is
+            updated for the tasks put back on the queue.
+
+        Returns
+        -------
+        n_requeued : int
+            The number of tasks put back on the queue.
+
+        Raises
+        ------
+        WorkerMapperError
+            If a task has used up all its retries.
+
+        """
+
+        n_requeued = 0
+        for worker_idx, worker in enumerate(self._workers):
+
+            if worker.is_alive():
+                continue
+
+            # the last task the worker claimed, which is known even
+            # if its started message never made it here
+            with self._task_claims[worker_idx].get_lock():
+                claimed_task_id = tuple(self._task_claims[worker_idx][:])
+
+            if claimed_task_id[0] >= 0:
+                task_id = claimed_task_id
+            else:
+                task_id = self._worker_tasks[worker_idx]
+
+            logging.warning("Worker {} died with exit code {} while running task {}, "
+                            "restarting it".format(worker.name, worker.exitcode, task_id))
+
+            self._workers[worker_idx] = self._start_worker(worker_idx)
+            self._worker_tasks[worker_idx] = None
+
+            # nothing else to do if it wasn't running a task we still
+            # need the result of, the claimed task may also be an old
+            # one it already finished
+            if task_id is None:
+                continue
+
+            map_idx, task_idx = task_id
+            if map_idx != self._map_idx or task_idx in results:
+                continue
+
+            task_retries[task_idx] = task_retries.get(task_idx, 0) + 1
+
+            if task_retries[task_idx] > self.max_task_retries:
+                raise WorkerMapperError("Task {} failed after {} retries, the worker "
+                                        "running it died each time".format(
+                                            task_idx, self.max_task_retries))
+
+            logging.warning("Retrying task {}".format(task_idx))
+
+            self._task_queue.put(((map_idx, task_idx), self._tasks[task_idx]))
+            n_requeued += 1
+
+        return n_requeued
+
+    def _check_timeout(self, map_start):
+        """Raise an error if the mapping has gone on too long.
+
+        Parameters
+        ----------
+        map_start : float
+            The time the mapping was started.
+
+        Raises
+        ------
+        WorkerMapperError
+            If the mapping is over the timeout.
+
+        """
+
+        if self.map_timeout is not None and time.time() - map_start > self.map_timeout:
+            raise WorkerMapperError("Mapping not finished after the timeout of {} s".format(
+                self.map_timeout))
+
+    def _task_batches(self):
+        """The indices of the calls of 'segment_func' in each task of the
+        current mapping.
+
+        Returns
+        -------
+        batches : list of list of int
+
+        """
+
+        if self._batches is None:
+            return [[task_idx] for task_idx in range(len(self._tasks))]
+        else:
+            return self._batches
+
+    def _finish_mapping(self, results):
+        """Save the run times of the tasks of a finished mapping and get
+        their results in order.
+
+        Parameters
+        ----------
+        results : dict of int : tuple
+            The results of all the tasks of the mapping.
+
+        Returns
+        -------
+        results : list
+            The results of each call of 'segment_func' in order.
+
+        """
+
+        task_func_results = self._task_func_results
+
+        # any copies of the tasks of this mapping still on the queue
+        # will now be skipped by the workers
+        self._finished_map_idx.value = self._map_idx
+
+        # get the results for each call out of the batches
+        if self._batches is not None:
+
+            batch_results = results
+            results = {}
+            task_func_results = {}
+            for batch_idx, batch in enumerate(self._batches):
+                worker_idx, task_times, split_times, batch_result = batch_results[batch_idx]
+                batch_func_results = self._task_func_results.get(batch_idx)
+
+                for i, task_idx in enumerate(batch):
+                    results[task_idx] = (worker_idx, task_times[i],
+                                         split_times[i], batch_result[i])
+
+                    if batch_func_results is not None:
+                        task_func_results[task_idx] = batch_func_results[i]
+
+        num_tasks = len(results)
+
+        # collate the values of the segment result functions computed
+        # in the workers for each function
+        self._segment_func_results = {key : [task_func_results[task_idx][key]
+                                             for task_idx in range(num_tasks)]
+                                      for key in self.segment_result_funcs.keys()}
+
+        # save the task run times, so they can be accessed if desired,
+        # after clearing the task times from the last mapping
+        self._worker_segment_times = {i : [] for i in range(self.num_workers)}
+        self._worker_segment_split_times = {i : [] for i in range(self.num_workers)}
+        for task_idx in range(num_tasks):
+            worker_idx, task_time, split_times, result = results[task_idx]
+
+            self._worker_segment_times[worker_idx].append(task_time)
+            self._worker_segment_split_times[worker_idx].append(split_times)
+
+            # save the time as the prediction for this task next time
+            self._task_times[task_idx] = task_time
+
+        if self.profiler is not None:
+            self._profile_mapping(results)
+
+        # then just return the values of the function in the order of
+        # the tasks
+        return [results[task_idx][3] for task_idx in range(num_tasks)]
+
+    def _profile_mapping(self, results):
+        """Add the worker idle time and segment split times of a finished
+        mapping to the profiler.
+
+        Parameters
+        ----------
+        results : dict of int : tuple
+            The results of each call of 'segment_func'.
+
+        """
+
+        total_task_time = sum(result[1] for result in results.values())
+
+        map_time = time.time() - self._map_start
+        self.profiler.add_time('mapper/worker_idle',
+                               max(0.0, len(self._workers) * map_time - total_task_time))
+
+        for worker_idx, task_time, split_times, result in results.values():
+            for split_name, split_time in split_times.items():
+                self.profiler.add_time('segment/{}'.format(split_name), split_time)
+
+    def map(self, *args):
+        # docstring in superclass
+
+        map_process = mp.current_process()
+        logging.info("Mapping from process {}; PID {}".format(map_process.name, map_process.pid))
+
+        map_start = time.time()
+
+        num_tasks = self._enqueue_tasks(*args)
+
+        logging.info("Waiting for tasks to be run")
 
         # get the results out in an unordered way. We rely on the
         # number of tasks we know we put out because if you just try
         # to get from the queue until it is empty it will just wait
-        # forever, since nothing is there. ALternatively it is risky
-        # to implement a wait timeout or no wait in case there is a
-        # small wait time.
+        # forever, since nothing is there.
         logging.info("Retrieving results")
 
-        n_results = num_tasks
-        results = []
-        while n_results > 0:
+        # the number of tasks on the queue not yet started
+        n_queued = num_tasks
 
-            logging.info("trying to retrieve result: {}".format(n_results))
+        # the time each task was first started
+        task_start_times = {}
 
-            result = self._result_queue.get()
-            results.append(result)
+        # the tasks that have been speculatively copied
+        speculated = set()
+
+        # the number of times tasks were retried after their worker died
+        task_retries = {}
+
+        results = {}
+        while len(results) < num_tasks:
+
+            self._check_timeout(map_start)
+
+            n_queued += self._check_workers(results, task_retries)
 
-            logging.info("Retrieved result {}: {}".format(n_results, result))
+            if self.speculative:
+                n_queued = self._speculate(n_queued, task_start_times,
+                                           results, speculated)
 
-            n_results -= 1
+            # we only wait for results for a while before checking
+            # the workers again
+            try:
+                message = self._result_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
 
-        logging.info("No more results")
+            kind, task_idx = self._handle_message(message, results, task_start_times)
+
+            if kind == TASK_STARTED and task_idx is not None:
+                n_queued -= 1
 
         logging.info("Retrieved results")
 
-        # sort the results according to their task_idx
-        results.sort()
+        return self._finish_mapping(results)
 
-        # save the task run times, so they can be accessed if desired,
-        # after clearing the task times from the last mapping
-        self._worker_segment_times = {i : [] for i in range(self.num_workers)}
-        for task_idx, worker_idx, task_time, result in results:
-            self._worker_segment_times[worker_idx].append(task_time)
 
-        # then just return the values of the function
-        return [result for task_idx, worker_idx, task_time, result in results]
+class AsyncMapper(WorkerMapper):
+    """Worker mapper which collects the results of tasks with asyncio
+    futures so that work can be done on each result as soon as it
+    comes back, while the other tasks are still running.
+
+    Functions to apply to each result (e.g. computing the boundary
+    condition progress or the distance image of a new walker) can be
+    given to `map_streaming` and are run in a pool of threads in the
+    main process as the results stream in. This overlaps the
+    per-walker work that would otherwise be done serially after all
+    the segments finished with the running of the segments.
+
+    The `map` method works just like the WorkerMapper one.
+
+    Speculative running of straggling tasks is not supported.
+
+    """
+
+    def __init__(self, num_func_threads=1, **kwargs):
+        """Constructor for AsyncMapper.
+
+        All other key-word arguments are passed to the WorkerMapper
+        constructor.
+
+        Parameters
+        ----------
+        num_func_threads : int
+            The number of threads to run the result functions in.
+           (Default = 1)
+
+        """
+
+        if kwargs.get('speculative', False):
+            raise ValueError("Speculative running of tasks is not supported by the AsyncMapper")
+
+        super().__init__(**kwargs)
+
+        self._num_func_threads = num_func_threads
+
+        # the event loop and threads for waiting on the result queue
+        # and running functions on the results, these are made at
+        # runtime in `init`
+        self._loop = None
+        self._executor = None
+
+    @property
+    def num_func_threads(self):
+        """The number of threads to run the result functions in."""
+        return self._num_func_threads
+
+    def init(self, **kwargs):
+        # docstring in superclass
+
+        super().init(**kwargs)
+
+        # one thread is always waiting on the result queue
+        self._executor = ThreadPoolExecutor(max_workers=self.num_func_threads + 1)
+
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+
+    def cleanup(self, **kwargs):
+        # docstring in superclass
+
+        super().cleanup(**kwargs)
+
+        if self._loop is not None:
+            self._loop.close()
+            self._loop = None
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _get_message(self):
+        """Get a message from the result queue, giving up after the poll
+        interval so that a waiting thread never outlives its mapping.
+
+        Returns
+        -------
+        message : tuple or None
+            None if no message was received.
+
+        """
+
+        try:
+            return self._result_queue.get(timeout=self.poll_interval)
+        except queue.Empty:
+            return None
+
+    async def _collect_results(self, futures, results):
+        """Get messages from the workers until all the results of the
+        current mapping are in, setting the result of the future for
+        each task as they come in.
+
+        Parameters
+        ----------
+        futures : list of asyncio.Future
+            The future for each task.
+
+        results : dict of int : tuple
+            The results of the finished tasks are added to this.
+
+        """
+
+        loop = asyncio.get_event_loop()
+
+        map_start = time.time()
+
+        task_start_times = {}
+        task_retries = {}
+        while len(results) < len(futures):
+
+            self._check_timeout(map_start)
+
+            self._check_workers(results, task_retries)
+
+            message = await loop.run_in_executor(None, self._get_message)
+
+            if message is None:
+                continue
+
+            kind, task_idx = self._handle_message(message, results, task_start_times)
+
+            if kind == TASK_COMPLETED and task_idx is not None:
+                futures[task_idx].set_result(results[task_idx][3])
+
+    async def _apply_result_funcs(self, future, result_funcs):
+        """Apply the functions to the results of a task once it is done.
+
+        Parameters
+        ----------
+        future : asyncio.Future
+            The future for the result of the task.
+
+        result_funcs : dict of str : callable
+
+        Returns
+        -------
+        func_results : list of dict of str : value
+            The value of each function applied to each result of the
+            task, there is more than one result for batches.
+
+        """
+
+        loop = asyncio.get_event_loop()
+
+        result = await future
+
+        if self._batches is not None:
+            task_results = result
+        else:
+            task_results = [result]
+
+        func_results = []
+        for task_result in task_results:
+
+            task_func_results = {}
+            for key, func in result_funcs.items():
+                task_func_results[key] = await loop.run_in_executor(None, func, task_result)
+
+            func_results.append(task_func_results)
+
+        return func_results
+
+    async def map_async(self, *args, result_funcs=None):
+        """Map the 'segment_func' to args and apply the result functions
+        to each result as soon as it is done.
+
+        Parameters
+        ----------
+        *args : list of list
+            Each element is the argument to one call of 'segment_func'.
+
+        result_funcs : dict of str : callable, optional
+            Functions to apply to each result.
+
+        Returns
+        -------
+        results : list
+            The results of each call to 'segment_func' in the same order as input.
+
+        func_results : dict of str : list
+            The values of each result function for each result, in
+            the same order as the results.
+
+        """
+
+        if result_funcs is None:
+            result_funcs = {}
+
+        loop = asyncio.get_event_loop()
+
+        num_tasks = self._enqueue_tasks(*args)
+
+        futures = [loop.create_future() for task_idx in range(num_tasks)]
+
+        results = {}
+        tasks = [loop.create_task(self._collect_results(futures, results))] + \
+                [loop.create_task(self._apply_result_funcs(future, result_funcs))
+                 for future in futures]
+
+        try:
+            task_results = await asyncio.gather(*tasks)
+
+        # if any of them failed don't leave the others waiting
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        # get the result function values for each call out of the
+        # tasks (which may be batches)
+        call_func_results = {}
+        for batch, batch_func_results in zip(self._task_batches(), task_results[1:]):
+            for task_idx, task_func_results in zip(batch, batch_func_results):
+                call_func_results[task_idx] = task_func_results
+
+        # collate the result function values for each function
+        func_results = {key : [call_func_results[task_idx][key]
+                               for task_idx in range(len(call_func_results))]
+                        for key in result_funcs.keys()}
+
+        logging.info("Retrieved results")
+
+        return self._finish_mapping(results), func_results
+
+    def map_streaming(self, *args, result_funcs=None):
+        """Map the 'segment_func' to args and apply the result functions
+        to each result as soon as it is done.
+
+        See `map_async` for the arguments, this just runs it to
+        completion in the event loop of this mapper.
+
+        """
+
+        return self._loop.run_until_complete(self.map_async(*args,
+                                                            result_funcs=result_funcs))
+
+    def map(self, *args):
+        # docstring in superclass
+
+        results, _ = self.map_streaming(*args)
+
+        return results
@@ -0,0 +1,427 @@
+"""Transports for sending walkers between the WorkerMapper and its
+workers without pickling their arrays through the queues.
+
+By default the WorkerMapper pickles whole walkers (including all of
+the arrays in their states) into the task queue and the workers
+pickle the new walkers into the result queue. For large systems and
+ensembles this serialization takes a considerable amount of time and
+memory each cycle.
+
+The SharedMemoryTransport instead lays out the arrays of the walker
+states in preallocated shared memory blocks ('slabs') using the
+`multiprocessing.shared_memory` module (python >= 3.8). Only small
+descriptors (the WalkerDescriptor class) of where the arrays are in
+the slabs are sent through the queues.
+
+There is one slab the mapper writes the walkers for the tasks into
+which is grown as needed, and one slab for each worker that the
+worker writes the new walkers into. The worker slabs have a fixed
+size and results which don't fit are sent through the queue as
+before.
+
+The states of walkers are sent as the arrays (and other values) of
+the `dict` method of the WalkerState interface, and are rebuilt as
+WalkerState objects on the other side. Walkers whose state is a
+plain WalkerState are sent this way, as are walkers of types that
+accept plain WalkerStates for states of other types, which is marked
+by a true `ARRAY_STATES` class attribute on the walker type. For
+example the OpenMMWalker, whose OpenMMState wraps an OpenMM State
+object that can't be laid out in shared memory, is rebuilt with a
+plain WalkerState of its arrays which the OpenMMRunner sets into its
+simulation just the same.
+
+Other walkers (with states of other types that can't be rebuilt from
+their arrays) are pickled through the queues as usual, which is
+logged as a warning the first time it happens.
+
+"""
+
+import logging
+
+import numpy as np
+
+from wepy.walker import WalkerState
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+class WalkerDescriptor(object):
+    """Small picklable description of a walker whose state arrays are in
+    a shared memory slab."""
+
+    __slots__ = ('walker_type', 'weight', 'shm_name', 'array_specs', 'values')
+
+    def __init__(self, walker_type, weight, shm_name, array_specs, values):
+        """Constructor for WalkerDescriptor.
+
+        Parameters
+        ----------
+        walker_type : type
+            The type the walker will be rebuilt as.
+
+        weight : float
+            Weight of the walker.
+
+        shm_name : str
+            Name of the shared memory block the arrays are in.
+
+        array_specs : dict of str : tuple
+            Mapping of the state keys of arrays to a tuple of the byte
+            offset in the block, the shape, and the dtype string.
+
+        values : dict of str : value
+            The state values which are not arrays.
+
+        """
+
+        self.walker_type = walker_type
+        self.weight = weight
+        self.shm_name = shm_name
+        self.array_specs = array_specs
+        self.values = values
+
+class SharedMemoryTransport(object):
+    """Transport of walker states through shared memory slabs.
+
+    Only walkers with a plain WalkerState, or of a walker type with a
+    true `ARRAY_STATES` attribute (e.g. the OpenMMWalker), are sent
+    through the slabs. Both are rebuilt with a plain WalkerState of
+    the same type of walker. Walkers with other types of states are
+    pickled through the queues as without a transport, so that they
+    are not rebuilt with a different type of state. For these the
+    transport gives no speedup and their states should be converted
+    to WalkerStates (e.g. with the `dict` method) to benefit from it.
+
+    """
+
+    ALIGNMENT = 64
+    """Byte alignment of the start of each array in the slabs."""
+
+    def __init__(self, worker_slab_size=2**28, task_slab_size=2**28):
+        """Constructor for SharedMemoryTransport.
+
+        Parameters
+        ----------
+        worker_slab_size : int
+            The size in bytes of the slab for each worker to write new
+            walkers into.
+           (Default = 256 MiB)
+
+        task_slab_size : int
+            The initial size in bytes of the slab the mapper writes
+            task walkers into, it is grown if needed.
+           (Default = 256 MiB)
+
+        """
+
+        if shared_memory is None:
+            raise ImportError("The SharedMemoryTransport requires python >= 3.8 "
+                              "for the multiprocessing.shared_memory module")
+
+        self.worker_slab_size = worker_slab_size
+        self.task_slab_size = task_slab_size
+
+        # the slabs, these are made at runtime in `init`
+        self._task_slab = None
+        self._worker_slab_names = []
+        self._worker_slabs = []
+
+        # task slabs that were replaced by bigger ones, these are
+        # kept until cleanup since queued copies of tasks may still
+        # refer to them
+        self._old_task_slabs = []
+
+        # shared memory blocks attached to in this process by name
+        self._attached = {}
+
+        # the offset of the next free byte in the slab of the worker
+        # in this process and the mapping it is used for
+        self._worker_offset = 0
+        self._worker_map_idx = None
+
+        # whether we have warned about walkers that can't be sent
+        # through the slabs yet
+        self._warned_unpackable = False
+
+    def __getstate__(self):
+
+        # shared memory blocks are only sent by name and are attached
+        # to again in the other process
+        state = self.__dict__.copy()
+        state['_task_slab'] = None
+        state['_worker_slabs'] = []
+        state['_old_task_slabs'] = []
+        state['_attached'] = {}
+
+        return state
+
+    @property
+    def worker_slab_names(self):
+        """The names of the shared memory slabs for each worker."""
+        return self._worker_slab_names
+
+    def init(self, num_workers):
+        """Make the shared memory slabs, called by the mapper before the
+        workers are started.
+
+        Parameters
+        ----------
+        num_workers : int
+
+        """
+
+        self._task_slab = shared_memory.SharedMemory(create=True, size=self.task_slab_size)
+
+        self._worker_slabs = [shared_memory.SharedMemory(create=True,
+                                                         size=self.worker_slab_size)
+                              for i in range(num_workers)]
+        self._worker_slab_names = [slab.name for slab in self._worker_slabs]
+
+    def cleanup(self):
+        """Free all the shared memory slabs, called by the mapper."""
+
+        for slab in [self._task_slab] + self._old_task_slabs + self._worker_slabs:
+            if slab is not None:
+                slab.close()
+                slab.unlink()
+
+        self._task_slab = None
+        self._old_task_slabs = []
+        self._worker_slabs = []
+        self._worker_slab_names = []
+
+        for slab in self._attached.values():
+            slab.close()
+
+        self._attached = {}
+
+    def _attach(self, shm_name):
+        """Get a shared memory block by name, attaching to it if this is
+        the first time it is used in this process."""
+
+        if self._task_slab is not None and shm_name == self._task_slab.name:
+            return self._task_slab
+
+        if shm_name not in self._attached:
+
+            self._attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+
+        return self._attached[shm_name]
+
+    @classmethod
+    def _aligned(cls, offset):
+        return -(-offset // cls.ALIGNMENT) * cls.ALIGNMENT
+
+    @staticmethod
+    def _is_walker(obj):
+        return hasattr(obj, 'state') and hasattr(obj, 'weight')
+
+    def _is_packable(self, obj):
+        """Test whether an object is a walker that can be sent through
+        the slabs, i.e. that it can be rebuilt with a plain WalkerState,
+        either because it has one or its type accepts them instead."""
+
+        if not self._is_walker(obj):
+            return False
+
+        if type(obj.state) is not WalkerState and \
+           not getattr(type(obj), 'ARRAY_STATES', False):
+
+            if not self._warned_unpackable:
+                logging.warning(
+                    "Walkers with states of type {} can't be sent through shared "
+                    "memory and are pickled instead".format(type(obj.state).__name__))
+                self._warned_unpackable = True
+
+            return False
+
+        return True
+
+    @staticmethod
+    def _split_state(walker):
+        """Split the state of a walker into its arrays and other values."""
+
+        arrays = {}
+        values = {}
+        for key, value in walker.state.dict().items():
+            if isinstance(value, np.ndarray) and value.dtype != object:
+                arrays[key] = np.ascontiguousarray(value)
+            else:
+                values[key] = value
+
+        return arrays, values
+
+    def _write(self, slab, offset, walker):
+        """Write the arrays of a walker's state into a slab.
+
+        Returns
+        -------
+        descriptor : WalkerDescriptor or None
+            None if the arrays don't fit in the slab.
+
+        end_offset : int
+            The offset after the written arrays.
+
+        """
+
+        arrays, values = self._split_state(walker)
+
+        array_specs = {}
+        for key, array in arrays.items():
+
+            offset = self._aligned(offset)
+            end = offset + array.nbytes
+
+            if end > slab.size:
+                return None, offset
+
+            dest = np.ndarray(array.shape, dtype=array.dtype,
+                              buffer=slab.buf, offset=offset)
+            dest[...] = array
+
+            array_specs[key] = (offset, array.shape, array.dtype.str)
+            offset = end
+
+        return WalkerDescriptor(type(walker), walker.weight, slab.name,
+                                array_specs, values), offset
+
+    def _walker_nbytes(self, walker):
+
+        arrays, values = self._split_state(walker)
+
+        return sum(self.ALIGNMENT + array.nbytes for array in arrays.values())
+
+    def pack_tasks_args(self, tasks_args):
+        """Write all walkers in the arguments of the tasks into the task
+        slab, replacing them with descriptors. Called in the mapper.
+
+        Parameters
+        ----------
+        tasks_args : list of tuple
+            The arguments for each task.
+
+        Returns
+        -------
+        packed_tasks_args : list of tuple
+
+        """
+
+        # grow the task slab if all the walkers won't fit
+        nbytes = sum(self._walker_nbytes(arg)
+                     for task_args in tasks_args
+                     for arg in task_args
+                     if self._is_packable(arg))
+
+        if nbytes > self._task_slab.size:
+
+            logging.info("Growing the shared memory task slab to {} bytes".format(nbytes))
+
+            self._old_task_slabs.append(self._task_slab)
+            self._task_slab = shared_memory.SharedMemory(create=True, size=nbytes)
+
+        offset = 0
+        packed_tasks_args = []
+        for task_args in tasks_args:
+
+            packed_args = []
+            for arg in task_args:
+
+                if self._is_packable(arg):
+                    arg, offset = self._write(self._task_slab, offset, arg)
+
+                packed_args.append(arg)
+
+            packed_tasks_args.append(tuple(packed_args))
+
+        return packed_tasks_args
+
+    def unpack_args(self, args):
+        """Rebuild walkers from descriptors in the arguments of a task.
+        Called in the worker.
+
+        Parameters
+        ----------
+        args : tuple
+
+        Returns
+        -------
+        unpacked_args : tuple
+
+        """
+
+        return tuple(self.unpack(arg) for arg in args)
+
+    def pack_result(self, worker_idx, task_id, result):
+        """Write the walker resulting from a task into the slab of the
+        worker. Called in the worker.
+
+        If the walker doesn't fit in the remaining space of the slab,
+        or its state is not a plain WalkerState, it is returned as is
+        to be pickled.
+
+        Parameters
+        ----------
+        worker_idx : int
+
+        task_id : tuple of int
+            The id of the task, which is the mapping index and the
+            task index.
+
+        result : object
+
+        Returns
+        -------
+        packed_result : WalkerDescriptor or object
+
+        """
+
+        if not self._is_packable(result):
+            return result
+
+        # the slab is reused for each mapping
+        map_idx = task_id[0]
+        if map_idx != self._worker_map_idx:
+            self._worker_map_idx = map_idx
+            self._worker_offset = 0
+
+        slab = self._attach(self.worker_slab_names[worker_idx])
+
+        descriptor, offset = self._write(slab, self._worker_offset, result)
+
+        if descriptor is None:
+            logging.info("Worker slab is full, sending result through the queue")
+            return result
+
+        self._worker_offset = offset
+
+        return descriptor
+
+    def unpack(self, obj):
+        """Rebuild a walker from a descriptor, other objects are returned
+        as is.
+
+        The arrays are copied out of the slab since it will be reused.
+
+        Parameters
+        ----------
+        obj : WalkerDescriptor or object
+
+        Returns
+        -------
+        walker_or_obj : object
+
+        """
+
+        if not isinstance(obj, WalkerDescriptor):
+            return obj
+
+        slab = self._attach(obj.shm_name)
+
+        state_d = dict(obj.values)
+        for key, (offset, shape, dtype) in obj.array_specs.items():
+            state_d[key] = np.ndarray(shape, dtype=np.dtype(dtype),
+                                      buffer=slab.buf, offset=offset).copy()
+
+        return obj.walker_type(WalkerState(**state_d), obj.weight)
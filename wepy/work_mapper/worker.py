@@ -5,6 +5,14 @@ import multiprocessing as mp
 import time
 import logging
 
+from wepy.sim_logging import log_event, log_payload
+
+TASK_STARTED = 'started'
+"""Message kind put on the result queue when a worker starts a task."""
+
+TASK_COMPLETED = 'completed'
+"""Message kind put on the result queue with the results of a task."""
+
 class Worker(Process):
     """Worker process.
 
@@ -13,13 +21,26 @@ class Worker(Process):
 
     When this class is constructed a new process will be formed.
 
+    Workers put messages on the result queue of the form `(kind,
+    task_idx, worker_idx, payload)`. When a task is started the kind
+    is TASK_STARTED with no payload, and when it is finished the kind
+    is TASK_COMPLETED and the payload is a tuple of the task run time,
+    the split times, the result of the task, and the values of the
+    segment result functions for the result (None if there are
+    none). For a TaskBatch the run times, split times, results, and
+    result function values are lists with an element for each call in
+    the batch.
+
     """
 
     NAME_TEMPLATE = "Worker-{}"
     """A string formatting template to identify worker processes in
     logs. The field will be filled with the worker index."""
 
-    def __init__(self, worker_idx, task_queue, result_queue, **kwargs):
+    def __init__(self, worker_idx, task_queue, result_queue,
+                 segment_func=None, transport=None,
+                 segment_result_funcs=None, task_claim=None,
+                 finished_map_idx=None, **kwargs):
         """Constructor for the Worker class.
 
         Parameters
@@ -30,8 +51,41 @@ class Worker(Process):
         task_queue : multiprocessing.JoinableQueue
             The shared task queue the worker will watch for new tasks to complete.
 
-        result_queue : multiprocessing.Queue
-            The shared queue that completed task results will be placed on.
+        result_queue : multiprocessing.Queue or ResultPipe
+            The queue (or anything else with a `put` method) that
+            messages about tasks and their results will be placed on.
+
+        segment_func : callable, optional
+            The function that tasks without their own function will be
+            run with, typically the bound `run_segment` method of a
+            runner. This is given to the worker only once when the
+            process is created so that it (and the runner it is bound
+            to) is not sent through the task queue with every task.
+
+        transport : SharedMemoryTransport, optional
+            If given, walkers in the task arguments are unpacked from
+            the transport and the resulting walkers are packed into
+            it instead of being sent through the queues.
+
+        segment_result_funcs : dict of str : callable, optional
+            Functions that are applied to each result of the segment
+            function in the worker right after it is run (e.g. the
+            progress of the boundary conditions for the new walker),
+            their values are sent back with the result. Like the
+            segment function these are only given to the worker when
+            the process is created.
+
+        task_claim : multiprocessing.Array, optional
+            Shared array of two ints the worker writes the id of each
+            task it takes off the queue to (before anything else), so
+            the mapper knows which task was lost if the worker dies
+            even when its started message never arrived.
+
+        finished_map_idx : multiprocessing.Value, optional
+            Shared index of the last mapping the mapper finished.
+            Tasks of it or earlier mappings which are still on the
+            queue (e.g. speculative copies of tasks) are skipped
+            without being run.
 
         """
 
@@ -47,11 +101,62 @@ class Worker(Process):
         self.task_queue = task_queue
         self.result_queue = result_queue
 
+        # the cached function for running segments
+        self._segment_func = segment_func
+
+        # the transport for walkers, if any
+        self._transport = transport
+
+        # the shared array the id of the current task is written to
+        self._task_claim = task_claim
+
+        # the shared index of the last finished mapping
+        self._finished_map_idx = finished_map_idx
+
+        # the cached functions to apply to the results of segments
+        if segment_result_funcs is None:
+            self._segment_result_funcs = {}
+        else:
+            self._segment_result_funcs = segment_result_funcs
+
+        # named times for parts of the task currently being run
+        self._task_split_times = {}
+
     @property
     def attributes(self):
         """Dictionary of attributes of the worker."""
         return self._attributes
 
+    @property
+    def segment_func(self):
+        """The function cached in this worker that tasks without their
+        own function are run with."""
+        return self._segment_func
+
+    @property
+    def segment_result_funcs(self):
+        """The functions cached in this worker that are applied to the
+        results of the segment function."""
+        return self._segment_result_funcs
+
+    @property
+    def transport(self):
+        """The transport walkers are sent through, or None if they are
+        sent through the queues."""
+        return self._transport
+
+    @property
+    def task_split_times(self):
+        """Dictionary of named times (in seconds) for parts of the task
+        currently being run.
+
+        This is reset before each task is run and may be filled in
+        `run_task` (e.g. by passing it to the segment function), it
+        is sent back with the result of the task.
+
+        """
+        return self._task_split_times
+
     def run_task(self, task):
         """Runs the given task and returns the results.
 
@@ -69,6 +174,37 @@ class Worker(Process):
 
         return task()
 
+    def apply_segment_result_funcs(self, result, split_times):
+        """Apply the segment result functions to the result of a call of
+        the segment function.
+
+        The time this takes is added to the split times as
+        'result_funcs'.
+
+        Parameters
+        ----------
+        result : object
+            The result of the segment function, i.e. a walker.
+
+        split_times : dict of str : float
+            The split times of the call.
+
+        Returns
+        -------
+        func_results : dict of str : value
+            The value of each function for the result.
+
+        """
+
+        start = time.time()
+
+        func_results = {key : func(result)
+                        for key, func in self.segment_result_funcs.items()}
+
+        split_times['result_funcs'] = time.time() - start
+
+        return func_results
+
     def run(self):
         """Overriding method for Process. Starts this process."""
 
@@ -81,6 +217,12 @@ class Worker(Process):
             # get the next task
             task_idx, next_task = self.task_queue.get()
 
+            # claim the task right away, unlike messages on the result
+            # queue this is seen by the mapper even if we die now
+            if self._task_claim is not None and next_task is not None:
+                with self._task_claim.get_lock():
+                    self._task_claim[0], self._task_claim[1] = task_idx
+
             # # check for the poison pill which is the signal to stop
             if next_task is None:
 
@@ -93,8 +235,48 @@ class Worker(Process):
                 # and exit the loop
                 break
 
-            logging.info('Worker: {}; task_idx : {}; args : {} '.format(
-                self.name, task_idx, next_task.args))
+            # the results of tasks from finished mappings would just
+            # be ignored, and with a transport their walkers may
+            # already be overwritten, so we don't run them
+            if self._finished_map_idx is not None and \
+               task_idx[0] <= self._finished_map_idx.value:
+
+                logging.info('Worker: {}; skipping task {} of a finished mapping'.format(
+                    self.name, task_idx))
+
+                self.task_queue.task_done()
+                continue
+
+            # never format the walkers in the arguments unless asked to
+            if isinstance(next_task, TaskBatch):
+                log_event('task_received', worker=self.name, task_idx=task_idx,
+                          n_calls=len(next_task.args_list))
+                log_payload('task_args', task_idx=task_idx, args=next_task.args_list)
+            else:
+                log_event('task_received', worker=self.name, task_idx=task_idx)
+                log_payload('task_args', task_idx=task_idx, args=next_task.args)
+
+            # tasks that were sent without a function are run with the
+            # segment function cached in this worker, only their
+            # results get the segment result functions applied
+            is_segment = next_task.func is None
+            if is_segment:
+                next_task.func = self.segment_func
+
+            # get the actual walkers for the arguments out of the
+            # transport
+            if self.transport is not None:
+                if isinstance(next_task, TaskBatch):
+                    next_task.args_list = [self.transport.unpack_args(args)
+                                           for args in next_task.args_list]
+                else:
+                    next_task.args = self.transport.unpack_args(next_task.args)
+
+            # let the mapper know which task this worker is running
+            self.result_queue.put((TASK_STARTED, task_idx, self.worker_idx, None))
+
+            # reset the split times for this task
+            self._task_split_times = {}
 
             # run the task
             start = time.time()
@@ -109,9 +291,71 @@ class Worker(Process):
             # enqued task is complete
             self.task_queue.task_done()
 
+            # batches of tasks are sent back with the times for each
+            # of their tasks
+            if isinstance(next_task, TaskBatch):
+                task_time = next_task.task_times
+                split_times = next_task.split_times
+            else:
+                split_times = self.task_split_times
+
+            # compute the values of the result functions here while
+            # we still have the walker, before it goes into the
+            # transport
+            func_results = None
+            if is_segment and len(self.segment_result_funcs) > 0:
+                if isinstance(next_task, TaskBatch):
+                    func_results = [self.apply_segment_result_funcs(result, call_split_times)
+                                    for result, call_split_times in zip(answer, split_times)]
+                else:
+                    func_results = self.apply_segment_result_funcs(answer, split_times)
+
+            # put the resulting walker into the transport so only its
+            # descriptor is sent back
+            if self.transport is not None:
+                if isinstance(next_task, TaskBatch):
+                    answer = [self.transport.pack_result(self.worker_idx, task_idx, result)
+                              for result in answer]
+                else:
+                    answer = self.transport.pack_result(self.worker_idx, task_idx, answer)
+
             # put the results into the results queue with it's task
             # index so we can sort them later
-            self.result_queue.put((task_idx, self.worker_idx, task_time, answer))
+            self.result_queue.put((TASK_COMPLETED, task_idx, self.worker_idx,
+                                   (task_time, split_times, answer, func_results)))
+
+
+class ResultPipe(object):
+    """The sending end of a pipe for the messages of a single worker,
+    with the `put` method of a queue.
+
+    Unlike with a multiprocessing.Queue shared by all the workers, the
+    messages are sent synchronously instead of by a feeder thread
+    holding a lock shared with the other workers. So a worker dying
+    (e.g. from a segfault) just after sending a message can't leave
+    that lock held and block all the other workers from sending
+    theirs.
+
+    """
+
+    def __init__(self, conn):
+        """Constructor for ResultPipe.
+
+        Parameters
+        ----------
+        conn : multiprocessing.connection.Connection
+            The sending end of the pipe.
+
+        """
+        self._conn = conn
+
+    def put(self, obj):
+        """Send a message."""
+        self._conn.send(obj)
+
+    def close(self):
+        """Close the sending end in this process."""
+        self._conn.close()
 
 
 class Task(object):
@@ -122,8 +366,9 @@ class Task(object):
 
         Parameters
         ----------
-        func : callable
-            Function to be called on the arguments.
+        func : callable or None
+            Function to be called on the arguments. If None the worker
+            running the task will use its cached segment function.
 
         *args
             The arguments to pass to func
@@ -138,3 +383,64 @@ class Task(object):
         # run the function passing in the args for running it and any
         # worker information in the kwargs
         return self.func(*self.args, **kwargs)
+
+
+class TaskBatch(object):
+    """Class that composes a function and the arguments for several calls
+    of it, which are run one after the other by a single worker."""
+
+    def __init__(self, func, args_list):
+        """Constructor for TaskBatch.
+
+        Parameters
+        ----------
+        func : callable or None
+            Function to be called on each of the arguments. If None
+            the worker running the batch will use its cached segment
+            function.
+
+        args_list : list of tuple
+            The arguments for each call of func.
+
+        """
+        self.args_list = args_list
+        self.func = func
+
+        # the run times and split times of each call, set when the
+        # batch is run
+        self.task_times = []
+        self.split_times = []
+
+    def __call__(self, **kwargs):
+        """Run the function on all of the arguments.
+
+        Any worker information in the kwargs is passed to each
+        call. If a dictionary of 'split_times' is given, each call is
+        given its own dictionary instead which are saved in the
+        `split_times` attribute.
+
+        Returns
+        -------
+        results : list
+            The result of each call.
+
+        """
+
+        collect_split_times = 'split_times' in kwargs
+
+        self.task_times = []
+        self.split_times = []
+
+        results = []
+        for args in self.args_list:
+
+            if collect_split_times:
+                kwargs['split_times'] = {}
+
+            start = time.time()
+            results.append(self.func(*args, **kwargs))
+            self.task_times.append(time.time() - start)
+
+            self.split_times.append(kwargs.get('split_times', {}))
+
+        return results